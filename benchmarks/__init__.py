@@ -0,0 +1,43 @@
+"""
+Standalone benchmarks.
+
+Every module sets up Django on its own and runs against a throwaway
+test database, e.g.:
+
+    python -m benchmarks.payloads
+"""
+import contextlib
+import os
+import time
+from typing import Callable
+
+import django
+
+
+def setup():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'junto.settings')
+    django.setup()
+
+
+@contextlib.contextmanager
+def test_database():
+    from django.db import connection
+    from django.test.utils import (setup_test_environment,
+                                   teardown_test_environment)
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def cpu_time(function: Callable, repeat: int) -> float:
+    """Average CPU time of a single call in microseconds"""
+    started = time.process_time()
+    for _ in range(repeat):
+        function()
+    return (time.process_time() - started) / repeat * 10 ** 6
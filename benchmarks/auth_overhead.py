@@ -0,0 +1,59 @@
+"""
+Auth overhead per request: resolving the user of an access token
+with a full jwt.decode and a user query every time, versus the cached
+verified claims and users.
+
+    python -m benchmarks.auth_overhead [--repeat N]
+"""
+import argparse
+
+from benchmarks import setup, test_database, cpu_time
+
+setup()
+
+import jwt  # noqa: E402
+from django.conf import settings  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from junto_api.auth import (AccessTokenAuthBackend, generate_tokens,  # noqa
+                            token_cache, user_cache)
+
+
+def authenticate_uncached(token: str):
+    """The way users were resolved before"""
+    payload = jwt.decode(token, key=settings.SECRET_KEY)
+    return User.objects.get(pk=payload.get('user_id'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=10000)
+    args = parser.parse_args()
+
+    with test_database():
+        user = User.objects.create_user(username='benchmark')
+        token = generate_tokens(user)['access']['token']
+        request = RequestFactory().get('/')
+        backend = AccessTokenAuthBackend()
+
+        timings = [
+            ('jwt.decode + query', lambda: authenticate_uncached(token)),
+            ('jwt.decode only',
+             lambda: jwt.decode(token, key=settings.SECRET_KEY)),
+            ('cached token only', lambda: token_cache.decode(token)),
+            ('cached token + query',
+             lambda: (token_cache.decode(token),
+                      User.objects.get(pk=user.id))),
+            ('cached token + user',
+             lambda: backend.authenticate(request, token=token)),
+        ]
+        print(f'{"":<24}{"µs per request":>16}')
+        for name, function in timings:
+            print(f'{name:<24}{cpu_time(function, args.repeat):>16.1f}')
+        print(f'token cache: {token_cache.stats()}')
+        print(f'user cache: {user_cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""
+Latency of order creation depending on order size:
+a query per dish versus a single lookup and a bulk insert.
+
+    python -m benchmarks.order_creation [--repeat N]
+
+The numbers are from the test database of the current settings, so run it
+against the production database engine to get meaningful absolute values.
+"""
+import argparse
+import statistics
+import time
+
+from benchmarks import setup, test_database
+
+setup()
+
+from django.db import connection, reset_queries  # noqa: E402
+from django.test.utils import CaptureQueriesContext  # noqa: E402
+
+from junto_api.models import Dish, DishOrder, Order, Restaurant, User  # noqa
+from junto_api.orders import create_order  # noqa: E402
+
+SIZES = (1, 5, 10, 30, 100)
+
+
+def create_order_per_dish(operator, restaurant, dish_ids):
+    """The way orders were created before"""
+    order = Order.objects.create(restaurant=restaurant, operator=operator)
+    order.save()
+    failed = []
+    for dish_id in dish_ids:
+        try:
+            dish = Dish.objects.get(pk=int(dish_id))
+            relation = DishOrder.objects.create(dish=dish, order=order,
+                                                current_price=dish.price)
+            relation.save()
+        except (Dish.DoesNotExist, ValueError):
+            failed.append(dish_id)
+    return order, failed
+
+
+def measure(function, operator, restaurant, dish_ids, repeat: int):
+    timings = []
+    reset_queries()
+    with CaptureQueriesContext(connection) as queries:
+        function(operator, restaurant, dish_ids)
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(operator, restaurant, dish_ids)
+        timings.append((time.perf_counter() - started) * 1000)
+    return len(queries), statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+
+    with test_database():
+        operator = User.objects.create_user(username='benchmark')
+        restaurant = Restaurant.objects.create(name='Ресторан', city='Москва')
+        dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                  for i in range(max(SIZES))]
+
+        print(f'{"items":>6}{"queries":>10}{"ms":>10}'
+              f'{"queries":>10}{"ms":>10}')
+        print(f'{"":>6}{"per dish":>20}{"bulk":>20}')
+        for size in SIZES:
+            dish_ids = [dish.id for dish in dishes[:size]]
+            row = [size]
+            for function in (create_order_per_dish, create_order):
+                row.extend(measure(function, operator, restaurant, dish_ids,
+                                   args.repeat))
+            print('{:>6}{:>10}{:>10.2f}{:>10}{:>10.2f}'.format(*row))
+
+
+if __name__ == '__main__':
+    main()
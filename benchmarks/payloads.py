@@ -0,0 +1,73 @@
+"""
+CPU time per request for /api/menu and /api/restaurants:
+JsonResponse encoding a dict on every call versus serving
+pre-rendered bytes of a snapshot.
+
+    python -m benchmarks.payloads [--categories N] [--repeat N]
+"""
+import argparse
+
+from benchmarks import setup, test_database, cpu_time
+
+setup()
+
+from django.http import JsonResponse  # noqa: E402
+from django.test import RequestFactory  # noqa: E402
+
+from junto_api.menu import build_menu, menu_snapshot  # noqa: E402
+from junto_api.models import Category, Dish, Restaurant  # noqa: E402
+from junto_api.restaurants import (build_restaurants,  # noqa: E402
+                                   restaurants_snapshot)
+from junto_api.snapshots import snapshot_response  # noqa: E402
+
+
+def populate(categories: int, dishes_per_category: int, restaurants: int):
+    for i in range(categories):
+        parent = Category.objects.create(name=f'Категория {i}')
+        child = Category.objects.create(name=f'Подкатегория {i}',
+                                        supercategory=parent)
+        for j in range(dishes_per_category):
+            dish = Dish.objects.create(name=f'Блюдо {i}.{j}', price=100 + j)
+            child.dishes.add(dish)
+    Restaurant.objects.bulk_create(
+        Restaurant(name=f'Ресторан {i}', city='Москва')
+        for i in range(restaurants))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--categories', type=int, default=100)
+    parser.add_argument('--dishes', type=int, default=10)
+    parser.add_argument('--restaurants', type=int, default=200)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    with test_database():
+        populate(args.categories, args.dishes, args.restaurants)
+        factory = RequestFactory()
+        plain = factory.get('/')
+        compressed = factory.get('/', HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+
+        for name, build, snapshots in [
+                ('menu', build_menu, menu_snapshot),
+                ('restaurants', build_restaurants, restaurants_snapshot)]:
+            data = build()
+            snapshot = snapshots.get()
+            print(f'{name}: {len(snapshot.body)} bytes, '
+                  f'{len(snapshot.content("gzip"))} bytes gzipped')
+
+            timings = [
+                ('JsonResponse(dict)',
+                 lambda: JsonResponse(data)),
+                ('snapshot, identity',
+                 lambda: snapshot_response(plain, snapshots.get())),
+                ('snapshot, compressed',
+                 lambda: snapshot_response(compressed, snapshots.get())),
+            ]
+            for label, function in timings:
+                print(f'  {label:<24}'
+                      f'{cpu_time(function, args.repeat):10.1f} µs/request')
+
+
+if __name__ == '__main__':
+    main()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/1.10/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -26,9 +27,69 @@ SECRET_KEY = os.environ['SECRET_KEY']
 # Access token's expiration time in seconds
 ACCESS_TOKEN_EXPIRATION_TIME = 24 * 60 * 60
 
+# Access tokens carry the active and staff flags of the user, so that
+# views decorated with claims_required don't load the user. Requires
+# snapshot versions shared between processes, see SNAPSHOT_REQUIRE_SHARED
+ACCESS_TOKEN_CLAIMS = False
+
 # Refresh token's expiration time in seconds
 REFRESH_TOKEN_EXPIRATION_TIME = 7 * 24 * 60 * 60
 
+# Directory (preferably on tmpfs) for menu and restaurant snapshots shared
+# between worker processes of the host. Set it to an empty string
+# to keep snapshots in a shared cache configured in CACHES instead
+SNAPSHOT_SHARED_DIRECTORY = os.environ.get(
+    'SNAPSHOT_SHARED_DIRECTORY',
+    os.path.join(tempfile.gettempdir(), 'junto-snapshots'))
+# Versions of cached menu, restaurants, references and users must be shared
+# between processes, so that an invalidation reaches every worker
+SNAPSHOT_REQUIRE_SHARED = True
+# Seconds after which versions kept in a cache private to the process
+# expire, so that other processes pick up invalidations at the latest
+SNAPSHOT_LOCAL_TTL = 60
+
+# Where responses for idempotency keys of order submissions are kept:
+# 'local' for process memory, 'cache' for the Django cache, which
+# collapses retries across workers when the cache is shared
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'cache')
+# Idempotency keys lifetime in seconds
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+# Max number of keys kept by the 'local' store
+IDEMPOTENCY_MAX_KEYS = 10000
+# How long a retry waits for the original request to finish, in seconds
+IDEMPOTENCY_LOCK_TIMEOUT = 30
+# Seconds after which the lock of a request that died expires. Must be
+# longer than any request may take, gunicorn kills a worker after 30
+IDEMPOTENCY_LOCK_TTL = 2 * 60
+# Refuse a store private to the process, which lets a retry handled
+# by another worker run again
+IDEMPOTENCY_REQUIRE_SHARED = True
+
+# Paid and cancelled orders older than that are moved to the archive
+# by the archive_orders command
+ORDER_RETENTION_DAYS = 180
+
+# Restaurants and dish prices used to create orders are cached in process
+# memory for that many seconds, unless they are changed earlier
+REFERENCE_CACHE_TTL = 5 * 60
+
+# Users resolved by access tokens are cached in process memory,
+# up to that many users for that many seconds. Changes reach other
+# processes earlier only when snapshot versions are shared
+USER_CACHE_MAX_SIZE = 10000
+USER_CACHE_TTL = 60
+# Max number of verified access tokens kept in process memory,
+# each of them until it expires
+TOKEN_CACHE_MAX_SIZE = 10000
+
+# Stale refresh tokens are deleted by the purge_refresh_tokens command.
+# With an interval in seconds it keeps running and purges periodically,
+# otherwise it purges once. Web workers never purge
+TOKEN_PURGE_INTERVAL = None
+# Tokens deleted by a single statement and seconds between the statements
+TOKEN_PURGE_BATCH_SIZE = 1000
+TOKEN_PURGE_PAUSE = 0.1
+
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = False
 HOST = os.environ['HOST']
@@ -93,6 +154,16 @@ DATABASES = {
 db_from_env = dj_database_url.config()
 DATABASES['default'].update(db_from_env)
 
+# Cache shared by all workers, idempotency keys of order submissions
+# are kept there. The table is created by `manage.py createcachetable`,
+# run by the release phase of the Procfile
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+        'LOCATION': 'junto_cache',
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
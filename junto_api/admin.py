@@ -1,5 +1,7 @@
-from django.contrib import admin
-from .models import Category, Dish, Restaurant, Order, DishOrder
+from django.contrib import admin, messages
+from .models import (Category, Dish, Restaurant, Order, DishOrder,
+                     ArchivedOrder, ArchivedDishOrder)
+from .orders import transition_orders, MAX_TRANSITION_SIZE
 from django.utils.html import linebreaks
 
 
@@ -36,15 +38,37 @@ class DishAdmin(admin.ModelAdmin):
     list_display = ['name', 'get_categories', 'price']
 
 
+def change_status(modeladmin, request, queryset, status: int):
+    changed, rejected = [], []
+    # Selected orders are handled in pages of MAX_TRANSITION_SIZE,
+    # the next page starts after the last order of the previous one
+    after = 0
+    while True:
+        page = transition_orders(queryset.filter(pk__gt=after), status)
+        changed += page[0]
+        rejected += page[1]
+        found = page[0] + page[1]
+        if len(found) < MAX_TRANSITION_SIZE:
+            break
+        after = max(found)
+    modeladmin.message_user(request, f'Изменено заказов: {len(changed)}')
+    if rejected:
+        modeladmin.message_user(request,
+                                f'Нельзя перевести в статус '
+                                f'«{dict(Order.STATUS_CHOICES)[status]}» '
+                                f'заказы: {", ".join(map(str, rejected))}',
+                                level=messages.WARNING)
+
+
 def make_paid(modeladmin, request, queryset):
-    queryset.update(status=Order.PAID)
+    change_status(modeladmin, request, queryset, Order.PAID)
 
 
 make_paid.short_description = "Отметить выделенные заказы как оплаченные"
 
 
 def make_cancelled(modeladmin, request, queryset):
-    queryset.update(status=Order.CANCELLED)
+    change_status(modeladmin, request, queryset, Order.CANCELLED)
 
 
 make_cancelled.short_description = "Отметить выделенные заказы как отменённые"
@@ -53,9 +77,9 @@ make_cancelled.short_description = "Отметить выделенные зак
 class OrderAdmin(admin.ModelAdmin):
     def get_dishes(self, obj):
         dishes = []
-        for dish in obj.dishes.all():
-            price = dish.dishorder_set.get(order=obj).current_price
-            dishes.append(f'{dish.name} ({price:.2f}₽)')
+        for item in obj.dishorder_set.select_related('dish'):
+            dishes.append(f'{item.dish.name} ({item.current_price:.2f}₽)'
+                          f' × {item.quantity}')
         
         return ''.join(linebreaks(dish) for dish in dishes)
     
@@ -64,6 +88,9 @@ class OrderAdmin(admin.ModelAdmin):
     
     list_display = ['created_at', 'restaurant', 'operator', 'get_dishes',
                     'status', 'total']
+    # Statuses are only changed by the actions, which keep revenue rollups
+    # in sync and allow nothing beyond Order.TRANSITIONS
+    readonly_fields = ['status']
     
     inlines = [
         DishOrderInline,
@@ -71,6 +98,28 @@ class OrderAdmin(admin.ModelAdmin):
     actions = [make_paid, make_cancelled]
 
 
+class ArchivedDishOrderInline(admin.TabularInline):
+    model = ArchivedDishOrder
+    extra = 0
+    readonly_fields = ('dish', 'current_price', 'quantity')
+    can_delete = False
+
+
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    """Archived orders are only moved here by the archive_orders command"""
+    list_display = ['id', 'created_at', 'restaurant', 'operator', 'status',
+                    'total', 'archived_at']
+    list_filter = ['status']
+    readonly_fields = ['operator', 'restaurant', 'status', 'total',
+                       'created_at', 'updated_at', 'archived_at']
+    inlines = [
+        ArchivedDishOrderInline,
+    ]
+    
+    def has_add_permission(self, request):
+        return False
+
+
 class OrderInline(admin.TabularInline):
     model = Order
     verbose_name = "заказ"
@@ -85,3 +134,4 @@ admin.site.register(Category, CategoryAdmin)
 admin.site.register(Dish, DishAdmin)
 admin.site.register(Restaurant, RestaurantAdmin)
 admin.site.register(Order, OrderAdmin)
+admin.site.register(ArchivedOrder, ArchivedOrderAdmin)
@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class JuntoApiConfig(AppConfig):
     name = 'junto_api'
+
+    def ready(self):
+        from . import checks, signals  # noqa: F401
@@ -0,0 +1,74 @@
+"""
+Archival of closed orders.
+
+Paid and cancelled orders older than the retention period are moved
+with their items from Order and DishOrder to ArchivedOrder and
+ArchivedDishOrder, keeping their ids. Every batch is copied and deleted
+in its own short transaction, so archival runs next to the live traffic,
+and an interrupted run is resumed by simply running it again.
+"""
+import datetime
+import time
+from typing import Iterator, Optional
+
+from django.db import transaction
+
+from .models import ArchivedDishOrder, ArchivedOrder, DishOrder, Order
+
+CLOSED = (Order.PAID, Order.CANCELLED)
+
+ORDER_FIELDS = ('id', 'operator_id', 'restaurant_id', 'status', 'total',
+                'created_at', 'updated_at')
+ITEM_FIELDS = ('order_id', 'dish_id', 'current_price', 'quantity')
+
+
+def archive_batch(before: datetime.datetime, batch_size: int) -> int:
+    """Archive up to `batch_size` oldest closed orders created before"""
+    with transaction.atomic():
+        # Locked orders can't be changed while they are being moved
+        ids = list(Order.objects.filter(status__in=CLOSED,
+                                        created_at__lt=before)
+                                .order_by('id')
+                                .select_for_update()
+                                .values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return 0
+
+        ArchivedOrder.objects.bulk_create(
+            ArchivedOrder(**order)
+            for order in Order.objects.filter(pk__in=ids)
+                                      .values(*ORDER_FIELDS))
+        ArchivedDishOrder.objects.bulk_create(
+            ArchivedDishOrder(**item)
+            for item in DishOrder.objects.filter(order_id__in=ids)
+                                         .values(*ITEM_FIELDS))
+        # Items are deleted without signals: they would update totals
+        # of the orders deleted right after, at least one query per batch
+        # on top of loading every item
+        DishOrder.objects.filter(order_id__in=ids)._raw_delete(
+            DishOrder.objects.db)
+        Order.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(before: datetime.datetime, batch_size: int = 1000,
+                   pause: float = 0,
+                   limit: Optional[int] = None) -> Iterator[int]:
+    """
+    Archive closed orders created before the given time in batches,
+    yielding the number of orders moved by every batch.
+
+    `pause` seconds between batches leave room for the other queries,
+    `limit` caps the number of orders archived by a single run.
+    """
+    archived = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size,
+                                                   limit - archived)
+        count = archive_batch(before, size)
+        if not count:
+            break
+        archived += count
+        yield count
+        if pause:
+            time.sleep(pause)
@@ -1,32 +1,38 @@
-from typing import Optional
+import copy
+import hashlib
+from typing import Optional, Union
 from django.conf import settings
 from django.contrib.auth.models import User
 import jwt
 from datetime import datetime, timedelta
 
-from django.core.exceptions import PermissionDenied
+from django.core.exceptions import ImproperlyConfigured, PermissionDenied
+from django.db import transaction
 from django.http import HttpRequest
 from django.http import JsonResponse
 from django.contrib.auth import authenticate
 
-from junto_api.models import RefreshToken
+from junto_api.lru import LRUCache
+from junto_api.models import DeniedUser, RefreshToken
+from junto_api.snapshots import default_backend
 
 
 def generate_access_token(user: User,
                           expires: datetime,
                           secret: str) -> str:
-    token = jwt.encode(
-        {
-            'user_id': user.id,
-            'exp': expires,
-        },
-        key=secret,
-        algorithm='HS256').decode()
+    payload = {
+        'user_id': user.id,
+        'exp': expires,
+    }
+    if settings.ACCESS_TOKEN_CLAIMS:
+        # Enough for the views decorated with claims_required
+        payload.update(active=user.is_active, staff=user.is_staff)
+    token = jwt.encode(payload, key=secret, algorithm='HS256').decode()
     
     return token
 
 
-def token_required(function):
+def _requires_token(function, resolve):
     def wrap(request: HttpRequest, *args, **kwargs):
         auth_header = request.META.get('HTTP_AUTHORIZATION')
         
@@ -34,7 +40,7 @@ def token_required(function):
             # Assuming that header looks like this: 'Bearer token'
             _, token, *_ = auth_header.split()
             
-            user = authenticate(request, token=token)
+            user = resolve(request, token)
             if user is not None:
                 request.user = user
                 return function(request, *args, **kwargs)
@@ -47,7 +53,22 @@ def token_required(function):
     return wrap
 
 
-def generate_tokens(user: User):
+def token_required(function):
+    return _requires_token(
+        function, lambda request, token: authenticate(request, token=token))
+
+
+def claims_required(function):
+    """
+    Same as token_required, for views that only need to know that
+    the caller is a valid user. With ACCESS_TOKEN_CLAIMS request.user
+    is a Principal built from the token claims.
+    """
+    return _requires_token(function, authenticate_claims)
+
+
+def generate_tokens(user: User, generation: int = 0):
+    """`generation` is the current generation of the user's refresh tokens"""
     now = datetime.utcnow()
     
     access_token_expires = now + timedelta(
@@ -61,8 +82,8 @@ def generate_tokens(user: User):
         seconds=settings.REFRESH_TOKEN_EXPIRATION_TIME)
     
     refresh_token = RefreshToken.create_token(user, refresh_token_expires,
-                                              settings.SECRET_KEY)
-    refresh_token.save()
+                                              settings.SECRET_KEY,
+                                              generation)
     
     return {
         'access': {
@@ -76,10 +97,105 @@ def generate_tokens(user: User):
     }
 
 
+class UserCache(object):
+    """
+    Users resolved by access tokens, kept in process memory.
+
+    Entries are tied to a version number kept in the snapshot backend,
+    which saving or deleting any user bumps once the change is committed.
+    Other processes see the bump only when that backend is shared
+    (SNAPSHOT_SHARED_DIRECTORY or a shared CACHES), which
+    SNAPSHOT_REQUIRE_SHARED enforces in production. With a per-process
+    backend a deactivated or deleted user stays cached by the other
+    processes for up to USER_CACHE_TTL seconds. User changes are rare
+    enough for the bumps to cost nothing in steady state.
+    """
+    def __init__(self, name: str = 'users'):
+        self.name = name
+        self._entries = None
+        self._backend = None
+
+    @property
+    def entries(self) -> LRUCache:
+        # Created lazily, since settings may not be configured on import
+        if self._entries is None:
+            self._entries = LRUCache(settings.USER_CACHE_MAX_SIZE,
+                                     settings.USER_CACHE_TTL)
+        return self._entries
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = default_backend(self.name)
+        return self._backend
+
+    def get(self, user_id: int) -> Optional[User]:
+        version = self.backend.version()
+        entry = self.entries.get(user_id)
+        if entry is not None and entry[0] == version:
+            # Every request gets its own copy to modify, including
+            # the model state and the cached relations
+            return copy.deepcopy(entry[1])
+
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        self.entries.set(user_id, (version, user))
+        return copy.deepcopy(user)
+
+    def invalidate(self, user_id: int):
+        self.entries.delete(user_id)
+        self.backend.bump()
+        transaction.on_commit(self.backend.bump)
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+
+user_cache = UserCache()
+
+
+class TokenCache(object):
+    """
+    Claims of tokens whose signature has already been verified,
+    keyed by a digest of the token, so that the token itself isn't kept.
+
+    An entry expires at the `exp` of its token, so a token is never
+    accepted for longer than it would be without the cache.
+    Tokens without `exp` aren't cached.
+    """
+    def __init__(self):
+        self._entries = None
+
+    @property
+    def entries(self) -> LRUCache:
+        if self._entries is None:
+            self._entries = LRUCache(settings.TOKEN_CACHE_MAX_SIZE)
+        return self._entries
+
+    def decode(self, token: str) -> dict:
+        """Same as jwt.decode with the secret key, raises the same errors"""
+        key = hashlib.sha256(token.encode()).digest()
+        payload = self.entries.get(key)
+        if payload is None:
+            payload = jwt.decode(token, key=settings.SECRET_KEY)
+            expires_at = payload.get('exp')
+            if isinstance(expires_at, (int, float)):
+                self.entries.set(key, payload, expires_at=expires_at)
+        return payload
+
+    def stats(self) -> dict:
+        return self.entries.stats()
+
+
+token_cache = TokenCache()
+
+
 class AccessTokenAuthBackend(object):
     def authenticate(self, request, token: str = None) -> Optional[User]:
         try:
-            payload = jwt.decode(token, key=settings.SECRET_KEY)
+            payload = token_cache.decode(token)
             user_id = payload.get('user_id')
             return self.get_user(user_id)
         except jwt.ExpiredSignatureError:
@@ -88,7 +204,133 @@ class AccessTokenAuthBackend(object):
             return None
 
     def get_user(self, user_id):
-        try:
-            return User.objects.get(pk=user_id)
-        except User.DoesNotExist:
-            return None
\ No newline at end of file
+        return user_cache.get(user_id)
+
+class Principal(object):
+    """
+    User described by the claims of an access token.
+
+    Only the id and the flags come from the token, any other attribute
+    loads the user, at most once per request.
+    """
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, user_id: int, is_active: bool, is_staff: bool):
+        self.id = self.pk = user_id
+        self.is_active = is_active
+        self._staff_claim = is_staff
+        self._user: Optional[User] = None
+
+    @property
+    def is_staff(self) -> bool:
+        # The staff claim may have been revoked since the token was issued,
+        # so it is confirmed by the user. Most users aren't staff and
+        # are answered by the claim alone
+        return self._staff_claim and self.user.is_staff
+
+    @property
+    def user(self) -> User:
+        if self._user is None:
+            self._user = user_cache.get(self.id)
+            if self._user is None:
+                raise User.DoesNotExist(f'User {self.id} does not exist')
+        return self._user
+
+    def __getattr__(self, name: str):
+        # Only called for attributes that aren't set in __init__
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.user, name)
+
+    def __str__(self):
+        return f'user #{self.id}'
+
+
+class Denylist(object):
+    """
+    Ids of deactivated and deleted users, whose tokens are rejected
+    without loading them.
+
+    The ids are kept in the DeniedUser table, shared by all processes,
+    and copied to process memory. The copy is reloaded when the version
+    of the denylist is bumped, which happens only when a user is denied
+    or allowed again, not on every save of a user. Entries are purged
+    along with stale refresh tokens once every access token issued
+    before the denial has expired.
+    """
+    def __init__(self, name: str = 'denylist', backend=None):
+        self.name = name
+        self._backend = backend
+        self._local = None
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = default_backend(self.name)
+        return self._backend
+
+    def __contains__(self, user_id: int) -> bool:
+        version = self.backend.version()
+        if self._local is None or self._local[0] != version:
+            ids = DeniedUser.objects.values_list('user_id', flat=True)
+            self._local = (version, frozenset(ids))
+        return user_id in self._local[1]
+
+    def invalidate(self):
+        # Same as for UserCache: a copy loaded from the uncommitted state
+        # is thrown away by the second bump after commit
+        self.backend.bump()
+        transaction.on_commit(self.backend.bump)
+
+    def deny(self, user_id: int):
+        _, created = DeniedUser.objects.get_or_create(user_id=user_id)
+        if created:
+            self.invalidate()
+
+    def allow(self, user_id: int):
+        deleted, _ = DeniedUser.objects.filter(user_id=user_id).delete()
+        if deleted:
+            self.invalidate()
+
+    def prune(self, before: datetime) -> int:
+        """
+        Deletes the entries denied before the given time. The copies are
+        reloaded too, or a user allowed again after the pruning would stay
+        denied by them.
+        """
+        deleted, _ = DeniedUser.objects.filter(denied_at__lte=before).delete()
+        if deleted:
+            self.invalidate()
+        return deleted
+
+
+denylist = Denylist()
+
+
+def authenticate_claims(request: HttpRequest,
+                        token: str) -> Optional[Union[Principal, User]]:
+    """
+    Principal of a token with claims, checked against the denylist.
+    Tokens issued without claims resolve to users as usual.
+    Refuses to run unless the version of the denylist is shared.
+    """
+    if not settings.ACCESS_TOKEN_CLAIMS:
+        return authenticate(request, token=token)
+    if not denylist.backend.shared:
+        # Other workers would keep accepting a deactivated user
+        raise ImproperlyConfigured(
+            'ACCESS_TOKEN_CLAIMS requires versions shared between '
+            'processes: set SNAPSHOT_SHARED_DIRECTORY or configure '
+            'a shared default cache in CACHES')
+    try:
+        payload = token_cache.decode(token)
+    except (jwt.ExpiredSignatureError, jwt.DecodeError):
+        return None
+    if 'active' not in payload:
+        return authenticate(request, token=token)
+    
+    user_id = payload.get('user_id')
+    if not payload['active'] or user_id in denylist:
+        return None
+    return Principal(user_id, True, bool(payload.get('staff')))
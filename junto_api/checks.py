@@ -0,0 +1,44 @@
+from django.conf import settings
+from django.core.checks import Error, Tags, register
+from django.core.exceptions import ImproperlyConfigured
+
+from .idempotency import get_store
+from .snapshots import default_backend
+
+
+@register(Tags.caches)
+def check_shared_versions(app_configs, **kwargs):
+    """Fail on deploy rather than on the first request"""
+    try:
+        default_backend('menu')
+    except ImproperlyConfigured as e:
+        return [Error(str(e), id='junto_api.E001')]
+    return []
+
+
+@register(Tags.caches)
+def check_access_token_claims(app_configs, **kwargs):
+    """Claims are only safe while the denylist is invalidated everywhere"""
+    if not settings.ACCESS_TOKEN_CLAIMS:
+        return []
+    try:
+        shared = default_backend('denylist').shared
+    except ImproperlyConfigured:
+        # Reported by check_shared_versions
+        return []
+    if shared:
+        return []
+    return [Error('ACCESS_TOKEN_CLAIMS requires versions shared between '
+                  'processes', hint='Set SNAPSHOT_SHARED_DIRECTORY or '
+                  'configure a shared default cache in CACHES',
+                  id='junto_api.E002')]
+
+
+@register(Tags.caches)
+def check_idempotency_store(app_configs, **kwargs):
+    """A retry on another worker must see the key of the first request"""
+    try:
+        get_store()
+    except ImproperlyConfigured as e:
+        return [Error(str(e), id='junto_api.E003')]
+    return []
@@ -0,0 +1,99 @@
+"""
+Export of orders with their items as NDJSON or CSV.
+
+Orders and their items are read by two queries sorted by order id,
+both iterated through server-side cursors, and merged on the fly.
+Nothing but the current order is held in memory, whatever the number
+of exported orders, so the output can be streamed as it's produced.
+"""
+import csv
+import datetime
+import json
+from decimal import Decimal
+from typing import Any, Iterator, List, Tuple
+
+from django.db.models import Q
+
+from .models import DishOrder, Order
+
+ORDER_COLUMNS = ('id', 'created_at', 'updated_at', 'status', 'operator_id',
+                 'restaurant_id', 'restaurant_name', 'restaurant_city',
+                 'total')
+ITEM_COLUMNS = ('dish_id', 'dish_name', 'price', 'quantity')
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+def _value(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+
+def _row(values: tuple) -> tuple:
+    return tuple(_value(value) for value in values)
+
+
+def export_orders(filters: Q) -> Iterator[Tuple[tuple, List[tuple]]]:
+    """Orders matching the filters along with their items, by order id"""
+    orders = (Order.objects.filter(filters)
+                           .order_by('id')
+                           .values_list('id', 'created_at', 'updated_at',
+                                        'status', 'operator_id',
+                                        'restaurant_id', 'restaurant__name',
+                                        'restaurant__city', 'total')
+                           .iterator())
+    items = (DishOrder.objects.filter(order__in=Order.objects.filter(filters))
+                              .order_by('order_id', 'id')
+                              .values_list('order_id', 'dish_id', 'dish__name',
+                                           'current_price', 'quantity')
+                              .iterator())
+
+    item = next(items, None)
+    for order in orders:
+        order_items = []
+        # Items of orders created after the orders query had started
+        # are skipped, they'd be exported without their orders otherwise
+        while item is not None and item[0] <= order[0]:
+            if item[0] == order[0]:
+                order_items.append(_row(item[1:]))
+            item = next(items, None)
+        yield _row(order), order_items
+
+
+def to_ndjson(orders: Iterator[Tuple[tuple, List[tuple]]]) -> Iterator[str]:
+    """A JSON object per line for every order, items are nested in it"""
+    for order, items in orders:
+        data = dict(zip(ORDER_COLUMNS, order))
+        data['items'] = [dict(zip(ITEM_COLUMNS, item)) for item in items]
+        yield json.dumps(data, ensure_ascii=False) + '\n'
+
+
+class _Echo(object):
+    """File-like object that returns what is written instead of storing it"""
+    def write(self, value: str) -> str:
+        return value
+
+
+def to_csv(orders: Iterator[Tuple[tuple, List[tuple]]]) -> Iterator[str]:
+    """
+    A row for every item, repeating columns of its order.
+    Orders without items get a single row with empty item columns.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(ORDER_COLUMNS + ITEM_COLUMNS)
+    empty = ('',) * len(ITEM_COLUMNS)
+    for order, items in orders:
+        for item in items or [empty]:
+            yield writer.writerow(order + item)
+
+
+def export(filters: Q, format: str) -> Iterator[str]:
+    """Lines of the export in one of FORMATS"""
+    serialize = to_ndjson if format == 'ndjson' else to_csv
+    return serialize(export_orders(filters))
@@ -0,0 +1,42 @@
+"""
+Parsing of the `fields` query parameter for sparse fieldsets.
+
+`fields=id,name` selects attributes of the top level objects,
+`fields=name,dishes.price` also selects attributes of a nested collection.
+A nested collection named without attributes gets all of them.
+"""
+from typing import Dict, Optional, Sequence, Set, Tuple
+
+
+def parse_fields(value: Optional[str],
+                 fields: Sequence[str],
+                 nested: Optional[Dict[str, Sequence[str]]] = None
+                 ) -> Tuple[Set[str], Dict[str, Set[str]]]:
+    """
+    Return selected fields of the top level objects
+    and of every nested collection.
+
+    Everything is selected when `value` is None.
+    Raises ValueError on unknown fields.
+    """
+    nested = nested or {}
+    if value is None:
+        return set(fields), {name: set(nested_fields)
+                             for name, nested_fields in nested.items()}
+
+    selected = set()
+    selected_nested = {name: set() for name in nested}
+    for field in filter(None, (item.strip() for item in value.split(','))):
+        name, _, attribute = field.partition('.')
+        if name not in fields:
+            raise ValueError(f'Unknown field {name}')
+        selected.add(name)
+        if attribute:
+            if name not in nested or attribute not in nested[name]:
+                raise ValueError(f'Unknown field {field}')
+            selected_nested[name].add(attribute)
+
+    for name, attributes in selected_nested.items():
+        if name in selected and not attributes:
+            attributes.update(nested[name])
+    return selected, selected_nested
@@ -0,0 +1,67 @@
+"""
+Materialized paths of categories.
+
+The path of a category lists ids of all its ancestors and the category
+itself, e.g. '/1/5/12/', so that the whole subtree can be selected
+with a single indexed prefix lookup.
+"""
+from collections import defaultdict
+from typing import Dict, Optional
+
+from django.db import transaction
+
+
+def category_path(parent_path: Optional[str], category_id: int) -> str:
+    return f'{parent_path or "/"}{category_id}/'
+
+
+def path_depth(path: str) -> int:
+    return path.count('/') - 2
+
+
+def compute_paths(parents: Dict[int, Optional[int]]) -> Dict[int, str]:
+    """
+    Paths of all categories reachable from the top level,
+    given a mapping of category ids to their supercategory ids
+    """
+    children = defaultdict(list)
+    for category_id, parent_id in parents.items():
+        children[parent_id].append(category_id)
+
+    paths = {}
+    stack = [(category_id, None) for category_id in children[None]]
+    while stack:
+        category_id, parent_path = stack.pop()
+        path = category_path(parent_path, category_id)
+        paths[category_id] = path
+        stack.extend((child_id, path) for child_id in children[category_id])
+    return paths
+
+
+def rebuild_paths(model) -> dict:
+    """
+    Recompute paths of all categories from scratch.
+
+    Takes the model as an argument, so that migrations can pass
+    the historical one.
+    """
+    manager = model._base_manager
+    with transaction.atomic():
+        rows = list(manager.select_for_update()
+                           .values_list('id', 'supercategory_id', 'path'))
+        paths = compute_paths({category_id: parent_id
+                               for category_id, parent_id, _ in rows})
+        updated = 0
+        for category_id, _, old_path in rows:
+            path = paths.get(category_id)
+            if path is not None and path != old_path:
+                manager.filter(pk=category_id).update(path=path,
+                                                      depth=path_depth(path))
+                updated += 1
+
+    return {
+        'total': len(rows),
+        'updated': updated,
+        # Categories caught in a cycle of supercategories
+        'unreachable': len(rows) - len(paths)
+    }
@@ -0,0 +1,179 @@
+"""
+Idempotency keys for write endpoints.
+
+A client sends a unique `Idempotency-Key` header with a request
+and reuses it for retries. The first response for the key is stored
+and replayed for the retries, so the request is executed only once.
+Concurrent requests with the same key wait for the first one to finish.
+"""
+import contextlib
+import functools
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpRequest, HttpResponse, JsonResponse
+
+from .lru import LRUCache
+from .snapshots import LOCAL_CACHES
+
+
+class RequestInProgress(Exception):
+    pass
+
+
+class LocalIdempotencyStore(object):
+    """
+    Bounded store in process memory.
+
+    Only collapses concurrent requests handled by the same process,
+    use the cache store when requests are spread over several workers.
+    """
+    shared = False
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.responses = LRUCache(maxsize, ttl)
+        self._locks = {}
+        self._guard = threading.Lock()
+
+    def get(self, key: str):
+        return self.responses.get(key)
+
+    def set(self, key: str, entry: dict):
+        self.responses.set(key, entry)
+
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: float):
+        with self._guard:
+            lock, waiting = self._locks.get(key, (threading.Lock(), 0))
+            self._locks[key] = (lock, waiting + 1)
+        try:
+            if not lock.acquire(timeout=timeout):
+                raise RequestInProgress()
+            try:
+                yield
+            finally:
+                lock.release()
+        finally:
+            with self._guard:
+                lock, waiting = self._locks[key]
+                if waiting == 1:
+                    del self._locks[key]
+                else:
+                    self._locks[key] = (lock, waiting - 1)
+
+
+class CacheIdempotencyStore(object):
+    """Store in the Django cache, shared by all processes using it"""
+    def __init__(self, ttl: float, lock_ttl: float):
+        self.ttl = ttl
+        self.lock_ttl = lock_ttl
+
+    @property
+    def shared(self) -> bool:
+        return type(caches['default']).__name__ not in LOCAL_CACHES
+
+    def get(self, key: str):
+        return cache.get(f'idempotency:{key}')
+
+    def set(self, key: str, entry: dict):
+        cache.set(f'idempotency:{key}', entry, self.ttl)
+
+    @contextlib.contextmanager
+    def lock(self, key: str, timeout: float):
+        lock_key = f'idempotency:{key}:lock'
+        # Every holder has its own token, so that a holder whose lock has
+        # expired doesn't release the lock of the next one
+        token = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        # The lock expires by itself if its holder dies. It outlives
+        # the slowest request, so it doesn't expire under a live holder
+        while not cache.add(lock_key, token, self.lock_ttl):
+            if time.time() > deadline:
+                raise RequestInProgress()
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+
+_store = None
+
+
+def get_store():
+    """
+    The store configured by IDEMPOTENCY_STORE. With
+    IDEMPOTENCY_REQUIRE_SHARED a store private to the process is refused,
+    since a retry handled by another worker would be executed again.
+    """
+    global _store
+    if _store is None:
+        if settings.IDEMPOTENCY_STORE == 'cache':
+            store = CacheIdempotencyStore(settings.IDEMPOTENCY_KEY_TTL,
+                                          settings.IDEMPOTENCY_LOCK_TTL)
+        else:
+            store = LocalIdempotencyStore(settings.IDEMPOTENCY_MAX_KEYS,
+                                          settings.IDEMPOTENCY_KEY_TTL)
+        if settings.IDEMPOTENCY_REQUIRE_SHARED and not store.shared:
+            raise ImproperlyConfigured(
+                'Idempotency keys are not shared between processes: set '
+                "IDEMPOTENCY_STORE to 'cache' and configure a shared "
+                'default cache in CACHES')
+        _store = store
+    return _store
+
+
+def idempotent(function):
+    """
+    Make a view replay its first response for every Idempotency-Key.
+
+    Keys are scoped by user and path. Reusing a key for a request
+    with a different body is rejected. Server errors aren't stored,
+    so that such requests can be retried.
+    """
+    @functools.wraps(function)
+    def wrap(request: HttpRequest, *args, **kwargs):
+        idempotency_key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+        if idempotency_key is None:
+            return function(request, *args, **kwargs)
+
+        key = hashlib.sha256(f'{request.user.id}:{request.path}:'
+                             f'{idempotency_key}'.encode()).hexdigest()
+        fingerprint = hashlib.sha256(request.body).hexdigest()
+        store = get_store()
+        try:
+            with store.lock(key, timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT):
+                entry = store.get(key)
+                if entry is None:
+                    response = function(request, *args, **kwargs)
+                    if response.status_code >= 500:
+                        return response
+                    entry = {
+                        'fingerprint': fingerprint,
+                        'status': response.status_code,
+                        'content': response.content,
+                        'content_type': response['Content-Type']
+                    }
+                    store.set(key, entry)
+                    return response
+        except RequestInProgress:
+            return JsonResponse({'error': 'A request with this idempotency '
+                                          'key is still in progress'},
+                                status=409)
+
+        if entry['fingerprint'] != fingerprint:
+            return JsonResponse({'error': 'Idempotency key has already been '
+                                          'used for a different request'},
+                                status=422)
+        response = HttpResponse(entry['content'], status=entry['status'],
+                                content_type=entry['content_type'])
+        response['Idempotent-Replayed'] = 'true'
+        return response
+
+    return wrap
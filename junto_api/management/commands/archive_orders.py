@@ -0,0 +1,34 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from junto_api.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Move closed orders older than the retention period to the '
+            'archive. Safe to interrupt, the next run continues the work.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            default=settings.ORDER_RETENTION_DAYS,
+                            help='archive orders created that many days ago '
+                                 'or earlier')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='orders moved in a single transaction')
+        parser.add_argument('--pause', type=float, default=0,
+                            help='seconds to wait between batches')
+        parser.add_argument('--limit', type=int,
+                            help='stop after archiving that many orders')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - datetime.timedelta(days=options['days'])
+        archived = 0
+        for count in archive_orders(before, options['batch_size'],
+                                    pause=options['pause'],
+                                    limit=options['limit']):
+            archived += count
+            self.stdout.write(f'Archived {archived} orders')
+        self.stdout.write(f'Done, {archived} orders archived in total')
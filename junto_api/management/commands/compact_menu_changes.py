@@ -0,0 +1,23 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from junto_api.menu import compact_changes
+
+
+class Command(BaseCommand):
+    help = ('Compact the menu change log used by /api/menu/changes. '
+            'Meant to be run periodically, e.g. by a scheduler.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--keep-days', type=int, default=30,
+                            help='Keep deletions recorded within that many '
+                                 'days, so that clients which synced '
+                                 'recently can still get them incrementally')
+
+    def handle(self, *args, **options):
+        keep_since = timezone.now() - datetime.timedelta(
+            days=options['keep_days'])
+        removed = compact_changes(keep_since)
+        self.stdout.write(f'Removed {removed} menu change log entries')
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from junto_api.exports import export, FORMATS
+from junto_api.order_history import parse_filters
+
+
+class Command(BaseCommand):
+    help = ('Export orders with their items as NDJSON or CSV. '
+            'Use --since with the time of the previous run '
+            'for incremental exports.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='ndjson')
+        parser.add_argument('--since',
+                            help='export orders created at or after '
+                                 'that ISO 8601 datetime')
+        parser.add_argument('--until',
+                            help='export orders created before '
+                                 'that ISO 8601 datetime')
+        parser.add_argument('--output',
+                            help='file to write to instead of stdout')
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_filters({param: options[param]
+                                     for param in ('since', 'until')
+                                     if options[param] is not None})
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        lines = export(filters, options['format'])
+        if options['output'] is None:
+            for line in lines:
+                self.stdout.write(line, ending='')
+        else:
+            with open(options['output'], 'w', newline='') as output:
+                output.writelines(lines)
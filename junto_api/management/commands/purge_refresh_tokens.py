@@ -0,0 +1,52 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from junto_api.token_purge import purge_denylist, purge_tokens, record_run
+
+
+class Command(BaseCommand):
+    help = ('Delete revoked and expired refresh tokens, tokens of '
+            'previous generations and expired denylist entries. Safe to '
+            'interrupt, the next run continues the work.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int,
+                            default=settings.TOKEN_PURGE_BATCH_SIZE,
+                            help='tokens deleted by a single statement')
+        parser.add_argument('--pause', type=float,
+                            default=settings.TOKEN_PURGE_PAUSE,
+                            help='seconds to wait between batches')
+        parser.add_argument('--limit', type=int,
+                            help='stop after deleting that many tokens')
+        parser.add_argument('--interval', type=float,
+                            default=settings.TOKEN_PURGE_INTERVAL,
+                            help='keep running and purge every that many '
+                                 'seconds, instead of purging once')
+
+    def handle(self, *args, **options):
+        while True:
+            self.purge(options)
+            if not options['interval']:
+                break
+            # The connection shouldn't stay open between the runs
+            connection.close()
+            time.sleep(options['interval'])
+
+    def purge(self, options: dict):
+        now = timezone.now()
+        started = time.monotonic()
+        deleted = 0
+        for count in purge_tokens(now, options['batch_size'],
+                                  pause=options['pause'],
+                                  limit=options['limit']):
+            deleted += count
+            self.stdout.write(f'Deleted {deleted} tokens')
+        purge_denylist(now)
+        seconds = time.monotonic() - started
+        record_run(now, deleted, seconds)
+        self.stdout.write(f'Done, {deleted} tokens deleted in total '
+                          f'in {seconds:.2f} s')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from junto_api.hierarchy import rebuild_paths
+from junto_api.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recompute materialized paths of all categories from scratch'
+
+    def handle(self, *args, **options):
+        result = rebuild_paths(Category)
+        self.stdout.write(f'Updated {result["updated"]} '
+                          f'of {result["total"]} categories')
+        if result['unreachable']:
+            self.stderr.write(f'{result["unreachable"]} categories are not '
+                              f'reachable from the top level, check their '
+                              f'supercategories for cycles')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+
+from junto_api.revenue import rebuild
+
+
+class Command(BaseCommand):
+    help = ('Recompute daily revenue rollups from scratch. Run it to fill '
+            'them for existing orders or after orders were edited by hand.')
+
+    def handle(self, *args, **options):
+        restaurants, dishes = rebuild()
+        self.stdout.write(f'Built {restaurants} restaurant '
+                          f'and {dishes} dish rollups')
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from junto_api.models import Order
+from junto_api.orders import total_drift
+
+
+class Command(BaseCommand):
+    help = 'Find orders whose stored total differs from their items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='recompute the totals that drifted')
+
+    def handle(self, *args, **options):
+        drift = total_drift()
+        for order_id, total, actual in drift:
+            self.stdout.write(f'Order #{order_id}: stored {total}, '
+                              f'actual {actual}')
+        if not drift:
+            self.stdout.write('All order totals are correct')
+        elif options['fix']:
+            with transaction.atomic():
+                ids = [order_id for order_id, _, _ in drift]
+                updated = Order.objects.filter(pk__in=ids).update_totals()
+            self.stdout.write(f'Fixed {updated} orders')
+        else:
+            self.stderr.write(f'{len(drift)} orders have a wrong total, '
+                              f'run with --fix to repair them')
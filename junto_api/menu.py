@@ -0,0 +1,281 @@
+import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+from django.db import transaction
+from django.db.models import Count, Max
+
+from .models import Category, Dish, MenuChange, MenuLogLock
+from .snapshots import SnapshotCache
+
+
+CATEGORY_FIELDS = ('name', 'dishes', 'subcategories')
+
+
+def _category_node(name: str, fields: Iterable[str]) -> dict:
+    node = {}
+    if 'name' in fields:
+        node['name'] = name
+    if 'dishes' in fields:
+        node['dishes'] = {
+            'count': 0,
+            'items': []
+        }
+    if 'subcategories' in fields:
+        node['subcategories'] = {
+            'count': 0,
+            'items': []
+        }
+    return node
+
+
+def _collection(items: list) -> dict:
+    return {
+        'count': len(items),
+        'items': items
+    }
+
+
+def build_menu(root: Optional[Category] = None,
+               max_depth: Optional[int] = None,
+               category_fields: Iterable[str] = CATEGORY_FIELDS,
+               dish_fields: Iterable[str] = Dish.FIELDS) -> dict:
+    """
+    Build the menu tree in a constant number of queries.
+
+    Categories, dishes and the category-dish relation are loaded
+    with one query each and then assembled in memory,
+    so the number of queries doesn't depend on the size of the menu.
+
+    The tree can be limited to the subtree of `root`
+    and to `max_depth` levels of categories. Subcategories of the
+    deepest categories are then replaced with their count and a cursor,
+    which is passed back as `root` to expand them.
+
+    Fields that aren't requested are not loaded from the database:
+    without dishes the dish tables aren't queried at all,
+    without subcategories only the top level is.
+    """
+    with_dishes = 'dishes' in category_fields
+    with_subcategories = 'subcategories' in category_fields
+    if not with_subcategories:
+        max_depth = 1
+
+    categories = Category.objects.order_by('id')
+    if root is not None:
+        categories = categories.filter(path__startswith=root.path)
+    if max_depth is not None:
+        base_depth = root.depth if root is not None else 0
+        categories = categories.filter(depth__lt=base_depth + max_depth)
+
+    nodes: Dict[int, dict] = {}
+    parents: Dict[int, int] = {}
+    depths: Dict[int, int] = {}
+    columns = ['id', 'supercategory_id', 'depth']
+    if 'name' in category_fields:
+        columns.append('name')
+    for row in categories.values(*columns):
+        category_id = row['id']
+        nodes[category_id] = _category_node(row.get('name'), category_fields)
+        parents[category_id] = row['supercategory_id']
+        depths[category_id] = row['depth']
+
+    if with_dishes:
+        links = Dish.categories.through.objects.order_by('dish_id')
+        dishes = Dish.objects.order_by('id').only('id', *dish_fields)
+        if root is not None or max_depth is not None:
+            links = links.filter(category_id__in=categories.values('id'))
+            dishes = dishes.filter(id__in=links.values('dish_id'))
+
+        dishes = {dish.id: dish.serialize(dish_fields) for dish in dishes}
+        for category_id, dish_id in links.values_list('category_id',
+                                                      'dish_id'):
+            nodes[category_id]['dishes']['items'].append(dishes[dish_id])
+
+    top_level: List[dict] = []
+    for category_id, node in nodes.items():
+        supercategory_id = parents[category_id]
+        if root is not None:
+            is_top_level = category_id == root.id
+        else:
+            is_top_level = supercategory_id is None
+
+        if is_top_level:
+            top_level.append(node)
+        elif with_subcategories:
+            nodes[supercategory_id]['subcategories']['items'].append(node)
+
+    for node in nodes.values():
+        for collection in ('dishes', 'subcategories'):
+            if collection in node:
+                node[collection]['count'] = len(node[collection]['items'])
+
+    if with_subcategories and max_depth is not None:
+        _cut_off(nodes, [category_id for category_id, depth in depths.items()
+                         if depth == base_depth + max_depth - 1])
+
+    return {
+        'categories': _collection(top_level)
+    }
+
+
+def _cut_off(nodes: Dict[int, dict], category_ids: List[int]):
+    """Replace subcategories of the given categories with expansion cursors"""
+    counts = (Category.objects.filter(supercategory_id__in=category_ids)
+                              .values('supercategory_id')
+                              .annotate(count=Count('id'))
+                              .order_by())
+    counts = {row['supercategory_id']: row['count'] for row in counts}
+    for category_id in category_ids:
+        count = counts.get(category_id, 0)
+        nodes[category_id]['subcategories'] = {'count': count}
+        if count:
+            nodes[category_id]['subcategories']['cursor'] = str(category_id)
+
+
+menu_snapshot = SnapshotCache('menu', build_menu)
+
+
+def record_changes(kind: str, ids: Iterable[int],
+                   action: int = MenuChange.UPDATED):
+    ids = set(ids)
+    if not ids:
+        return
+    with transaction.atomic():
+        MenuLogLock.acquire()
+        MenuChange.objects.bulk_create(
+            MenuChange(kind=kind, object_id=object_id, action=action)
+            for object_id in ids)
+
+
+def current_version() -> int:
+    return MenuChange.objects.aggregate(version=Max('id'))['version'] or 0
+
+
+def history_horizon() -> int:
+    """Changes with ids up to the horizon may be missing from the log"""
+    horizon = (MenuChange.objects.filter(action=MenuChange.COMPACTED)
+                                 .aggregate(horizon=Max('object_id')))
+    return horizon['horizon'] or 0
+
+
+def _flat_menu(category_ids: Optional[Iterable[int]] = None,
+               dish_ids: Optional[Iterable[int]] = None) -> dict:
+    """
+    Categories and dishes as flat lists with references by id.
+    Loads everything when no ids are given.
+    """
+    categories = Category.objects.order_by('id')
+    dishes = Dish.objects.order_by('id')
+    links = Dish.categories.through.objects.order_by('category_id')
+    if category_ids is not None:
+        categories = categories.filter(id__in=category_ids)
+    if dish_ids is not None:
+        dishes = dishes.filter(id__in=dish_ids)
+        links = links.filter(dish_id__in=dish_ids)
+
+    dish_categories = defaultdict(list)
+    for category_id, dish_id in links.values_list('category_id', 'dish_id'):
+        dish_categories[dish_id].append(category_id)
+
+    return {
+        'categories': [
+            {
+                'id': category_id,
+                'name': name,
+                'supercategory_id': supercategory_id
+            }
+            for category_id, name, supercategory_id
+            in categories.values_list('id', 'name', 'supercategory_id')
+        ],
+        'dishes': [
+            dict(dish.serialize(), category_ids=dish_categories[dish.id])
+            for dish in dishes
+        ]
+    }
+
+
+def build_changes(since: int) -> dict:
+    """
+    Categories and dishes changed or removed after version `since`.
+
+    Falls back to the full menu when the log doesn't reach back
+    that far, which the client can tell by `full` being true.
+    """
+    version = current_version()
+    if since < history_horizon() or since > version:
+        menu = _flat_menu()
+        return {
+            'version': version,
+            'full': True,
+            'categories': {'changed': menu['categories'], 'removed': []},
+            'dishes': {'changed': menu['dishes'], 'removed': []}
+        }
+
+    # Only the latest change of every object matters
+    latest = {}
+    changes = (MenuChange.objects.filter(id__gt=since, id__lte=version)
+                                 .exclude(action=MenuChange.COMPACTED)
+                                 .order_by('id')
+                                 .values_list('kind', 'object_id', 'action'))
+    for kind, object_id, action in changes:
+        latest[kind, object_id] = action
+
+    changed = defaultdict(set)
+    removed = defaultdict(set)
+    for (kind, object_id), action in latest.items():
+        if action == MenuChange.DELETED:
+            removed[kind].add(object_id)
+        else:
+            changed[kind].add(object_id)
+
+    menu = _flat_menu(changed[MenuChange.CATEGORY], changed[MenuChange.DISH])
+    # Objects deleted without a trace in the log are reported as removed
+    for kind, items in [(MenuChange.CATEGORY, menu['categories']),
+                        (MenuChange.DISH, menu['dishes'])]:
+        removed[kind] |= changed[kind] - {item['id'] for item in items}
+
+    return {
+        'version': version,
+        'full': False,
+        'categories': {
+            'changed': menu['categories'],
+            'removed': sorted(removed[MenuChange.CATEGORY])
+        },
+        'dishes': {
+            'changed': menu['dishes'],
+            'removed': sorted(removed[MenuChange.DISH])
+        }
+    }
+
+
+def compact_changes(keep_since: datetime.datetime) -> int:
+    """
+    Remove log entries superseded by later changes of the same object,
+    along with deletions recorded before `keep_since`.
+
+    Clients that synced before the latest removed deletion
+    get the full menu on their next sync.
+    Returns the number of removed entries.
+    """
+    with transaction.atomic():
+        MenuLogLock.acquire()
+        latest = (MenuChange.objects.exclude(action=MenuChange.COMPACTED)
+                                    .values('kind', 'object_id')
+                                    .annotate(last_id=Max('id'))
+                                    .values('last_id'))
+        superseded, _ = (MenuChange.objects.exclude(action=MenuChange.COMPACTED)
+                                           .exclude(id__in=latest)
+                                           .delete())
+
+        deletions = MenuChange.objects.filter(action=MenuChange.DELETED,
+                                              created_at__lt=keep_since)
+        horizon = deletions.aggregate(horizon=Max('id'))['horizon']
+        if horizon is None:
+            return superseded
+
+        removed, _ = deletions.delete()
+        MenuChange.objects.filter(action=MenuChange.COMPACTED).delete()
+        MenuChange.objects.create(kind='', object_id=horizon,
+                                  action=MenuChange.COMPACTED)
+        return superseded + removed
@@ -0,0 +1,44 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:13
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def mark_history_incomplete(apps, schema_editor):
+    """Menu existing before the log was introduced can only be synced fully"""
+    MenuChange = apps.get_model('junto_api', 'MenuChange')
+    marker = MenuChange.objects.create(kind='', object_id=0, action=2)
+    marker.object_id = marker.id
+    marker.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0014_auto_20171012_0109'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(blank=True, choices=[('category', 'категория'), ('dish', 'блюдо')], max_length=10)),
+                ('object_id', models.PositiveIntegerField()),
+                ('action', models.SmallIntegerField(choices=[(0, 'Изменено'), (1, 'Удалено'), (2, 'История сжата')])),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'изменение меню',
+                'verbose_name_plural': 'изменения меню',
+            },
+        ),
+        migrations.AlterField(
+            model_name='dishorder',
+            name='dish',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='junto_api.Dish', verbose_name='блюдо'),
+        ),
+        migrations.RunPython(mark_history_incomplete, migrations.RunPython.noop),
+    ]
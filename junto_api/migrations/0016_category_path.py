@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+from junto_api.hierarchy import rebuild_paths
+
+
+def build_paths(apps, schema_editor):
+    rebuild_paths(apps.get_model('junto_api', 'Category'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0015_menuchange'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='category',
+            options={'base_manager_name': 'objects', 'verbose_name': 'категория', 'verbose_name_plural': 'категории'},
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(build_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:21
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def combine_duplicate_items(apps, schema_editor):
+    """Merge rows of the same dish at the same price into one with a quantity"""
+    DishOrder = apps.get_model('junto_api', 'DishOrder')
+    duplicates = (DishOrder.objects.values('order_id', 'dish_id',
+                                           'current_price')
+                                   .annotate(rows=Count('id'),
+                                             quantity=Sum('quantity'),
+                                             kept_id=Min('id'))
+                                   .filter(rows__gt=1)
+                                   .order_by())
+    for group in list(duplicates):
+        rows = DishOrder.objects.filter(order_id=group['order_id'],
+                                        dish_id=group['dish_id'],
+                                        current_price=group['current_price'])
+        rows.exclude(id=group['kept_id']).delete()
+        rows.filter(id=group['kept_id']).update(quantity=group['quantity'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0016_category_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dishorder',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, verbose_name='количество'),
+        ),
+        migrations.RunPython(combine_duplicate_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:21
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0017_dishorder_quantity'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='dishorder',
+            unique_together=set([('order', 'dish', 'current_price')]),
+        ),
+    ]
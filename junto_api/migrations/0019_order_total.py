@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:24
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def compute_totals(apps, schema_editor):
+    Order = apps.get_model('junto_api', 'Order')
+    DishOrder = apps.get_model('junto_api', 'DishOrder')
+    output_field = models.DecimalField(max_digits=10, decimal_places=2)
+    amount = F('current_price') * F('quantity')
+    totals = (DishOrder.objects.filter(order=OuterRef('pk'))
+                               .order_by()
+                               .values('order')
+                               .annotate(total=Sum(amount,
+                                                   output_field=output_field))
+                               .values('total'))
+    Order.objects.update(total=Coalesce(Subquery(totals,
+                                                 output_field=output_field),
+                                        Value(0), output_field=output_field))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0018_auto_20261018_0721'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='total',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=10, verbose_name='сумма, ₽'),
+        ),
+        migrations.RunPython(compute_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0020_order_history_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RestaurantRevenue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='день')),
+                ('status', models.SmallIntegerField(choices=[(0, 'Ожидает оплаты'), (1, 'Оплачен'), (2, 'Отменён')], verbose_name='статус')),
+                ('orders', models.IntegerField(default=0, verbose_name='заказов')),
+                ('items', models.IntegerField(default=0, verbose_name='порций')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='выручка, ₽')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue', to='junto_api.Restaurant', verbose_name='ресторан')),
+            ],
+            options={
+                'verbose_name': 'выручка ресторана за день',
+                'verbose_name_plural': 'выручка ресторанов по дням',
+                'unique_together': {('restaurant', 'date', 'status')},
+            },
+        ),
+        migrations.CreateModel(
+            name='DishRevenue',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='день')),
+                ('status', models.SmallIntegerField(choices=[(0, 'Ожидает оплаты'), (1, 'Оплачен'), (2, 'Отменён')], verbose_name='статус')),
+                ('orders', models.IntegerField(default=0, verbose_name='заказов')),
+                ('items', models.IntegerField(default=0, verbose_name='порций')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='выручка, ₽')),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revenue', to='junto_api.Dish', verbose_name='блюдо')),
+            ],
+            options={
+                'verbose_name': 'выручка блюда за день',
+                'verbose_name_plural': 'выручка блюд по дням',
+                'unique_together': {('dish', 'date', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:32
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('junto_api', '0021_revenue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('status', models.SmallIntegerField(choices=[(0, 'Ожидает оплаты'), (1, 'Оплачен'), (2, 'Отменён')], verbose_name='статус')),
+                ('total', models.DecimalField(decimal_places=2, max_digits=10, verbose_name='сумма, ₽')),
+                ('created_at', models.DateTimeField(verbose_name='время создания')),
+                ('updated_at', models.DateTimeField()),
+                ('archived_at', models.DateTimeField(auto_now_add=True, verbose_name='время архивации')),
+                ('operator', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to=settings.AUTH_USER_MODEL, verbose_name='оператор')),
+                ('restaurant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_orders', to='junto_api.Restaurant', verbose_name='ресторан')),
+            ],
+            options={
+                'verbose_name': 'архивный заказ',
+                'verbose_name_plural': 'архив заказов',
+            },
+        ),
+        migrations.CreateModel(
+            name='ArchivedDishOrder',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('current_price', models.DecimalField(decimal_places=2, max_digits=8, verbose_name='стоимость на момент заказа, ₽')),
+                ('quantity', models.PositiveIntegerField(verbose_name='количество')),
+                ('dish', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='junto_api.Dish', verbose_name='блюдо')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='junto_api.ArchivedOrder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['created_at', 'id'], name='archived_order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['operator', 'created_at', 'id'], name='archived_order_operator_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['restaurant', 'created_at', 'id'], name='archived_order_restaurant_idx'),
+        ),
+    ]
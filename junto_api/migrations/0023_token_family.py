@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 07:39
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_families(apps, schema_editor):
+    """
+    Existing refresh tokens belong to the first generation,
+    so they stay valid until they are used or revoked
+    """
+    RefreshToken = apps.get_model('junto_api', 'RefreshToken')
+    TokenFamily = apps.get_model('junto_api', 'TokenFamily')
+    user_ids = (RefreshToken.objects.order_by()
+                                    .values_list('user_id', flat=True)
+                                    .distinct())
+    TokenFamily.objects.bulk_create(
+        (TokenFamily(user_id=user_id) for user_id in user_ids.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('junto_api', '0022_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenFamily',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='token_family', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('generation', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='generation',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(create_families, migrations.RunPython.noop),
+    ]
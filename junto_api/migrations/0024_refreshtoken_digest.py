@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 08:05
+from __future__ import unicode_literals
+
+import hashlib
+
+from django.db import migrations, models, transaction
+from django.db.models import Count, Min
+
+BATCH_SIZE = 1000
+
+
+def fill_digests(apps, schema_editor):
+    RefreshToken = apps.get_model('junto_api', 'RefreshToken')
+
+    # Identical tokens could be issued to a user within the same second,
+    # they are interchangeable, so a single row of them is kept
+    duplicates = (RefreshToken.objects.order_by()
+                                      .values('value')
+                                      .annotate(count=Count('id'),
+                                                keep=Min('id'))
+                                      .filter(count__gt=1))
+    for duplicate in list(duplicates):
+        (RefreshToken.objects.filter(value=duplicate['value'])
+                             .exclude(pk=duplicate['keep'])
+                             .delete())
+
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(RefreshToken.objects.filter(pk__gt=last_id)
+                                             .order_by('pk')
+                                             .values_list('pk', 'value')
+                                             [:BATCH_SIZE])
+            for pk, value in batch:
+                digest = hashlib.sha256(value.encode()).hexdigest()
+                RefreshToken.objects.filter(pk=pk).update(digest=digest)
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed separately, so the backfill doesn't keep
+    # the whole table locked
+    atomic = False
+
+    dependencies = [
+        ('junto_api', '0023_token_family'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='digest',
+            field=models.CharField(editable=False, max_length=64, null=True),
+        ),
+        migrations.RunPython(fill_digests, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='digest',
+            field=models.CharField(editable=False, max_length=64, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='refreshtoken',
+            name='value',
+            field=models.CharField(max_length=500),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 08:40
+from __future__ import unicode_literals
+
+import datetime
+
+import jwt
+from django.db import migrations, models, transaction
+from django.utils import timezone
+
+BATCH_SIZE = 1000
+
+
+def fill_expiration_times(apps, schema_editor):
+    """
+    Copy exp claims of the existing tokens. Tokens that can't be decoded
+    are useless, so they are marked as expired
+    """
+    RefreshToken = apps.get_model('junto_api', 'RefreshToken')
+    now = timezone.now()
+    last_id = 0
+    while True:
+        with transaction.atomic():
+            batch = list(RefreshToken.objects.filter(pk__gt=last_id)
+                                             .order_by('pk')
+                                             .values_list('pk', 'value')
+                                             [:BATCH_SIZE])
+            for pk, value in batch:
+                try:
+                    exp = jwt.decode(value, verify=False)['exp']
+                    expires_at = datetime.datetime.fromtimestamp(
+                        exp, timezone.utc)
+                except (jwt.InvalidTokenError, KeyError, TypeError,
+                        ValueError):
+                    expires_at = now
+                (RefreshToken.objects.filter(pk=pk)
+                                     .update(expires_at=expires_at))
+        if not batch:
+            break
+        last_id = batch[-1][0]
+
+
+class Migration(migrations.Migration):
+    # Every batch is committed separately, as in 0024
+    atomic = False
+
+    dependencies = [
+        ('junto_api', '0024_refreshtoken_digest'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='refreshtoken',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, editable=False, null=True),
+        ),
+        migrations.RunPython(fill_expiration_times, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 09:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def create_lock(apps, schema_editor):
+    MenuLogLock = apps.get_model('junto_api', 'MenuLogLock')
+    MenuLogLock.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0025_refreshtoken_expires_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MenuLogLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+            options={
+                'verbose_name': 'блокировка журнала меню',
+                'verbose_name_plural': 'блокировки журнала меню',
+            },
+        ),
+        migrations.RunPython(create_lock, migrations.RunPython.noop),
+    ]
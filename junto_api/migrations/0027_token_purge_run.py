@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 11:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('junto_api', '0026_menu_log_lock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenPurgeRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('started_at', models.DateTimeField(verbose_name='начало')),
+                ('deleted', models.PositiveIntegerField(verbose_name='удалено токенов')),
+                ('seconds', models.FloatField(verbose_name='длительность, с')),
+            ],
+            options={
+                'verbose_name': 'очистка refresh-токенов',
+                'verbose_name_plural': 'очистки refresh-токенов',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.3 on 2026-10-18 13:20
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def deny_inactive_users(apps, schema_editor):
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    DeniedUser = apps.get_model('junto_api', 'DeniedUser')
+    user_ids = User.objects.filter(is_active=False).values_list('id',
+                                                                flat=True)
+    DeniedUser.objects.bulk_create(
+        (DeniedUser(user_id=user_id) for user_id in user_ids.iterator()),
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('junto_api', '0027_token_purge_run'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeniedUser',
+            fields=[
+                ('user_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('denied_at', models.DateTimeField(auto_now=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'заблокированный пользователь',
+                'verbose_name_plural': 'заблокированные пользователи',
+            },
+        ),
+        migrations.RunPython(deny_inactive_users, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,41 @@
 import datetime
+import hashlib
+import threading
 import jwt
 from django.conf import settings
-from django.db import models
+from django.core.exceptions import ValidationError
+from django.db import models, transaction
+from django.db.models import (DecimalField, ExpressionWrapper, F, OuterRef,
+                              Subquery, Sum, Value)
+from django.db.models.functions import Coalesce, Concat, Substr
 from django.contrib.auth.models import User
 from django.utils import timezone
-from decimal import Decimal
+from contextlib import contextmanager
+from typing import Iterable
+
+from .hierarchy import category_path, path_depth
+
+
+class CategoryQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Keep paths, the menu change log and the menu snapshot in sync
+        when categories are moved in bulk, e.g. by subcategories.add()
+        """
+        if 'supercategory' not in kwargs and 'supercategory_id' not in kwargs:
+            return super().update(**kwargs)
+
+        # Imported here, since the menu module depends on the models
+        from .menu import menu_snapshot, record_changes
+
+        with transaction.atomic(using=self.db):
+            moved = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            for category in self.model._base_manager.filter(pk__in=moved):
+                category.update_path()
+            record_changes(MenuChange.CATEGORY, moved)
+            menu_snapshot.invalidate()
+        return rows
 
 
 class Category(models.Model):
@@ -15,28 +46,105 @@ class Category(models.Model):
                                       blank=True,
                                       related_name='subcategories',
                                       related_query_name='subcategory')
-    
-    def serialize(self):
-        return {
-            'name': self.name,
-            'dishes': {
-                'count': self.dishes.count(),
-                'items': [dish.serialize() for dish in self.dishes.all()]
-            },
-            'subcategories': {
-                'count': self.subcategories.count(),
-                'items': [cat.serialize() for cat in self.subcategories.all()]
-            }
-        }
+    # Materialized path, see junto_api.hierarchy
+    path = models.CharField(max_length=255, db_index=True, editable=False,
+                            default='')
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = CategoryQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'категория'
         verbose_name_plural = 'категории'
-    
+        # Reverse relation managers move subcategories with update()
+        base_manager_name = 'objects'
+
+    def clean(self):
+        if self.pk is not None and self.supercategory_id is not None:
+            if self.get_descendants(include_self=True).filter(
+                    pk=self.supercategory_id).exists():
+                raise ValidationError({'supercategory': 'Категория не может '
+                                                        'быть вложена '
+                                                        'сама в себя'})
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Paths are maintained by update_path(),
+            # an outdated copy in memory must not overwrite them
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in ('path', 'depth')
+            ]
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            self.update_path()
+
+    def update_path(self):
+        """Recompute the path of the category and rebase its subtree"""
+        # Paths in memory may be outdated, so both are read from the database
+        paths = dict(Category._base_manager.filter(pk__in=[self.pk,
+                                                           self.supercategory_id])
+                                           .values_list('pk', 'path'))
+        old_path = paths[self.pk]
+        parent_path = paths.get(self.supercategory_id)
+        path = category_path(parent_path, self.pk)
+        depth = path_depth(path)
+        if path != old_path:
+            if old_path and parent_path and parent_path.startswith(old_path):
+                raise ValueError('Category cannot be moved into its own subtree')
+
+            Category._base_manager.filter(pk=self.pk).update(path=path,
+                                                             depth=depth)
+            if old_path:
+                (Category._base_manager
+                         .filter(path__startswith=old_path)
+                         .exclude(pk=self.pk)
+                         .update(path=Concat(Value(path),
+                                             Substr('path', len(old_path) + 1)),
+                                 depth=F('depth') + depth - path_depth(old_path)))
+        self.path = path
+        self.depth = depth
+
+    def detach_subcategories(self):
+        """Make subcategories top level ones before the category is deleted"""
+        for subcategory in self.subcategories.all():
+            subcategory.supercategory = None
+            subcategory.update_path()
+
+    def get_descendants(self, include_self: bool = False) -> models.QuerySet:
+        descendants = Category.objects.filter(path__startswith=self.path)
+        if not include_self:
+            descendants = descendants.exclude(pk=self.pk)
+        return descendants
+
+    def get_subtree_dishes(self) -> models.QuerySet:
+        """Dishes of the category and all of its descendants"""
+        return (Dish.objects.filter(categories__path__startswith=self.path)
+                            .distinct())
+
     def __str__(self):
         return self.name
 
 
+class DishQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Keep the menu change log, the menu snapshot and the prices
+        cached for orders in sync when dishes are changed in bulk
+        """
+        # Imported here, since these modules depend on the models
+        from .menu import menu_snapshot, record_changes
+        from .references import references
+
+        with transaction.atomic(using=self.db):
+            changed = list(self.values_list('pk', flat=True))
+            rows = super().update(**kwargs)
+            record_changes(MenuChange.DISH, changed)
+            menu_snapshot.invalidate()
+            references.invalidate()
+        return rows
+
+
 class Dish(models.Model):
     name = models.CharField(max_length=200, verbose_name='название')
     price = models.DecimalField(max_digits=8,
@@ -47,12 +155,20 @@ class Dish(models.Model):
                                         related_query_name='dish',
                                         verbose_name='категории')
     
-    def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'price': str(self.price)
-        }
+    objects = DishQuerySet.as_manager()
+    
+    FIELDS = ('id', 'name', 'price')
+
+    def serialize(self, fields: Iterable[str] = FIELDS) -> dict:
+        """Only the requested fields are touched, the rest may be deferred"""
+        data = {}
+        if 'id' in fields:
+            data['id'] = self.id
+        if 'name' in fields:
+            data['name'] = self.name
+        if 'price' in fields:
+            data['price'] = str(self.price)
+        return data
     
     class Meta:
         verbose_name = 'блюдо'
@@ -62,25 +178,121 @@ class Dish(models.Model):
         return f'{self.name} ({self.price} ₽)'
 
 
+class MenuChange(models.Model):
+    """
+    Log of menu changes used for incremental synchronization.
+
+    The id of the latest entry is the current version of the menu.
+    COMPACTED entries mark that the history up to `object_id`
+    is no longer complete.
+    """
+    CATEGORY = 'category'
+    DISH = 'dish'
+    KIND_CHOICES = (
+        (CATEGORY, 'категория'),
+        (DISH, 'блюдо'),
+    )
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True)
+    object_id = models.PositiveIntegerField()
+
+    UPDATED = 0
+    DELETED = 1
+    COMPACTED = 2
+    ACTION_CHOICES = (
+        (UPDATED, 'Изменено'),
+        (DELETED, 'Удалено'),
+        (COMPACTED, 'История сжата'),
+    )
+    action = models.SmallIntegerField(choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'изменение меню'
+        verbose_name_plural = 'изменения меню'
+
+    def __str__(self):
+        return f'{self.get_action_display()}: {self.kind} #{self.object_id}'
+
+
+class MenuLogLock(models.Model):
+    """
+    Single row locked by every writer of the MenuChange log until it
+    commits. Ids are then assigned in commit order, so a change never
+    becomes visible below a version a client has already synced to.
+    """
+    class Meta:
+        verbose_name = 'блокировка журнала меню'
+        verbose_name_plural = 'блокировки журнала меню'
+
+    @classmethod
+    def acquire(cls):
+        """Should be called inside a transaction"""
+        cls.objects.select_for_update().get_or_create(pk=1)
+
+
+class RestaurantQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Keep the restaurants snapshot and the restaurants cached
+        for orders in sync when restaurants are changed in bulk
+        """
+        from .references import references
+        from .restaurants import restaurants_snapshot
+
+        with transaction.atomic(using=self.db):
+            rows = super().update(**kwargs)
+            restaurants_snapshot.invalidate()
+            references.invalidate()
+        return rows
+
+
 class Restaurant(models.Model):
     name = models.CharField(max_length=200, verbose_name='название')
     city = models.CharField(max_length=50, verbose_name='город')
     
+    objects = RestaurantQuerySet.as_manager()
+    
     class Meta:
         verbose_name = 'ресторан'
         verbose_name_plural = 'рестораны'
         
-    def serialize(self):
-        return {
-            'id': self.id,
-            'name': self.name,
-            'city': self.city
-        }
+    FIELDS = ('id', 'name', 'city')
+
+    def serialize(self, fields: Iterable[str] = FIELDS) -> dict:
+        """Only the requested fields are touched, the rest may be deferred"""
+        data = {}
+        if 'id' in fields:
+            data['id'] = self.id
+        if 'name' in fields:
+            data['name'] = self.name
+        if 'city' in fields:
+            data['city'] = self.city
+        return data
     
     def __str__(self):
         return self.name
     
 
+class OrderQuerySet(models.QuerySet):
+    @staticmethod
+    def computed_total() -> Coalesce:
+        """Total of an order computed from its items"""
+        output_field = DecimalField(max_digits=10, decimal_places=2)
+        amount = ExpressionWrapper(F('current_price') * F('quantity'),
+                                   output_field=output_field)
+        totals = (DishOrder.objects.filter(order=OuterRef('pk'))
+                                   .order_by()
+                                   .values('order')
+                                   .annotate(total=Sum(amount))
+                                   .values('total'))
+        return Coalesce(Subquery(totals, output_field=output_field),
+                        Value(0), output_field=output_field)
+
+    def update_totals(self) -> int:
+        """Recompute stored totals from the order items in one query"""
+        return self.update(total=self.computed_total())
+
+
 class Order(models.Model):
     operator = models.ForeignKey(User,
                                  on_delete=models.CASCADE,
@@ -96,6 +308,12 @@ class Order(models.Model):
         (PAID, 'Оплачен'),
         (CANCELLED, 'Отменён'),
     )
+    # Statuses an order may be moved to from each status
+    TRANSITIONS = {
+        PENDING: (PAID, CANCELLED),
+        PAID: (),
+        CANCELLED: (),
+    }
     status = models.SmallIntegerField(choices=STATUS_CHOICES,
                                       default=PENDING,
                                       verbose_name='статус')
@@ -112,10 +330,29 @@ class Order(models.Model):
                                       verbose_name='время создания')
     updated_at = models.DateTimeField()
     
-    @property
-    def total(self) -> Decimal:
-        return sum([rel.current_price for rel in self.dishorder_set.all()])
-    total.fget.short_description = 'сумма, ₽'
+    # Kept in sync with the items by DishOrder.save(), the post_delete
+    # signal of DishOrder and DishOrderQuerySet.update(), other bulk
+    # changes of items have to call OrderQuerySet.update_totals()
+    total = models.DecimalField(max_digits=10,
+                                decimal_places=2,
+                                default=0,
+                                editable=False,
+                                verbose_name='сумма, ₽')
+    
+    objects = OrderQuerySet.as_manager()
+    
+    def serialize(self) -> dict:
+        """Items should be prefetched along with their dishes"""
+        return {
+            'id': self.id,
+            'operator_id': self.operator_id,
+            'restaurant_id': self.restaurant_id,
+            'status': self.status,
+            'total': str(self.total),
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'items': [item.serialize() for item in self.dishorder_set.all()]
+        }
     
     def save(self, *args, **kwargs):
         """Update timestamps on save"""
@@ -123,16 +360,87 @@ class Order(models.Model):
             self.created_at = timezone.now()
         self.updated_at = timezone.now()
         
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # The total is maintained along with the items,
+            # an outdated copy in memory must not overwrite it
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'total'
+            ]
         return super().save(*args, **kwargs)
     
     class Meta:
         verbose_name = 'заказ'
         verbose_name_plural = 'заказы'
+        # Order history is paginated by (created_at, id)
+        # and filtered by one of operator, restaurant or status
+        indexes = [
+            models.Index(fields=['created_at', 'id'],
+                         name='order_created_idx'),
+            models.Index(fields=['operator', 'created_at', 'id'],
+                         name='order_operator_created_idx'),
+            models.Index(fields=['restaurant', 'created_at', 'id'],
+                         name='order_restaurant_created_idx'),
+            models.Index(fields=['status', 'created_at', 'id'],
+                         name='order_status_created_idx'),
+        ]
     
     def __str__(self):
         return f'Заказ №{self.id}'
 
 
+# Order ids collected by deferred_totals() in the current thread
+_deferred = threading.local()
+
+
+@contextmanager
+def deferred_totals():
+    """
+    Totals of orders whose items are deleted inside the block are
+    updated with a single query at the end of it, instead of one query
+    per deleted item. Should be used inside a transaction.
+    """
+    if getattr(_deferred, 'order_ids', None) is not None:
+        yield
+        return
+    _deferred.order_ids = set()
+    try:
+        yield
+        order_ids = _deferred.order_ids
+    finally:
+        _deferred.order_ids = None
+    if order_ids:
+        Order.objects.filter(pk__in=order_ids).update_totals()
+
+
+class DishOrderQuerySet(models.QuerySet):
+    # Fields that affect totals of orders
+    TOTAL_FIELDS = {'order', 'order_id', 'current_price', 'quantity'}
+    
+    def update(self, **kwargs):
+        """Keep totals of the affected orders in sync"""
+        if not self.TOTAL_FIELDS & kwargs.keys():
+            return super().update(**kwargs)
+        
+        with transaction.atomic(using=self.db):
+            items = list(self.values_list('pk', 'order_id'))
+            rows = super().update(**kwargs)
+            order_ids = {order_id for _, order_id in items}
+            if 'order' in kwargs or 'order_id' in kwargs:
+                # Orders the items were moved to
+                order_ids.update(
+                    self.model._base_manager
+                              .filter(pk__in=[pk for pk, _ in items])
+                              .values_list('order_id', flat=True))
+            Order.objects.filter(pk__in=order_ids).update_totals()
+        return rows
+    
+    def delete(self):
+        # Totals are updated by the post_delete signal of every item
+        with transaction.atomic(using=self.db), deferred_totals():
+            return super().delete()
+
+
 class DishOrder(models.Model):
     """Due to  price changes we need to """
     order = models.ForeignKey(Order, on_delete=models.CASCADE)
@@ -141,39 +449,281 @@ class DishOrder(models.Model):
     current_price = models.DecimalField(max_digits=8,
                                         decimal_places=2,
                                         verbose_name='стоимость на момент заказа, ₽')
+    quantity = models.PositiveIntegerField(default=1,
+                                           verbose_name='количество')
+    
+    objects = DishOrderQuerySet.as_manager()
+    
+    class Meta:
+        # Several portions of a dish are stored as one row with a quantity
+        unique_together = ('order', 'dish', 'current_price')
+    
+    def serialize(self) -> dict:
+        return {
+            'dish_id': self.dish_id,
+            'name': self.dish.name,
+            'price': str(self.current_price),
+            'quantity': self.quantity
+        }
+    
+    def save(self, *args, **kwargs):
+        """Update the total of the order along with the item"""
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            Order.objects.filter(pk=self.order_id).update_totals()
+    
+    @staticmethod
+    def deleted(order_ids: Iterable[int]):
+        """
+        Update totals of the orders after their items were deleted,
+        either right away or at the end of deferred_totals()
+        """
+        pending = getattr(_deferred, 'order_ids', None)
+        if pending is not None:
+            pending.update(order_ids)
+        else:
+            Order.objects.filter(pk__in=order_ids).update_totals()
     
     def __str__(self):
         return str(self.dish)
 
 
+class ArchivedOrder(models.Model):
+    """Closed order moved out of the Order table, keeps its id"""
+    id = models.IntegerField(primary_key=True)
+    operator = models.ForeignKey(User,
+                                 on_delete=models.CASCADE,
+                                 related_name='archived_orders',
+                                 verbose_name='оператор')
+    restaurant = models.ForeignKey(Restaurant,
+                                   on_delete=models.CASCADE,
+                                   related_name='archived_orders',
+                                   verbose_name='ресторан')
+    status = models.SmallIntegerField(choices=Order.STATUS_CHOICES,
+                                      verbose_name='статус')
+    total = models.DecimalField(max_digits=10,
+                                decimal_places=2,
+                                verbose_name='сумма, ₽')
+    created_at = models.DateTimeField(verbose_name='время создания')
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True,
+                                       verbose_name='время архивации')
+    
+    def serialize(self) -> dict:
+        """Items should be prefetched along with their dishes"""
+        return {
+            'id': self.id,
+            'operator_id': self.operator_id,
+            'restaurant_id': self.restaurant_id,
+            'status': self.status,
+            'total': str(self.total),
+            'created_at': self.created_at.isoformat(),
+            'updated_at': self.updated_at.isoformat(),
+            'items': [item.serialize() for item in self.items.all()]
+        }
+    
+    class Meta:
+        verbose_name = 'архивный заказ'
+        verbose_name_plural = 'архив заказов'
+        indexes = [
+            models.Index(fields=['created_at', 'id'],
+                         name='archived_order_created_idx'),
+            models.Index(fields=['operator', 'created_at', 'id'],
+                         name='archived_order_operator_idx'),
+            models.Index(fields=['restaurant', 'created_at', 'id'],
+                         name='archived_order_restaurant_idx'),
+        ]
+    
+    def __str__(self):
+        return f'Заказ №{self.id}'
+
+
+class ArchivedDishOrder(models.Model):
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE,
+                              related_name='items')
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE,
+                             verbose_name='блюдо')
+    current_price = models.DecimalField(max_digits=8,
+                                        decimal_places=2,
+                                        verbose_name='стоимость на момент заказа, ₽')
+    quantity = models.PositiveIntegerField(verbose_name='количество')
+    
+    serialize = DishOrder.serialize
+    
+    def __str__(self):
+        return str(self.dish)
+
+
+class DailyRevenue(models.Model):
+    """
+    Orders of a day in a status, aggregated by junto_api.revenue.
+
+    Days are in the local time zone.
+    """
+    date = models.DateField(verbose_name='день')
+    status = models.SmallIntegerField(choices=Order.STATUS_CHOICES,
+                                      verbose_name='статус')
+    orders = models.IntegerField(default=0, verbose_name='заказов')
+    items = models.IntegerField(default=0, verbose_name='порций')
+    revenue = models.DecimalField(max_digits=14,
+                                  decimal_places=2,
+                                  default=0,
+                                  verbose_name='выручка, ₽')
+    
+    class Meta:
+        abstract = True
+
+
+class RestaurantRevenue(DailyRevenue):
+    restaurant = models.ForeignKey(Restaurant, on_delete=models.CASCADE,
+                                   related_name='revenue',
+                                   verbose_name='ресторан')
+    
+    class Meta:
+        unique_together = ('restaurant', 'date', 'status')
+        verbose_name = 'выручка ресторана за день'
+        verbose_name_plural = 'выручка ресторанов по дням'
+
+
+class DishRevenue(DailyRevenue):
+    dish = models.ForeignKey(Dish, on_delete=models.CASCADE,
+                             related_name='revenue',
+                             verbose_name='блюдо')
+    
+    class Meta:
+        unique_together = ('dish', 'date', 'status')
+        verbose_name = 'выручка блюда за день'
+        verbose_name_plural = 'выручка блюд по дням'
+
+
+class TokenFamily(models.Model):
+    """
+    Generation of the refresh tokens of a user.
+
+    Only refresh tokens of the current generation are valid, so bumping
+    the generation revokes all tokens of the user with a single UPDATE.
+    """
+    user = models.OneToOneField(User, on_delete=models.CASCADE,
+                                primary_key=True,
+                                related_name='token_family')
+    generation = models.PositiveIntegerField(default=0)
+    
+    @classmethod
+    def revoke_all(cls, user: User) -> int:
+        """Revoke all refresh tokens of the user, returns the new generation"""
+        with transaction.atomic():
+            updated = (cls.objects.filter(user=user)
+                                  .update(generation=F('generation') + 1))
+            if not updated:
+                cls.objects.get_or_create(user=user)
+            return (cls.objects.values_list('generation', flat=True)
+                               .get(user=user))
+    
+    @classmethod
+    def rotate(cls, user_id: int, generation: int) -> bool:
+        """
+        Move to the next generation if the current one is `generation`.
+        Only one of concurrent refreshes with the same token succeeds.
+        """
+        return bool(cls.objects.filter(user_id=user_id, generation=generation)
+                               .update(generation=generation + 1))
+    
+    def __str__(self):
+        return f'{self.user} #{self.generation}'
+
+
+class DeniedUser(models.Model):
+    """
+    Deactivated or deleted user, whose access tokens with claims
+    are rejected. Not a foreign key, since deleted users stay here
+    until every access token issued to them has expired.
+    """
+    user_id = models.IntegerField(primary_key=True)
+    denied_at = models.DateTimeField(auto_now=True, db_index=True)
+    
+    class Meta:
+        verbose_name = 'заблокированный пользователь'
+        verbose_name_plural = 'заблокированные пользователи'
+    
+    def __str__(self):
+        return f'user #{self.user_id}'
+
+
+def token_digest(token: str) -> str:
+    """Fixed-length key of a token, used to look it up"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
 class RefreshToken(models.Model):
-    value = models.CharField(max_length=500, db_index=True)
+    value = models.CharField(max_length=500)
+    # Tokens are looked up by the digest, which keeps the index compact
+    digest = models.CharField(max_length=64, unique=True, editable=False)
     revoked = models.BooleanField(default=False)
     user = models.ForeignKey(User, on_delete=models.CASCADE,
                              related_name='refresh_tokens',
                              related_query_name='refresh_token')
+    generation = models.PositiveIntegerField(default=0)
+    # Copy of the exp claim, so that expired tokens can be purged.
+    # Unknown for tokens created without create_token
+    expires_at = models.DateTimeField(null=True, db_index=True,
+                                      editable=False)
     @classmethod
     def create_token(cls, user: User,
                      expires: datetime.datetime,
-                     secret: str) -> 'RefreshToken':
+                     secret: str,
+                     generation: int = 0) -> 'RefreshToken':
         payload = {
             'type': 'refresh',
             'user_id': user.id,
+            'generation': generation,
             'exp': expires
         }
         token_value: str = jwt.encode(payload, secret).decode()
-        token = cls.objects.create(value=token_value, user=user)
+        if timezone.is_naive(expires):
+            # Expiration times of JWTs are in UTC
+            expires = timezone.make_aware(expires, timezone.utc)
+        token = cls.objects.create(value=token_value, user=user,
+                                   generation=generation,
+                                   expires_at=expires)
         return token
     
+    @classmethod
+    def lookup(cls, token: str) -> models.QuerySet:
+        return cls.objects.filter(digest=token_digest(token))
+    
+    def save(self, *args, **kwargs):
+        self.digest = token_digest(self.value)
+        super().save(*args, **kwargs)
+    
     def validate(self):
         try:
             payload = jwt.decode(self.value, key=settings.SECRET_KEY)
-            return not self.revoked and payload.get('type') == 'refresh'
+            return (not self.revoked and payload.get('type') == 'refresh'
+                    and self.generation == self.user.token_family.generation)
         
         except jwt.DecodeError:
             return False
         except jwt.ExpiredSignatureError:
             return False
+        except TokenFamily.DoesNotExist:
+            return False
         
     def __str__(self):
         return f'token #{self.id}'
+
+
+class TokenPurgeRun(models.Model):
+    """
+    A run of the refresh token purge. Runs are kept in the database,
+    since the purge runs in its own process and not in the web workers.
+    """
+    started_at = models.DateTimeField(verbose_name='начало')
+    deleted = models.PositiveIntegerField(verbose_name='удалено токенов')
+    seconds = models.FloatField(verbose_name='длительность, с')
+    
+    class Meta:
+        verbose_name = 'очистка refresh-токенов'
+        verbose_name_plural = 'очистки refresh-токенов'
+    
+    def __str__(self):
+        return f'{self.started_at:%Y-%m-%d %H:%M}, {self.deleted} tokens'
@@ -0,0 +1,120 @@
+"""
+Listing of orders with keyset pagination.
+
+Orders are sorted from the newest to the oldest by (created_at, id).
+A page ends with a cursor pointing at its last order, the next page
+starts right after it. Unlike OFFSET, the database seeks to the cursor
+in a composite index, so deep pages are as fast as the first one.
+"""
+import base64
+import datetime
+import json
+from typing import Optional, Tuple, Union
+
+from django.db.models import Prefetch, Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+from .models import ArchivedDishOrder, ArchivedOrder, DishOrder, Order
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+FILTERS = ('operator', 'restaurant', 'status', 'since', 'until')
+
+
+def encode_cursor(order: Union[Order, ArchivedOrder]) -> str:
+    value = json.dumps([order.created_at.isoformat(), order.id])
+    return base64.urlsafe_b64encode(value.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime.datetime, int]:
+    """Raises ValueError if the cursor is malformed"""
+    try:
+        created_at, order_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode()).decode())
+        created_at = parse_datetime(created_at)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid cursor')
+    if created_at is None or not isinstance(order_id, int):
+        raise ValueError('Invalid cursor')
+    return created_at, order_id
+
+
+def parse_filters(params: dict) -> Q:
+    """
+    Filters from query parameters: operator, restaurant and status ids
+    and the time range [since, until) as ISO 8601 datetimes.
+    Raises ValueError on malformed values.
+    """
+    filters = Q()
+    for param, field in (('operator', 'operator_id'),
+                         ('restaurant', 'restaurant_id'),
+                         ('status', 'status')):
+        value = params.get(param)
+        if value is not None:
+            try:
+                filters &= Q(**{field: int(value)})
+            except ValueError:
+                raise ValueError(f'{param} should be an integer')
+    for param, lookup in (('since', 'created_at__gte'),
+                          ('until', 'created_at__lt')):
+        value = params.get(param)
+        if value is not None:
+            moment = parse_datetime(value)
+            if moment is None:
+                raise ValueError(f'{param} should be an ISO 8601 datetime')
+            filters &= Q(**{lookup: moment})
+    return filters
+
+
+def _with_items(orders: QuerySet, items: QuerySet, name: str) -> QuerySet:
+    items = items.select_related('dish').only(
+        'order_id', 'dish_id', 'dish__name', 'current_price', 'quantity')
+    return orders.prefetch_related(
+        Prefetch(name, queryset=items.order_by('id')))
+
+
+def orders_with_items() -> QuerySet:
+    """Orders with their items and dish names in two queries"""
+    return _with_items(Order.objects.all(), DishOrder.objects.all(),
+                       'dishorder_set')
+
+
+def archived_orders_with_items() -> QuerySet:
+    return _with_items(ArchivedOrder.objects.all(),
+                       ArchivedDishOrder.objects.all(), 'items')
+
+
+def after_cursor(orders: QuerySet, cursor: str) -> QuerySet:
+    """
+    Orders older than the cursor. The OR alone can't be used to seek
+    in the (created_at, id) index, the redundant created_at bound can,
+    so only orders created at the cursor time are filtered by id.
+    """
+    created_at, order_id = decode_cursor(cursor)
+    return orders.filter(Q(created_at__lt=created_at) |
+                         Q(created_at=created_at, id__lt=order_id),
+                         created_at__lte=created_at)
+
+
+def list_orders(filters: Q, cursor: Optional[str] = None,
+                limit: int = DEFAULT_PAGE_SIZE,
+                orders: Optional[QuerySet] = None) -> dict:
+    """
+    A page of orders matching the filters, starting after the cursor.
+    The next cursor is None on the last page.
+    Archived orders are listed when given as `orders`.
+    """
+    if orders is None:
+        orders = orders_with_items()
+    orders = orders.filter(filters)
+    if cursor is not None:
+        orders = after_cursor(orders, cursor)
+    # One more order tells whether there is a next page
+    page = list(orders.order_by('-created_at', '-id')[:limit + 1])
+    has_next = len(page) > limit
+    page = page[:limit]
+    return {
+        'orders': [order.serialize() for order in page],
+        'next_cursor': encode_cursor(page[-1]) if has_next else None
+    }
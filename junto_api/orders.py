@@ -0,0 +1,212 @@
+from collections import OrderedDict
+from decimal import Decimal
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from django.contrib.auth.models import User
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from . import revenue
+from .models import DishOrder, Order, Restaurant
+from .references import references
+
+
+def _to_int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _order_items(dish_ids: List[Any],
+                 prices: Dict[int, Decimal]) -> Tuple[List[DishOrder],
+                                                      List[Any]]:
+    """
+    Order items for known dishes and the ids that failed.
+    Repeated dishes are combined into one item with a quantity.
+    """
+    items = OrderedDict()
+    failed = []
+    for dish_id in dish_ids:
+        pk = _to_int(dish_id)
+        if pk in items:
+            items[pk].quantity += 1
+        elif pk in prices:
+            items[pk] = DishOrder(dish_id=pk, current_price=prices[pk],
+                                  quantity=1)
+        else:
+            failed.append(dish_id)
+    return list(items.values()), failed
+
+
+def _total(items: List[DishOrder]) -> Decimal:
+    return sum((item.current_price * item.quantity for item in items),
+               Decimal(0))
+
+
+def _assign(order: Order, items: List[DishOrder]):
+    for item in items:
+        item.order = order
+
+
+def _prices(dish_ids: Iterable[Any]) -> Dict[int, Decimal]:
+    pks = {_to_int(dish_id) for dish_id in dish_ids} - {None}
+    return references.prices(pks)
+
+
+def create_order(operator: User, restaurant: Restaurant,
+                 dish_ids: List[Any]) -> Tuple[Order, List[Any]]:
+    """
+    Create an order with one bulk insert for all of its items.
+    Dish prices come from the reference cache.
+
+    Returns the order and the dish ids that are not valid or don't exist,
+    in the order they were given.
+    """
+    with transaction.atomic():
+        prices = _prices(dish_ids)
+        items, failed = _order_items(dish_ids, prices)
+        # The total is known upfront, bulk_create doesn't call DishOrder.save()
+        order = Order.objects.create(restaurant=restaurant, operator=operator,
+                                     total=_total(items))
+        _assign(order, items)
+        DishOrder.objects.bulk_create(items)
+        revenue.record_created([(order, items)])
+    return order, failed
+
+
+def _validate(spec: Any) -> Optional[str]:
+    if not isinstance(spec, dict):
+        return 'order should be an object'
+    if not isinstance(spec.get('dish_ids'), list):
+        return 'dish_ids should be a list'
+    if _to_int(spec.get('restaurant_id')) is None:
+        return 'restaurant_id should be an integer'
+    return None
+
+
+# Upper limit of orders in a single batch
+MAX_BATCH_SIZE = 1000
+
+# Upper limit of order ids in a single status transition
+MAX_TRANSITION_SIZE = 10000
+
+
+def create_orders(operator: User, specs: List[Any]) -> List[dict]:
+    """
+    Create a batch of orders, each given as a dict with
+    restaurant_id and dish_ids.
+
+    Restaurants and dishes of the whole batch are looked up at once
+    in the reference cache and all rows are written with bulk inserts
+    in one transaction.
+    Returns a result for every order: either its id and failed dish ids
+    or an error, so that an invalid order doesn't affect the rest.
+    """
+    errors = [_validate(spec) for spec in specs]
+    valid = [spec for spec, error in zip(specs, errors) if error is None]
+
+    with transaction.atomic():
+        restaurant_ids = references.restaurants(
+            _to_int(spec['restaurant_id']) for spec in valid)
+        prices = _prices(dish_id for spec in valid
+                         for dish_id in spec['dish_ids'])
+
+        now = timezone.now()
+        orders = []
+        order_items = []
+        for spec, error in zip(specs, errors):
+            order = None
+            items, failed = [], []
+            if error is None:
+                restaurant_id = _to_int(spec['restaurant_id'])
+                if restaurant_id in restaurant_ids:
+                    items, failed = _order_items(spec['dish_ids'], prices)
+                    # Timestamps are set by save(), which bulk_create skips
+                    order = Order(operator=operator,
+                                  restaurant_id=restaurant_id,
+                                  created_at=now, updated_at=now,
+                                  total=_total(items))
+            orders.append(order)
+            order_items.append((items, failed))
+
+        created = [order for order in orders if order is not None]
+        if connection.features.can_return_ids_from_bulk_insert:
+            Order.objects.bulk_create(created)
+        else:
+            # Ids of bulk inserted rows are only returned by some backends
+            for order in created:
+                order.save()
+
+        results = []
+        all_items = []
+        created_items = []
+        for spec, error, order, (items, failed) in zip(specs, errors, orders,
+                                                       order_items):
+            if error is not None:
+                results.append({'error': error})
+            elif order is None:
+                results.append({'error': f'Restaurant with id '
+                                         f'{spec["restaurant_id"]} '
+                                         f'does not exist'})
+            else:
+                _assign(order, items)
+                all_items.extend(items)
+                created_items.append((order, items))
+                results.append({'order_id': order.id,
+                                'failed_dishes_ids': failed})
+        DishOrder.objects.bulk_create(all_items)
+        revenue.record_created(created_items)
+
+    return results
+
+
+def total_drift() -> List[Tuple[int, Decimal, Decimal]]:
+    """
+    Orders whose stored total differs from the sum of their items,
+    as tuples of the order id, the stored and the actual total.
+    """
+    cent = Decimal('0.01')
+    rows = (Order.objects.annotate(actual=Order.objects.computed_total())
+                         .order_by('id')
+                         .values_list('id', 'total', 'actual')
+                         .iterator())
+    # Sums come back as floats on some backends, compare them in cents
+    return [(order_id, total, Decimal(actual).quantize(cent))
+            for order_id, total, actual in rows
+            if Decimal(total).quantize(cent) != Decimal(actual).quantize(cent)]
+
+
+def transition_orders(orders: QuerySet, status: int,
+                      limit: Optional[int] = None
+                      ) -> Tuple[List[int], List[int]]:
+    """
+    Move orders to the status, where Order.TRANSITIONS allows it,
+    with a single UPDATE guarded by the current status.
+    Only `limit` orders with the lowest ids are handled at once,
+    MAX_TRANSITION_SIZE by default.
+
+    Returns ids of the changed orders and of the orders
+    that can't be moved to the status from their current one.
+    """
+    allowed = [current for current, targets in Order.TRANSITIONS.items()
+               if status in targets]
+    if limit is None:
+        limit = MAX_TRANSITION_SIZE
+    with transaction.atomic():
+        # Locked rows can't change status until the UPDATE is done,
+        # so the reported ids are exactly the ones it changes
+        current = list(orders.select_for_update()
+                             .order_by('id')
+                             .values_list('id', 'status')[:limit])
+        changed = [pk for pk, current_status in current
+                   if current_status in allowed]
+        rejected = [pk for pk, current_status in current
+                    if current_status not in allowed]
+        if changed:
+            orders = Order.objects.filter(pk__in=changed, status__in=allowed)
+            rollups = revenue.aggregate(orders)
+            orders.update(status=status, updated_at=timezone.now())
+            revenue.record_transition(rollups, status)
+    return changed, rejected
@@ -0,0 +1,105 @@
+"""
+Read-through cache of the reference data used to create orders:
+restaurants and dish prices.
+
+Entries are loaded from the database on the first request and kept
+in process memory. They are tied to a version number kept in the same
+backend as the menu snapshots. Saving or deleting a restaurant or a dish,
+and changing them with QuerySet.update(), bumps it right away and once
+more after commit. The version reaches other processes when that backend
+is shared (SNAPSHOT_SHARED_DIRECTORY or a shared CACHES), which
+SNAPSHOT_REQUIRE_SHARED enforces in production. Otherwise it expires
+after SNAPSHOT_LOCAL_TTL. Entries also expire after REFERENCE_CACHE_TTL,
+which bounds changes made outside of Django, e.g. by raw SQL.
+"""
+import time
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import Dish, Restaurant
+from .snapshots import default_backend
+
+
+class References(object):
+    """Entries loaded for a single version"""
+    def __init__(self, version: int, expires_at: float):
+        self.version = version
+        self.expires_at = expires_at
+        self.restaurants: Dict[int, Restaurant] = {}
+        self.prices: Dict[int, Decimal] = {}
+
+
+class ReferenceCache(object):
+    """
+    Only existing objects are cached, so that requests with made up ids
+    can't fill the memory. Such ids are looked up every time.
+    """
+    def __init__(self, name: str, ttl: Optional[float] = None,
+                 backend=None):
+        self.name = name
+        self._ttl = ttl
+        self._backend = backend
+        self._local: Optional[References] = None
+
+    @property
+    def backend(self):
+        # Resolved lazily, since settings may not be configured on import
+        if self._backend is None:
+            self._backend = default_backend(self.name)
+        return self._backend
+
+    @property
+    def ttl(self) -> float:
+        if self._ttl is None:
+            return settings.REFERENCE_CACHE_TTL
+        return self._ttl
+
+    def invalidate(self):
+        # Same as for snapshots: entries loaded from the uncommitted
+        # state are thrown away by the second bump after commit
+        self.backend.bump()
+        transaction.on_commit(self.backend.bump)
+
+    def current(self) -> References:
+        """
+        Entries of the current version. The version is read before
+        anything is loaded, so entries loaded concurrently with a change
+        end up in the entries of the version they were loaded for.
+        """
+        version = self.backend.version()
+        references = self._local
+        if (references is None or references.version != version
+                or references.expires_at <= time.time()):
+            references = References(version, time.time() + self.ttl)
+            self._local = references
+        return references
+
+    def restaurants(self, ids: Iterable[int]) -> Dict[int, Restaurant]:
+        """Existing restaurants among the ids"""
+        references = self.current()
+        ids = set(ids)
+        missing = ids - references.restaurants.keys()
+        if missing:
+            references.restaurants.update(
+                (restaurant.id, restaurant)
+                for restaurant in Restaurant.objects.filter(pk__in=missing))
+        return {pk: references.restaurants[pk] for pk in ids
+                if pk in references.restaurants}
+
+    def prices(self, dish_ids: Iterable[int]) -> Dict[int, Decimal]:
+        """Prices of existing dishes among the ids"""
+        references = self.current()
+        dish_ids = set(dish_ids)
+        missing = dish_ids - references.prices.keys()
+        if missing:
+            references.prices.update(
+                Dish.objects.filter(pk__in=missing).values_list('id',
+                                                                'price'))
+        return {pk: references.prices[pk] for pk in dish_ids
+                if pk in references.prices}
+
+
+references = ReferenceCache('references')
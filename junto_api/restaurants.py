@@ -0,0 +1,19 @@
+from typing import Iterable
+
+from .models import Restaurant
+from .snapshots import SnapshotCache
+
+
+def build_restaurants(fields: Iterable[str] = Restaurant.FIELDS) -> dict:
+    """Fields that aren't requested are not loaded from the database"""
+    restaurants = Restaurant.objects.order_by('id').only('id', *fields)
+    return {
+        'restaurants': {
+            'count': len(restaurants),
+            'items': [restaurant.serialize(fields)
+                      for restaurant in restaurants]
+        }
+    }
+
+
+restaurants_snapshot = SnapshotCache('restaurants', build_restaurants)
@@ -0,0 +1,229 @@
+"""
+Daily revenue rollups per restaurant and per dish.
+
+Every rollup row holds the number of orders, the number of portions
+and the revenue of a restaurant or a dish for a day and an order status.
+Rows are updated along with orders: created orders are added to their
+day and PENDING status, orders that change status are moved between
+statuses. `rebuild` recomputes everything from the current and archived
+orders, it fixes rows after orders or their items were edited by hand.
+"""
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple, Type
+
+from django.db import IntegrityError, transaction
+from django.db.models import (Case, Count, DecimalField, ExpressionWrapper, F,
+                              IntegerField, QuerySet, Sum, Value, When)
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from .models import (ArchivedDishOrder, ArchivedOrder, DailyRevenue,
+                     DishOrder, DishRevenue, Order, RestaurantRevenue)
+
+# (restaurant or dish id, day, status) -> [orders, items, revenue]
+Deltas = Dict[Tuple[int, datetime.date, int], List]
+
+COLUMNS = ('orders', 'items', 'revenue')
+
+
+def _deltas() -> Deltas:
+    return defaultdict(lambda: [0, 0, Decimal(0)])
+
+
+def _add(deltas: Deltas, key: tuple, orders: int, items: int,
+         revenue: Decimal):
+    delta = deltas[key]
+    delta[0] += orders
+    delta[1] += items
+    delta[2] += revenue
+
+
+def _increment(column: str, key_field: str, values: Dict[int, object]):
+    output_field = (DecimalField(max_digits=14, decimal_places=2)
+                    if column == 'revenue' else IntegerField())
+    return F(column) + Case(*[When(**{key_field: key}, then=Value(value))
+                              for key, value in values.items()],
+                            default=Value(0), output_field=output_field)
+
+
+def _apply(model: Type[DailyRevenue], key_field: str, deltas: Deltas):
+    """
+    Add deltas to the rows with a single UPDATE per day and status.
+    Rows are only created when some of them don't exist yet.
+    """
+    groups = defaultdict(dict)
+    for (key, day, status), delta in deltas.items():
+        groups[day, status][key] = delta
+
+    for (day, status), group in groups.items():
+        rows = model.objects.filter(date=day, status=status,
+                                    **{f'{key_field}__in': group})
+        updated = rows.update(**{
+            column: _increment(column, key_field,
+                               {key: delta[i] for key, delta in group.items()})
+            for i, column in enumerate(COLUMNS)
+        })
+        if updated == len(group):
+            continue
+
+        existing = set(rows.values_list(key_field, flat=True))
+        missing = {(key, day, status): delta for key, delta in group.items()
+                   if key not in existing}
+        try:
+            with transaction.atomic():
+                model.objects.bulk_create([
+                    model(date=day, status=status, **{key_field: key},
+                          **dict(zip(COLUMNS, delta)))
+                    for (key, _, _), delta in missing.items()
+                ])
+        except IntegrityError:
+            # Created by a concurrent transaction in the meantime
+            _apply(model, key_field, missing)
+
+
+def record_created(orders: Iterable[Tuple[Order, List[DishOrder]]]):
+    """Add new orders, given along with their items, to the rollups"""
+    restaurants, dishes = _deltas(), _deltas()
+    for order, items in orders:
+        day = timezone.localdate(order.created_at)
+        _add(restaurants, (order.restaurant_id, day, order.status), 1,
+             sum(item.quantity for item in items), order.total)
+        for item in items:
+            # Items of a dish are combined, so the dish is counted once
+            _add(dishes, (item.dish_id, day, order.status), 1, item.quantity,
+                 item.current_price * item.quantity)
+    _apply(RestaurantRevenue, 'restaurant_id', restaurants)
+    _apply(DishRevenue, 'dish_id', dishes)
+
+
+def aggregate(orders: QuerySet,
+              restaurants: Optional[Deltas] = None,
+              dishes: Optional[Deltas] = None) -> Tuple[Deltas, Deltas]:
+    """
+    Rollups of the orders, either current or archived ones,
+    per restaurant and per dish, computed in SQL.
+    Rollups are added to the given ones.
+    """
+    if restaurants is None:
+        restaurants, dishes = _deltas(), _deltas()
+    items_model = (ArchivedDishOrder if orders.model is ArchivedOrder
+                   else DishOrder)
+    rows = (orders.order_by()
+                  .annotate(day=TruncDate('created_at'))
+                  .values('restaurant_id', 'day', 'status')
+                  .annotate(orders=Count('id'), revenue=Sum('total')))
+    for row in rows:
+        _add(restaurants, (row['restaurant_id'], row['day'], row['status']),
+             row['orders'], 0, row['revenue'])
+
+    items = (items_model.objects.filter(order__in=orders)
+                                .order_by()
+                                .annotate(day=TruncDate('order__created_at'),
+                                          status=F('order__status')))
+    rows = (items.values('order__restaurant_id', 'day', 'status')
+                 .annotate(items=Sum('quantity')))
+    for row in rows:
+        _add(restaurants, (row['order__restaurant_id'], row['day'],
+                           row['status']),
+             0, row['items'], Decimal(0))
+
+    amount = ExpressionWrapper(F('current_price') * F('quantity'),
+                               output_field=DecimalField(max_digits=14,
+                                                         decimal_places=2))
+    rows = (items.values('dish_id', 'day', 'status')
+                 .annotate(orders=Count('order_id', distinct=True),
+                           items=Sum('quantity'),
+                           revenue=Sum(amount)))
+    for row in rows:
+        _add(dishes, (row['dish_id'], row['day'], row['status']),
+             row['orders'], row['items'], row['revenue'])
+    return restaurants, dishes
+
+
+def record_transition(rollups: Tuple[Deltas, Deltas], status: int):
+    """
+    Move orders to the status in the rollups.
+    `rollups` should be aggregated before the status was changed.
+    """
+    for model, key_field, deltas in zip((RestaurantRevenue, DishRevenue),
+                                        ('restaurant_id', 'dish_id'),
+                                        rollups):
+        moved = _deltas()
+        for (key, day, current), (orders, items, revenue) in deltas.items():
+            _add(moved, (key, day, current), -orders, -items, -revenue)
+            _add(moved, (key, day, status), orders, items, revenue)
+        _apply(model, key_field, moved)
+        # Rows left without orders would only bloat the reports
+        model.objects.filter(date__in={day for _, day, _ in deltas},
+                             status__in={current for _, _, current in deltas},
+                             orders=0).delete()
+
+
+def rebuild() -> Tuple[int, int]:
+    """
+    Recompute all rollups from the orders.
+    Returns the number of restaurant and dish rows.
+    """
+    with transaction.atomic():
+        RestaurantRevenue.objects.all().delete()
+        DishRevenue.objects.all().delete()
+        restaurants, dishes = aggregate(Order.objects.all())
+        aggregate(ArchivedOrder.objects.all(), restaurants, dishes)
+        for model, key_field, deltas in ((RestaurantRevenue, 'restaurant_id',
+                                          restaurants),
+                                         (DishRevenue, 'dish_id', dishes)):
+            model.objects.bulk_create([
+                model(date=day, status=status, **{key_field: key},
+                      **dict(zip(COLUMNS, delta)))
+                for (key, day, status), delta in deltas.items()
+            ], batch_size=1000)
+    return len(restaurants), len(dishes)
+
+
+ROLLUPS = {
+    'restaurant': (RestaurantRevenue, 'restaurant_id'),
+    'dish': (DishRevenue, 'dish_id'),
+}
+
+
+def report(params: dict) -> List[dict]:
+    """
+    Daily rollup rows selected by query parameters:
+    `by` is either restaurant (the default) or dish,
+    `since` and `until` are inclusive ISO 8601 dates,
+    `status` and `id` select a single status and restaurant or dish.
+    Raises ValueError on malformed values.
+    """
+    by = params.get('by', 'restaurant')
+    if by not in ROLLUPS:
+        raise ValueError(f'by should be one of {", ".join(ROLLUPS)}')
+    model, key_field = ROLLUPS[by]
+
+    rows = model.objects.all()
+    for param, lookup in (('since', 'date__gte'), ('until', 'date__lte')):
+        value = params.get(param)
+        if value is not None:
+            day = parse_date(value)
+            if day is None:
+                raise ValueError(f'{param} should be an ISO 8601 date')
+            rows = rows.filter(**{lookup: day})
+    for param, field in (('status', 'status'), ('id', key_field)):
+        value = params.get(param)
+        if value is not None:
+            try:
+                rows = rows.filter(**{field: int(value)})
+            except ValueError:
+                raise ValueError(f'{param} should be an integer')
+
+    return [{
+        'date': row['date'].isoformat(),
+        by + '_id': row[key_field],
+        'status': row['status'],
+        'orders': row['orders'],
+        'items': row['items'],
+        'revenue': str(row['revenue'])
+    } for row in rows.order_by('date', key_field, 'status')
+                     .values('date', key_field, 'status', *COLUMNS)]
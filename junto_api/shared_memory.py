@@ -0,0 +1,159 @@
+"""
+Snapshots shared between worker processes through memory-mapped files.
+
+Point SNAPSHOT_SHARED_DIRECTORY to a tmpfs directory (e.g. /dev/shm/junto)
+and every gunicorn worker on the host will map the same pages instead
+of building and holding its own copy of the payload.
+"""
+import contextlib
+import fcntl
+import mmap
+import os
+import struct
+import tempfile
+import time
+from typing import Optional
+
+from .snapshots import Snapshot
+
+MAGIC = b'JSN1'
+# magic, version, sha1 digest, number of variants
+HEADER = struct.Struct('<4sQ40sB')
+# content coding, offset, length
+VARIANT = struct.Struct('<8sQQ')
+IDENTITY = b'identity'
+
+COUNTER = struct.Struct('<Q')
+
+
+@contextlib.contextmanager
+def flocked(path: str):
+    """Exclusive flock of the file, which is created if needed"""
+    with open(path, 'ab') as file:
+        fcntl.flock(file, fcntl.LOCK_EX)
+        yield
+
+
+class SharedCounter(object):
+    """64-bit counter kept in a memory-mapped file"""
+    def __init__(self, path: str):
+        self.path = path
+        self._map: Optional[mmap.mmap] = None
+
+    def _open(self) -> mmap.mmap:
+        if self._map is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                if os.fstat(fd).st_size < COUNTER.size:
+                    # Start from a timestamp, so that a recreated counter
+                    # never comes back with a value that has been used
+                    os.write(fd, COUNTER.pack(int(time.time() * 10 ** 6)))
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                self._map = mmap.mmap(fd, COUNTER.size)
+            finally:
+                os.close(fd)
+        return self._map
+
+    def value(self) -> int:
+        return COUNTER.unpack_from(self._open())[0]
+
+    def increment(self) -> int:
+        counter = self._open()
+        with flocked(self.path):
+            value = COUNTER.unpack_from(counter)[0] + 1
+            COUNTER.pack_into(counter, 0, value)
+        return value
+
+
+def write_snapshot(path: str, snapshot: Snapshot):
+    """
+    Write the snapshot next to `path` and atomically rename it into place.
+
+    Readers either map the old file or the new one, never a partial write.
+    Mappings of the old file stay valid until they are dropped.
+    """
+    variants = [(IDENTITY, snapshot.body)]
+    variants += [(encoding.encode(), content)
+                 for encoding, content in snapshot.variants.items()]
+
+    offset = HEADER.size + VARIANT.size * len(variants)
+    header = [HEADER.pack(MAGIC, snapshot.version, snapshot.digest.encode(),
+                          len(variants))]
+    for encoding, content in variants:
+        header.append(VARIANT.pack(encoding, offset, len(content)))
+        offset += len(content)
+
+    directory = os.path.dirname(path)
+    fd, temporary_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            file.writelines(header)
+            file.writelines(content for _, content in variants)
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.unlink(temporary_path)
+        raise
+
+
+def read_snapshot(path: str) -> Optional[Snapshot]:
+    """Map the snapshot file, payloads are memoryviews into the mapping"""
+    try:
+        with open(path, 'rb') as file:
+            mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    magic, version, digest, count = HEADER.unpack_from(mapping)
+    if magic != MAGIC:
+        return None
+
+    view = memoryview(mapping)
+    body = None
+    variants = {}
+    for i in range(count):
+        encoding, offset, length = VARIANT.unpack_from(
+            mapping, HEADER.size + VARIANT.size * i)
+        content = view[offset:offset + length]
+        encoding = encoding.rstrip(b'\0')
+        if encoding == IDENTITY:
+            body = content
+        else:
+            variants[encoding.decode()] = content
+
+    return Snapshot(version, body, digest=digest.decode(), variants=variants)
+
+
+class SharedMemorySnapshotBackend(object):
+    """
+    Snapshot backend for several processes on the same host.
+
+    The version counter and the snapshot both live in memory-mapped files,
+    so an invalidation in one worker is seen by all others
+    and the payload is built by a single worker and mapped by the rest.
+    """
+    shared = True
+
+    def __init__(self, name: str, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, f'{name}.snapshot')
+        self.counter = SharedCounter(os.path.join(directory, f'{name}.version'))
+        self.lock_path = os.path.join(directory, f'{name}.lock')
+
+    def version(self) -> int:
+        return self.counter.value()
+
+    def bump(self):
+        self.counter.increment()
+
+    def load(self) -> Optional[Snapshot]:
+        return read_snapshot(self.path)
+
+    def lock(self):
+        """Held while a snapshot is built, released if the holder dies"""
+        return flocked(self.lock_path)
+
+    def store(self, snapshot: Snapshot) -> Snapshot:
+        write_snapshot(self.path, snapshot)
+        # Serve from the shared mapping and let the private copy go
+        return read_snapshot(self.path) or snapshot
@@ -0,0 +1,101 @@
+from django.db.models.signals import (post_save, pre_delete, post_delete,
+                                      m2m_changed)
+from django.contrib.auth.models import User
+from django.dispatch import receiver
+
+from .auth import denylist, user_cache
+from .menu import menu_snapshot, record_changes
+from .models import Category, Dish, DishOrder, MenuChange, Restaurant
+from .references import references
+from .restaurants import restaurants_snapshot
+
+MENU_KINDS = {
+    Category: MenuChange.CATEGORY,
+    Dish: MenuChange.DISH,
+}
+
+
+@receiver(post_save, sender=Dish)
+@receiver(post_delete, sender=Dish)
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_references(sender, **kwargs):
+    references.invalidate()
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Dish)
+def menu_object_saved(sender, instance, **kwargs):
+    record_changes(MENU_KINDS[sender], [instance.id])
+    menu_snapshot.invalidate()
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance: Category, **kwargs):
+    # Subcategories lose their supercategory and dishes lose the category
+    # without sending any signals of their own
+    instance.detach_subcategories()
+    record_changes(MenuChange.CATEGORY,
+                   instance.subcategories.values_list('id', flat=True))
+    record_changes(MenuChange.DISH,
+                   instance.dishes.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Dish)
+def menu_object_deleted(sender, instance, **kwargs):
+    record_changes(MENU_KINDS[sender], [instance.id], MenuChange.DELETED)
+    menu_snapshot.invalidate()
+
+
+@receiver(m2m_changed, sender=Dish.categories.through)
+def dish_categories_changed(sender, instance, action: str, reverse: bool,
+                            pk_set: set, **kwargs):
+    if action in ('post_add', 'post_remove'):
+        dish_ids = pk_set if reverse else [instance.id]
+    elif action == 'pre_clear':
+        # Ids are only known before the relations are gone
+        dish_ids = (instance.dishes.values_list('id', flat=True)
+                    if reverse else [instance.id])
+    elif action == 'post_clear':
+        menu_snapshot.invalidate()
+        return
+    else:
+        return
+
+    record_changes(MenuChange.DISH, dish_ids)
+    menu_snapshot.invalidate()
+
+
+@receiver(post_save, sender=Restaurant)
+@receiver(post_delete, sender=Restaurant)
+def invalidate_restaurants(sender, **kwargs):
+    restaurants_snapshot.invalidate()
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance: User, **kwargs):
+    user_cache.invalidate(instance.id)
+
+
+@receiver(post_save, sender=User)
+def update_denylist(sender, instance: User, update_fields=None, **kwargs):
+    # Logins only save last_login
+    if update_fields is not None and 'is_active' not in update_fields:
+        return
+    if instance.is_active:
+        denylist.allow(instance.id)
+    else:
+        denylist.deny(instance.id)
+
+
+@receiver(post_delete, sender=User)
+def deny_deleted_user(sender, instance: User, **kwargs):
+    denylist.deny(instance.id)
+
+
+@receiver(post_delete, sender=DishOrder)
+def update_order_total(sender, instance: DishOrder, **kwargs):
+    # Sent for cascades and queryset deletes as well
+    DishOrder.deleted([instance.order_id])
@@ -0,0 +1,281 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import time
+import uuid
+import zlib
+from typing import Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.http import HttpRequest, HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# Content codings we can serve, most preferred first
+ENCODINGS = ('br', 'gzip', 'deflate')
+
+
+def _compress(body: bytes) -> Dict[str, bytes]:
+    variants = {
+        'gzip': gzip.compress(body),
+        'deflate': zlib.compress(body),
+    }
+    if brotli is not None:
+        variants['br'] = brotli.compress(body)
+    return variants
+
+
+def accepted_encodings(header: str) -> set:
+    """Parse Accept-Encoding header into a set of acceptable codings"""
+    accepted = set()
+    for item in header.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        quality = 1.0
+        for param in params:
+            if param.startswith('q='):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+
+class Snapshot(object):
+    """
+    JSON payload rendered to bytes once, along with its compressed
+    variants and a strong ETag for each of them
+    """
+    def __init__(self, version: int, body: bytes, digest: str,
+                 variants: Dict[str, bytes]):
+        self.version = version
+        self.body = body
+        self.digest = digest
+        self.variants = variants
+
+    @classmethod
+    def render(cls, version: int, data: dict) -> 'Snapshot':
+        body = json.dumps(data, cls=DjangoJSONEncoder).encode()
+        return cls(version, body,
+                   digest=hashlib.sha1(body).hexdigest(),
+                   variants=_compress(body))
+
+    def negotiate(self, accept_encoding: str) -> Optional[str]:
+        accepted = accepted_encodings(accept_encoding)
+        for encoding in ENCODINGS:
+            if encoding in self.variants and (encoding in accepted
+                                              or '*' in accepted):
+                return encoding
+        return None
+
+    def etag(self, encoding: Optional[str] = None) -> str:
+        # Every representation has its own bytes, hence its own strong ETag
+        if encoding is None:
+            return f'"{self.digest}"'
+        return f'"{self.digest}-{encoding}"'
+
+    def content(self, encoding: Optional[str] = None) -> bytes:
+        if encoding is None:
+            return self.body
+        return self.variants[encoding]
+
+
+# Size of the slices a payload is written out in
+CHUNK_SIZE = 64 * 1024
+
+
+def _slices(payload: memoryview) -> Iterator[memoryview]:
+    for offset in range(0, len(payload), CHUNK_SIZE):
+        yield payload[offset:offset + CHUNK_SIZE]
+
+
+class SnapshotResponse(StreamingHttpResponse):
+    """
+    Writes out a stored payload in slices of its memoryview, so that
+    a payload mapped from a shared snapshot is never copied as a whole.
+    Only the slice being written is turned into bytes, as WSGI requires.
+    """
+    def __init__(self, payload, **kwargs):
+        self.payload = memoryview(payload)
+        super().__init__(_slices(self.payload), **kwargs)
+        self['Content-Length'] = len(self.payload)
+
+    def make_bytes(self, value) -> bytes:
+        # Not every Django version converts memoryviews
+        return bytes(value)
+
+    @property
+    def content(self) -> bytes:
+        # For callers that need the whole body at once, e.g. the test client
+        return bytes(self.payload)
+
+
+def snapshot_response(request: HttpRequest,
+                      snapshot: Snapshot) -> HttpResponse:
+    """Serve stored bytes of the snapshot, answering 304 when possible"""
+    encoding = snapshot.negotiate(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = snapshot.etag(encoding)
+
+    response = get_conditional_response(request, etag=etag)
+    if response is None:
+        response = SnapshotResponse(snapshot.content(encoding),
+                                    content_type='application/json')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+    response['ETag'] = etag
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+# Cache backends whose entries are private to a process
+LOCAL_CACHES = ('LocMemCache', 'DummyCache')
+
+
+class CacheSnapshotBackend(object):
+    """
+    Keeps the version counter and the snapshot in the Django cache.
+
+    Invalidations reach other processes only through a cache they share,
+    e.g. memcached or Redis, not through the default LocMemCache. With a
+    cache private to the process the version expires after
+    SNAPSHOT_LOCAL_TTL seconds instead, which bounds how long other
+    processes serve data invalidated by this one.
+    """
+    def __init__(self, name: str):
+        self.version_key = f'snapshot:{name}:version'
+        self.snapshot_key = f'snapshot:{name}'
+        self.lock_key = f'snapshot:{name}:lock'
+
+    @property
+    def shared(self) -> bool:
+        return type(caches['default']).__name__ not in LOCAL_CACHES
+
+    @property
+    def timeout(self) -> Optional[float]:
+        return None if self.shared else settings.SNAPSHOT_LOCAL_TTL
+
+    def version(self) -> int:
+        version = cache.get(self.version_key)
+        if version is None:
+            # Start from a timestamp, so that an evicted or expired counter
+            # never comes back with a value that has already been used
+            version = int(time.time() * 10 ** 6)
+            if not cache.add(self.version_key, version, self.timeout):
+                version = cache.get(self.version_key, version)
+        return version
+
+    def bump(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            self.version()
+
+    def load(self) -> Optional[Snapshot]:
+        return cache.get(self.snapshot_key)
+
+    def store(self, snapshot: Snapshot) -> Snapshot:
+        cache.set(self.snapshot_key, snapshot, None)
+        return snapshot
+
+    @contextlib.contextmanager
+    def lock(self, timeout: float = 10):
+        """
+        Lock held while a snapshot is built. It is only a best effort:
+        a waiter builds anyway after `timeout` seconds, and the lock
+        expires by itself if its holder dies.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        while not cache.add(self.lock_key, token, timeout):
+            if time.time() > deadline:
+                break
+            time.sleep(0.05)
+        try:
+            yield
+        finally:
+            if cache.get(self.lock_key) == token:
+                cache.delete(self.lock_key)
+
+
+def default_backend(name: str):
+    """
+    Shared memory in SNAPSHOT_SHARED_DIRECTORY when it is set,
+    the Django cache otherwise. With SNAPSHOT_REQUIRE_SHARED a backend
+    private to the process is refused, since every other worker would
+    keep serving data invalidated by this one.
+    """
+    if settings.SNAPSHOT_SHARED_DIRECTORY:
+        from .shared_memory import SharedMemorySnapshotBackend
+        return SharedMemorySnapshotBackend(name,
+                                           settings.SNAPSHOT_SHARED_DIRECTORY)
+    backend = CacheSnapshotBackend(name)
+    if settings.SNAPSHOT_REQUIRE_SHARED and not backend.shared:
+        raise ImproperlyConfigured(
+            'Versions of cached data are not shared between processes: '
+            'set SNAPSHOT_SHARED_DIRECTORY or configure a shared '
+            'default cache in CACHES')
+    return backend
+
+
+class SnapshotCache(object):
+    """
+    Keeps the result of an expensive `build` function in a snapshot
+    backend until `invalidate` is called.
+
+    Every invalidation bumps the version number, so a snapshot built
+    before the change is never served after it. The last snapshot is
+    also kept in process memory, so that a hit doesn't have to fetch
+    the payload from the backend again.
+    """
+    def __init__(self, name: str, build: Callable[[], dict], backend=None):
+        self.name = name
+        self.build = build
+        self._backend = backend
+        self._local: Optional[Snapshot] = None
+
+    @property
+    def backend(self):
+        # Resolved lazily, since settings may not be configured on import
+        if self._backend is None:
+            self._backend = default_backend(self.name)
+        return self._backend
+
+    def version(self) -> int:
+        return self.backend.version()
+
+    def invalidate(self):
+        # Bump right away for readers inside the current transaction
+        # and once again after commit, so that a snapshot built
+        # from the uncommitted state is thrown away as well
+        self.backend.bump()
+        transaction.on_commit(self.backend.bump)
+
+    def get(self) -> Snapshot:
+        version = self.version()
+        snapshot = self._local
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        snapshot = self.backend.load()
+        if snapshot is None or snapshot.version != version:
+            # A single worker builds the snapshot, the others wait for it
+            # and read what it has stored
+            with self.backend.lock():
+                version = self.version()
+                snapshot = self.backend.load()
+                if snapshot is None or snapshot.version != version:
+                    snapshot = Snapshot.render(version, self.build())
+                    snapshot = self.backend.store(snapshot)
+        self._local = snapshot
+        return snapshot
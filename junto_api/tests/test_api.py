@@ -1,9 +1,27 @@
 from django.test import TestCase
-from junto_api.models import User, Category, Dish, Restaurant, Order
+from junto_api.auth import (authenticate_claims, denylist, token_cache,
+                            user_cache, Denylist, Principal)
+from junto_api.checks import check_access_token_claims
+from junto_api.shared_memory import SharedMemorySnapshotBackend
+from junto_api.snapshots import CacheSnapshotBackend
+from junto_api.models import (User, Category, Dish, Restaurant, Order,
+                              RefreshToken, TokenFamily, TokenPurgeRun,
+                              DeniedUser)
 from django.test import Client
 from django.test.utils import override_settings
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.utils import timezone
+from junto_api.token_purge import purge, purge_denylist, purge_stats
+from io import StringIO
+import datetime
+import tempfile
 import time
 import json
+import jwt
+from unittest import mock
+from decimal import Decimal
 
 
 class APIAuthTestCase(TestCase):
@@ -73,13 +91,31 @@ class APIAuthTestCase(TestCase):
         
         self.assertEqual(response.status_code, 200)
         access_token = response.json().get('access', {}).get('token')
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
+        # The verified token is cached, but only until it expires
+        response = self.client.get('/api/menu', **headers)
+        self.assertEqual(response.status_code, 200)
         # Wait for token to expire
         time.sleep(3)
         # Try to access a protected endpoint
-        headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
         response = self.client.get('/api/menu', **headers)
         self.assertEqual(response.status_code, 403)
     
+    def test_verified_token_is_cached(self):
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json().get('access', {}).get('token')
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
+        token_cache.entries.clear()
+        
+        with mock.patch('junto_api.auth.jwt.decode',
+                        wraps=jwt.decode) as decode:
+            for _ in range(3):
+                response = self.client.get('/api/menu', **headers)
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(decode.call_count, 1)
+    
     def test_access_api_with_incorrect_token(self):
         headers = {'HTTP_AUTHORIZATION': 'Bearer obviously wrong token'}
         response = self.client.get('/api/menu', **headers)
@@ -105,6 +141,51 @@ class APIAuthTestCase(TestCase):
         response = self.client.post('/api/auth/refresh',
                                     data={'token': refresh_token})
         self.assertEqual(response.status_code, 403)
+    
+    def test_login_revokes_refresh_tokens(self):
+        tokens = []
+        for _ in range(3):
+            response = self.client.post('/api/auth',
+                                        data={'username': 'test',
+                                              'password': 'SoPasswordMuchStrong'})
+            tokens.append(response.json()['refresh']['token'])
+        
+        # Previous tokens are revoked by the generation alone
+        self.assertFalse(RefreshToken.objects.filter(revoked=True).exists())
+        for token in tokens[:-1]:
+            response = self.client.post('/api/auth/refresh',
+                                        data={'token': token})
+            self.assertEqual(response.status_code, 403)
+        
+        response = self.client.post('/api/auth/refresh',
+                                    data={'token': tokens[-1]})
+        self.assertEqual(response.status_code, 200)
+    
+    def test_legacy_refresh_token(self):
+        """Tokens issued without a generation belong to the first one"""
+        user = User.objects.get(username='test')
+        TokenFamily.objects.update_or_create(user=user,
+                                             defaults={'generation': 0})
+        token = jwt.encode({'type': 'refresh', 'user_id': user.id,
+                            'exp': int(time.time()) + 60},
+                           settings.SECRET_KEY).decode()
+        RefreshToken.objects.create(user=user, value=token)
+        
+        response = self.client.post('/api/auth/refresh', data={'token': token})
+        self.assertEqual(response.status_code, 200)
+        response = self.client.post('/api/auth/refresh', data={'token': token})
+        self.assertEqual(response.status_code, 403)
+    
+    def test_refresh_token_lookup(self):
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        token = response.json()['refresh']['token']
+        
+        refresh_token = RefreshToken.lookup(token).get()
+        self.assertEqual(refresh_token.value, token)
+        self.assertEqual(len(refresh_token.digest), 64)
+        self.assertFalse(RefreshToken.lookup(token + 'x').exists())
 
 
 class APIMethodsTestCase(TestCase):
@@ -250,9 +331,11 @@ class APIMethodsTestCase(TestCase):
         order_id = response.json()['order_id']
         
         order = Order.objects.get(pk=order_id)
-        expected_dish_ids = payload['dish_ids']
-        result_dish_ids = [dish.id for dish in order.dishes.all()]
-        self.assertCountEqual(expected_dish_ids, result_dish_ids)
+        # Repeated dishes are stored as one item with a quantity
+        result = {item.dish_id: item.quantity
+                  for item in order.dishorder_set.all()}
+        self.assertDictEqual(result, {1: 2, 2: 1, 3: 1})
+        self.assertEqual(order.total, Decimal('100649.99'))
     
     def test_create_order_with_incorrect_dish_id(self):
         headers = {'HTTP_AUTHORIZATION': f'Bearer {self.access_token}',
@@ -266,3 +349,260 @@ class APIMethodsTestCase(TestCase):
         self.assertEqual(response.status_code, 200)
         order_id = response.json()['order_id']
         self.assertIn('not id', response.json()['failed_dishes_ids'])
+    
+    def test_create_order_with_string_restaurant_id(self):
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.access_token}',
+                   'content_type': 'application/json'}
+        payload = {'restaurant_id': '1', 'dish_ids': [1]}
+        response = self.client.post('/api/order',
+                                    data=json.dumps(payload),
+                                    **headers)
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=response.json()['order_id'])
+        self.assertEqual(order.restaurant_id, 1)
+
+
+class UserCacheTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='cached',
+                                             password='SoPasswordMuchStrong')
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'cached',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json()['access']['token']
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
+
+    def test_user_is_cached(self):
+        self.client.get('/api/stats/caches', **self.headers)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/stats/caches', **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_invalidation(self):
+        self.client.get('/api/stats/caches', **self.headers)
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get('/api/stats/caches', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['users']),
+                         {'size', 'maxsize', 'hits', 'misses'})
+
+        self.user.delete()
+        response = self.client.get('/api/stats/caches', **self.headers)
+        self.assertEqual(response.status_code, 403)
+
+    def test_copies_are_independent(self):
+        user = user_cache.get(self.user.id)
+        user.first_name = 'Изменено'
+        user._state.adding = True
+        user._state.db = 'other'
+
+        again = user_cache.get(self.user.id)
+        self.assertEqual(again.first_name, '')
+        self.assertFalse(again._state.adding)
+        self.assertEqual(again._state.db, 'default')
+
+
+class TokenPurgeTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='test',
+                                             password='SoPasswordMuchStrong')
+    
+    def create_tokens(self) -> RefreshToken:
+        """Creates stale tokens, returns the only valid one"""
+        now = datetime.datetime.utcnow()
+        expires = now + datetime.timedelta(hours=1)
+        RefreshToken.create_token(self.user, expires, settings.SECRET_KEY,
+                                  TokenFamily.revoke_all(self.user))
+        generation = TokenFamily.revoke_all(self.user)
+        valid = RefreshToken.create_token(self.user, expires,
+                                          settings.SECRET_KEY, generation)
+        RefreshToken.create_token(self.user, now - datetime.timedelta(hours=1),
+                                  settings.SECRET_KEY, generation)
+        revoked = RefreshToken.create_token(self.user,
+                                            expires + datetime.timedelta(1),
+                                            settings.SECRET_KEY, generation)
+        revoked.revoked = True
+        revoked.save()
+        return valid
+    
+    def test_command(self):
+        valid = self.create_tokens()
+        out = StringIO()
+        call_command('purge_refresh_tokens', '--batch-size', '2', '--pause',
+                     '0', stdout=out)
+        self.assertIn('Done, 3 tokens deleted in total', out.getvalue())
+        self.assertEqual(list(RefreshToken.objects.all()), [valid])
+        self.assertEqual(purge_stats()['last_deleted'], 3)
+    
+    @mock.patch('junto_api.management.commands.purge_refresh_tokens.'
+                'connection')
+    def test_command_interval(self, connection):
+        self.create_tokens()
+        command = 'junto_api.management.commands.purge_refresh_tokens'
+        # The second sleep stops the loop
+        with mock.patch(f'{command}.time.sleep',
+                        side_effect=[None, RuntimeError]) as sleep:
+            with self.assertRaises(RuntimeError):
+                call_command('purge_refresh_tokens', '--interval', '60',
+                             '--pause', '0', stdout=StringIO())
+        sleep.assert_called_with(60)
+        self.assertEqual(connection.close.call_count, 2)
+        self.assertEqual(list(TokenPurgeRun.objects.order_by('id')
+                                                   .values_list('deleted',
+                                                                flat=True)),
+                         [3, 0])
+    
+    def test_purge(self):
+        valid = self.create_tokens()
+        self.assertEqual(purge(batch_size=10, pause=0, limit=2)[0], 2)
+        self.assertEqual(purge(batch_size=10, pause=0)[0], 1)
+        self.assertEqual(list(RefreshToken.objects.all()), [valid])
+        stats = purge_stats()
+        self.assertEqual((stats['runs'], stats['deleted'],
+                          stats['last_deleted']), (2, 3, 1))
+    
+    def test_stats_are_exposed(self):
+        self.user.is_staff = True
+        self.user.save()
+        purge(pause=0)
+        client = Client()
+        response = client.post('/api/auth',
+                               data={'username': 'test',
+                                     'password': 'SoPasswordMuchStrong'})
+        access_token = response.json()['access']['token']
+        response = client.get('/api/stats/caches',
+                              HTTP_AUTHORIZATION=f'Bearer {access_token}')
+        self.assertEqual(response.json()['token_purge']['runs'], 1)
+
+
+@override_settings(ACCESS_TOKEN_CLAIMS=True)
+class ClaimsTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        # Claims are refused without versions shared between processes
+        backend = SharedMemorySnapshotBackend('users', self.directory)
+        denied = SharedMemorySnapshotBackend('denylist', self.directory)
+        for patcher in (mock.patch.object(user_cache, '_backend', backend),
+                        mock.patch.object(denylist, '_backend', denied),
+                        mock.patch.object(denylist, '_local', None)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        user_cache.entries.clear()
+        
+        self.user = User.objects.create_user(username='claims',
+                                             password='SoPasswordMuchStrong')
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'claims',
+                                          'password': 'SoPasswordMuchStrong'})
+        self.access_token = response.json()['access']['token']
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {self.access_token}'}
+    
+    def test_user_is_not_loaded(self):
+        self.client.get('/api/menu', **self.headers)
+        user_cache.entries.clear()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/menu', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(user_cache.stats()['size'], 0)
+    
+    def test_principal(self):
+        principal = Principal(self.user.id, True, False)
+        self.assertEqual(principal.pk, self.user.id)
+        with self.assertNumQueries(1):
+            self.assertEqual(principal.username, 'claims')
+            self.assertEqual(principal.get_username(), 'claims')
+    
+    def test_deactivated_user(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get('/api/restaurants', **self.headers)
+        self.assertEqual(response.status_code, 403)
+    
+    def test_deleted_user(self):
+        self.client.get('/api/restaurants', **self.headers)
+        self.user.delete()
+        response = self.client.get('/api/restaurants', **self.headers)
+        self.assertEqual(response.status_code, 403)
+    
+    def test_other_worker(self):
+        other = User.objects.create_user(username='other',
+                                         password='SoPasswordMuchStrong')
+        # Denylist of another worker process, sharing only the version
+        worker = Denylist(backend=SharedMemorySnapshotBackend(
+            'denylist', self.directory))
+        self.assertNotIn(self.user.id, worker)
+        self.assertNotIn(other.id, worker)
+        
+        self.user.is_active = False
+        self.user.save()
+        other_id = other.id
+        other.delete()
+        self.assertIn(self.user.id, worker)
+        self.assertIn(other_id, worker)
+    
+    def test_only_denied_users_are_kept(self):
+        self.assertNotIn(self.user.id, denylist)
+        self.assertFalse(DeniedUser.objects.exists())
+        # Logins update last_login only, the copy isn't reloaded
+        self.client.post('/api/auth', data={'username': 'claims',
+                                            'password': 'SoPasswordMuchStrong'})
+        with self.assertNumQueries(0):
+            self.assertNotIn(self.user.id, denylist)
+        
+        self.user.is_active = False
+        self.user.save()
+        self.assertIn(self.user.id, denylist)
+        self.user.is_active = True
+        self.user.save()
+        self.assertNotIn(self.user.id, denylist)
+        self.assertFalse(DeniedUser.objects.exists())
+    
+    def test_demoted_staff(self):
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'claims',
+                                          'password': 'SoPasswordMuchStrong'})
+        token = response.json()['access']['token']
+        self.assertTrue(authenticate_claims(None, token).is_staff)
+        
+        self.user.is_staff = False
+        self.user.save()
+        # The token still claims staff
+        self.assertFalse(authenticate_claims(None, token).is_staff)
+        response = self.client.post('/api/orders/status',
+                                    data=json.dumps({'status': 1}),
+                                    content_type='application/json',
+                                    HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 403)
+    
+    def test_stale_entries_are_pruned(self):
+        self.user.is_active = False
+        self.user.save()
+        self.assertIn(self.user.id, denylist)
+        later = timezone.now() + datetime.timedelta(
+            seconds=settings.ACCESS_TOKEN_EXPIRATION_TIME)
+        self.assertEqual(purge_denylist(timezone.now()), 0)
+        self.assertEqual(purge_denylist(later), 1)
+        self.assertFalse(DeniedUser.objects.exists())
+        # Allowed again after the pruning
+        self.user.is_active = True
+        self.user.save()
+        self.assertNotIn(self.user.id, denylist)
+    
+    def test_local_versions_are_refused(self):
+        with mock.patch.object(denylist, '_backend',
+                               CacheSnapshotBackend('users')):
+            with self.assertRaises(ImproperlyConfigured):
+                authenticate_claims(None, self.access_token)
+        with self.settings(SNAPSHOT_SHARED_DIRECTORY=None):
+            self.assertEqual([error.id for error
+                              in check_access_token_claims(None)],
+                             ['junto_api.E002'])
+        with self.settings(SNAPSHOT_SHARED_DIRECTORY=self.directory):
+            self.assertEqual(check_access_token_claims(None), [])
@@ -0,0 +1,466 @@
+import datetime
+import gzip
+import multiprocessing
+import tempfile
+import threading
+import time
+import zlib
+from unittest import mock
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.test import TestCase, Client, RequestFactory
+from django.utils import timezone
+from junto_api.models import User, Category, Dish, MenuLogLock, Restaurant
+from junto_api.menu import build_menu, compact_changes, menu_snapshot
+from junto_api.shared_memory import SharedMemorySnapshotBackend
+from junto_api.checks import check_shared_versions
+from junto_api.snapshots import (CacheSnapshotBackend, SnapshotCache,
+                                 default_backend, snapshot_response)
+
+
+def make_menu(width: int, depth: int, dishes_per_category: int):
+    """Create a synthetic menu: `width` children per category, `depth` levels"""
+    level = [None]
+    for _ in range(depth):
+        next_level = []
+        for parent in level:
+            for i in range(width):
+                category = Category.objects.create(name=f'Категория {i}',
+                                                   supercategory=parent)
+                for j in range(dishes_per_category):
+                    dish = Dish.objects.create(name=f'Блюдо {j}', price=j)
+                    category.dishes.add(dish)
+                next_level.append(category)
+        level = next_level
+
+
+class MenuBuilderTestCase(TestCase):
+    def test_menu_shape(self):
+        food = Category.objects.create(name='Еда')
+        burgers = Category.objects.create(name='Бургеры', supercategory=food)
+        cheeseburger = Dish.objects.create(name='Чизбургер', price='50.00')
+        burgers.dishes.add(cheeseburger)
+
+        expected = {
+            'categories': {
+                'count': 1,
+                'items': [
+                    {
+                        'name': 'Еда',
+                        'dishes': {'count': 0, 'items': []},
+                        'subcategories': {
+                            'count': 1,
+                            'items': [
+                                {
+                                    'name': 'Бургеры',
+                                    'dishes': {
+                                        'count': 1,
+                                        'items': [cheeseburger.serialize()]
+                                    },
+                                    'subcategories': {'count': 0, 'items': []}
+                                }
+                            ]
+                        }
+                    }
+                ]
+            }
+        }
+        self.assertDictEqual(build_menu(), expected)
+
+    def test_empty_menu(self):
+        with self.assertNumQueries(3):
+            menu = build_menu()
+        self.assertDictEqual(menu, {'categories': {'count': 0, 'items': []}})
+
+    def test_query_count_does_not_depend_on_menu_size(self):
+        for width, depth in [(1, 1), (2, 3), (3, 4)]:
+            Category.objects.all().delete()
+            Dish.objects.all().delete()
+            make_menu(width, depth, dishes_per_category=2)
+
+            with self.assertNumQueries(3):
+                menu = build_menu()
+            self.assertEqual(menu['categories']['count'], width)
+
+    def test_depth_limited_menu(self):
+        make_menu(width=2, depth=3, dishes_per_category=1)
+
+        with self.assertNumQueries(4):
+            menu = build_menu(max_depth=1)
+        self.assertEqual(menu['categories']['count'], 2)
+        top = menu['categories']['items'][0]
+        self.assertEqual(top['dishes']['count'], 1)
+        self.assertEqual(top['subcategories']['count'], 2)
+        self.assertNotIn('items', top['subcategories'])
+
+        # Expanding the cursor gives the same subtree as the full menu
+        root = Category.objects.get(pk=int(top['subcategories']['cursor']))
+        with self.assertNumQueries(3):
+            subtree = build_menu(root)
+        self.assertEqual(subtree['categories']['items'],
+                         build_menu()['categories']['items'][:1])
+
+    def test_leaves_have_no_cursor(self):
+        make_menu(width=1, depth=2, dishes_per_category=0)
+        top = build_menu(max_depth=2)['categories']['items'][0]
+        leaf = top['subcategories']['items'][0]
+        self.assertEqual(leaf['subcategories'], {'count': 0})
+
+    def test_sparse_fieldsets(self):
+        make_menu(width=2, depth=2, dishes_per_category=1)
+
+        # Without dishes and subcategories only top level names are loaded
+        with self.assertNumQueries(1):
+            menu = build_menu(category_fields={'name'})
+        self.assertEqual(menu['categories']['items'],
+                         [{'name': 'Категория 0'}, {'name': 'Категория 1'}])
+
+        menu = build_menu(category_fields={'dishes', 'subcategories'},
+                          dish_fields={'price'})
+        top = menu['categories']['items'][0]
+        self.assertNotIn('name', top)
+        self.assertEqual(top['dishes']['items'], [{'price': '0.00'}])
+        self.assertEqual(top['subcategories']['count'], 2)
+
+
+class MenuSnapshotTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='test',
+                                 password='SoPasswordMuchStrong')
+        cls.food = Category.objects.create(name='Еда')
+        cls.fries = Dish.objects.create(name='Картофель фри', price='49.99')
+        cls.food.dishes.add(cls.fries)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json().get('access', {}).get('token')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
+
+    def test_cached_menu_makes_no_queries(self):
+        self.client.get('/api/menu', **self.headers)
+        # The user is cached as well
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/menu', **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['categories']['count'], 1)
+
+    def test_not_modified(self):
+        response = self.client.get('/api/menu', **self.headers)
+        etag = response['ETag']
+
+        response = self.client.get('/api/menu', HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(response.content, b'')
+
+    def test_invalidation(self):
+        response = self.client.get('/api/menu', **self.headers)
+        etag = response['ETag']
+
+        self.fries.price = '59.99'
+        self.fries.save()
+        response = self.client.get('/api/menu', HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        dish = response.json()['categories']['items'][0]['dishes']['items'][0]
+        self.assertEqual(dish['price'], '59.99')
+
+        etag = response['ETag']
+        self.food.dishes.remove(self.fries)
+        response = self.client.get('/api/menu', HTTP_IF_NONE_MATCH=etag,
+                                   **self.headers)
+        self.assertEqual(response.status_code, 200)
+        category = response.json()['categories']['items'][0]
+        self.assertEqual(category['dishes']['count'], 0)
+
+    def test_subtree(self):
+        response = self.client.get('/api/menu',
+                                   {'root': self.food.id, 'depth': 1},
+                                   **self.headers)
+        self.assertEqual(response.status_code, 200)
+        category = response.json()['categories']['items'][0]
+        self.assertEqual(category['name'], 'Еда')
+        self.assertEqual(category['subcategories'], {'count': 0})
+
+        response = self.client.get('/api/menu', {'depth': 0}, **self.headers)
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/api/menu', {'root': 100500},
+                                   **self.headers)
+        self.assertEqual(response.status_code, 404)
+
+    def test_fields_parameter(self):
+        Restaurant.objects.create(name='Тестовый ресторан', city='Москва')
+        response = self.client.get('/api/restaurants', {'fields': 'id,city'},
+                                   **self.headers)
+        self.assertEqual(response.json()['restaurants']['items'][0].keys(),
+                         {'id', 'city'})
+
+        response = self.client.get('/api/menu',
+                                   {'fields': 'name,dishes.name'},
+                                   **self.headers)
+        self.assertEqual(response.json()['categories']['items'],
+                         [{'name': 'Еда',
+                           'dishes': {'count': 1,
+                                      'items': [{'name': 'Картофель фри'}]}}])
+
+        for endpoint, fields in [('/api/menu', 'dishes.calories'),
+                                 ('/api/restaurants', 'rating')]:
+            response = self.client.get(endpoint, {'fields': fields},
+                                       **self.headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_compressed_menu(self):
+        plain = self.client.get('/api/menu', **self.headers)
+
+        response = self.client.get('/api/menu', HTTP_ACCEPT_ENCODING='gzip',
+                                   **self.headers)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response['Vary'])
+        self.assertNotEqual(response['ETag'], plain['ETag'])
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+
+        response = self.client.get('/api/menu',
+                                   HTTP_ACCEPT_ENCODING='gzip;q=0, deflate',
+                                   **self.headers)
+        self.assertEqual(response['Content-Encoding'], 'deflate')
+        self.assertEqual(zlib.decompress(response.content), plain.content)
+
+    def test_restaurants_invalidation(self):
+        response = self.client.get('/api/restaurants', **self.headers)
+        self.assertEqual(response.json()['restaurants']['count'], 0)
+
+        Restaurant.objects.create(name='Тестовый ресторан', city='Москва')
+        response = self.client.get('/api/restaurants', **self.headers)
+        self.assertEqual(response.json()['restaurants']['count'], 1)
+
+
+def _read_shared_snapshot(directory: str, queue: multiprocessing.Queue):
+    backend = SharedMemorySnapshotBackend('menu', directory)
+    snapshot = backend.load()
+    queue.put((backend.version(), snapshot.version, bytes(snapshot.body)))
+
+
+class SharedSnapshotTestCase(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.builds = 0
+
+    def build(self) -> dict:
+        self.builds += 1
+        return {'builds': self.builds}
+
+    def worker(self) -> SnapshotCache:
+        backend = SharedMemorySnapshotBackend('menu', self.directory)
+        return SnapshotCache('menu', self.build, backend=backend)
+
+    def test_snapshot_is_built_once_for_all_workers(self):
+        first, second = self.worker(), self.worker()
+
+        snapshot = first.get()
+        self.assertEqual(bytes(second.get().body), bytes(snapshot.body))
+        self.assertEqual(second.get().etag(), snapshot.etag())
+        self.assertEqual(gzip.decompress(second.get().content('gzip')),
+                         b'{"builds": 1}')
+        self.assertEqual(self.builds, 1)
+
+    def test_invalidation_is_seen_by_other_workers(self):
+        first, second = self.worker(), self.worker()
+        old = second.get()
+
+        first.invalidate()
+        new = second.get()
+        self.assertGreater(new.version, old.version)
+        self.assertEqual(bytes(new.body), b'{"builds": 2}')
+        # The old mapping is still readable after the file was replaced
+        self.assertEqual(bytes(old.body), b'{"builds": 1}')
+
+    def test_rebuild_is_done_by_one_worker(self):
+        first, second = self.worker(), self.worker()
+        waiting = {}
+
+        def build() -> dict:
+            # Another worker asks for the snapshot while it is being built
+            thread = threading.Thread(
+                target=lambda: waiting.update(snapshot=second.get()))
+            thread.start()
+            thread.join(0.2)
+            self.assertTrue(thread.is_alive())
+            waiting['thread'] = thread
+            return self.build()
+
+        first.build = build
+        snapshot = first.get()
+        waiting['thread'].join(10)
+        self.assertEqual(bytes(waiting['snapshot'].body),
+                         bytes(snapshot.body))
+        self.assertEqual(self.builds, 1)
+
+    def test_response_is_streamed_from_the_mapping(self):
+        snapshot = self.worker().get()
+        response = snapshot_response(RequestFactory().get('/'), snapshot)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Length'], str(len(snapshot.body)))
+        # A view of the mapped payload rather than a copy of it
+        self.assertIs(response.payload.obj, snapshot.body.obj)
+        self.assertEqual(b''.join(response.streaming_content),
+                         bytes(snapshot.body))
+
+    def test_snapshot_is_readable_from_another_process(self):
+        snapshot = self.worker().get()
+
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(target=_read_shared_snapshot,
+                                          args=(self.directory, queue))
+        process.start()
+        process.join(10)
+        self.assertEqual(queue.get(timeout=1),
+                         (snapshot.version, snapshot.version,
+                          bytes(snapshot.body)))
+
+
+class SnapshotBackendTestCase(TestCase):
+    def test_local_versions_expire(self):
+        backend = CacheSnapshotBackend('expiring')
+        cache.delete(backend.version_key)
+        with self.settings(SNAPSHOT_LOCAL_TTL=0.05):
+            version = backend.version()
+            self.assertEqual(backend.version(), version)
+            time.sleep(0.1)
+            # Another process that missed an invalidation moves on
+            self.assertGreater(backend.version(), version)
+
+    def test_local_cache_is_refused(self):
+        with self.settings(SNAPSHOT_SHARED_DIRECTORY=None,
+                           SNAPSHOT_REQUIRE_SHARED=True):
+            with self.assertRaises(ImproperlyConfigured):
+                default_backend('menu')
+            self.assertEqual([error.id for error
+                              in check_shared_versions(None)],
+                             ['junto_api.E001'])
+
+    def test_shared_backends(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        with self.settings(SNAPSHOT_SHARED_DIRECTORY=directory.name,
+                           SNAPSHOT_REQUIRE_SHARED=True):
+            self.assertTrue(default_backend('menu').shared)
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }}
+        with self.settings(SNAPSHOT_SHARED_DIRECTORY=None,
+                           SNAPSHOT_REQUIRE_SHARED=True, CACHES=caches):
+            self.assertTrue(default_backend('menu').shared)
+            self.assertEqual(check_shared_versions(None), [])
+
+
+class MenuChangesTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='test',
+                                 password='SoPasswordMuchStrong')
+
+    def setUp(self):
+        self.food = Category.objects.create(name='Еда')
+        self.burgers = Category.objects.create(name='Бургеры',
+                                               supercategory=self.food)
+        self.fries = Dish.objects.create(name='Картофель фри', price='49.99')
+        self.cheeseburger = Dish.objects.create(name='Чизбургер', price='50')
+        self.food.dishes.add(self.fries)
+        self.burgers.dishes.add(self.cheeseburger)
+
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json().get('access', {}).get('token')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}'}
+
+    def changes(self, since: int) -> dict:
+        response = self.client.get('/api/menu/changes', {'since': since},
+                                   **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_full_sync(self):
+        changes = self.changes(0)
+        self.assertTrue(changes['full'])
+        self.assertCountEqual(
+            [category['name'] for category in changes['categories']['changed']],
+            ['Еда', 'Бургеры'])
+        dishes = {dish['id']: dish for dish in changes['dishes']['changed']}
+        self.assertEqual(dishes[self.fries.id]['category_ids'], [self.food.id])
+
+    def test_incremental_sync(self):
+        version = self.changes(0)['version']
+        self.assertEqual(self.changes(version)['dishes'],
+                         {'changed': [], 'removed': []})
+
+        cheeseburger_id = self.cheeseburger.id
+        self.fries.price = '59.99'
+        self.fries.save()
+        self.cheeseburger.delete()
+
+        changes = self.changes(version)
+        self.assertFalse(changes['full'])
+        self.assertGreater(changes['version'], version)
+        self.assertEqual([dish['price'] for dish in changes['dishes']['changed']],
+                         ['59.99'])
+        self.assertEqual(changes['dishes']['removed'], [cheeseburger_id])
+        self.assertEqual(changes['categories']['changed'], [])
+
+    def test_category_deletion_updates_children(self):
+        version = self.changes(0)['version']
+        food_id = self.food.id
+        self.food.delete()
+
+        changes = self.changes(version)
+        self.assertEqual(changes['categories']['removed'], [food_id])
+        self.assertEqual(changes['categories']['changed'],
+                         [{'id': self.burgers.id, 'name': 'Бургеры',
+                           'supercategory_id': None}])
+        self.assertEqual(changes['dishes']['changed'][0]['category_ids'], [])
+
+    def test_move_through_related_manager(self):
+        drinks = Category.objects.create(name='Напитки')
+        version = self.changes(0)['version']
+        snapshot_version = menu_snapshot.version()
+
+        self.food.subcategories.add(drinks)
+        self.assertEqual(self.changes(version)['categories']['changed'],
+                         [{'id': drinks.id, 'name': 'Напитки',
+                           'supercategory_id': self.food.id}])
+        self.assertGreater(menu_snapshot.version(), snapshot_version)
+
+    def test_log_writers_are_serialized(self):
+        with mock.patch('junto_api.menu.MenuLogLock.acquire') as acquire:
+            self.fries.save()
+        acquire.assert_called_once_with()
+        self.assertTrue(MenuLogLock.objects.filter(pk=1).exists())
+
+    def test_compaction(self):
+        old_version = self.changes(0)['version']
+        self.cheeseburger.delete()
+        recent_version = self.changes(old_version)['version']
+        self.fries.name = 'Картофель по-деревенски'
+        self.fries.save()
+
+        # Deletions within the retention period are kept
+        compact_changes(timezone.now() - datetime.timedelta(days=1))
+        self.assertFalse(self.changes(old_version)['full'])
+
+        compact_changes(timezone.now() + datetime.timedelta(days=1))
+        self.assertTrue(self.changes(old_version)['full'])
+        changes = self.changes(recent_version)
+        self.assertFalse(changes['full'])
+        self.assertEqual([dish['name'] for dish in changes['dishes']['changed']],
+                         ['Картофель по-деревенски'])
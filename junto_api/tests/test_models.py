@@ -1,3 +1,5 @@
+from io import StringIO
+from django.core.management import call_command
 from django.test import TestCase
 from junto_api.models import Category, Dish
 
@@ -39,4 +41,59 @@ class CategoryTestCase(TestCase):
         
         self.assertTrue(texas_burger in self.beef_burgers.dishes.all())
         self.assertTrue(fries in self.fastfood.dishes.all())
-        
\ No newline at end of file
+
+    def refresh(self):
+        for category in (self.fastfood, self.burgers, self.beef_burgers):
+            category.refresh_from_db()
+
+    def test_paths(self):
+        self.refresh()
+        self.assertEqual(self.fastfood.path, f'/{self.fastfood.id}/')
+        self.assertEqual(self.beef_burgers.path,
+                         f'/{self.fastfood.id}/{self.burgers.id}/'
+                         f'{self.beef_burgers.id}/')
+        self.assertEqual(self.beef_burgers.depth, 2)
+
+    def test_descendants(self):
+        self.refresh()
+        with self.assertNumQueries(1):
+            descendants = list(self.fastfood.get_descendants())
+        self.assertCountEqual(descendants, [self.burgers, self.beef_burgers])
+
+        texas_burger = Dish.objects.create(name='Техасский бургер', price=250)
+        self.beef_burgers.dishes.add(texas_burger)
+        with self.assertNumQueries(1):
+            dishes = list(self.fastfood.get_subtree_dishes())
+        self.assertEqual(dishes, [texas_burger])
+
+    def test_move(self):
+        drinks = Category.objects.create(name='Напитки')
+        self.burgers.supercategory = drinks
+        self.burgers.save()
+
+        self.refresh()
+        self.assertEqual(self.beef_burgers.path,
+                         f'/{drinks.id}/{self.burgers.id}/'
+                         f'{self.beef_burgers.id}/')
+        self.assertEqual(list(self.fastfood.get_descendants()), [])
+
+    def test_move_into_own_subtree(self):
+        self.refresh()
+        self.fastfood.supercategory = self.beef_burgers
+        with self.assertRaises(ValueError):
+            self.fastfood.save()
+
+    def test_delete(self):
+        self.burgers.delete()
+        self.beef_burgers.refresh_from_db()
+        self.assertIsNone(self.beef_burgers.supercategory)
+        self.assertEqual(self.beef_burgers.path, f'/{self.beef_burgers.id}/')
+        self.assertEqual(self.beef_burgers.depth, 0)
+
+    def test_rebuild_paths(self):
+        Category.objects.update(path='', depth=0)
+        call_command('rebuild_category_paths', stdout=StringIO())
+        self.refresh()
+        self.assertEqual(self.beef_burgers.depth, 2)
+        self.assertEqual(self.burgers.path,
+                         f'/{self.fastfood.id}/{self.burgers.id}/')
@@ -0,0 +1,713 @@
+import csv
+import datetime
+import json
+import tempfile
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
+from unittest import mock, skipUnless
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count
+from django.http import JsonResponse
+from django.test import TestCase, Client, RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from junto_api import idempotency
+from junto_api.checks import check_idempotency_store
+from junto_api.idempotency import CacheIdempotencyStore, idempotent
+from junto_api.models import (User, Dish, Restaurant, Order, DishOrder,
+                              ArchivedOrder)
+from junto_api.archive import archive_batch
+from junto_api.order_history import after_cursor, encode_cursor
+from junto_api.orders import create_order, create_orders, total_drift
+from junto_api.references import ReferenceCache
+
+
+class CreateOrderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='test',
+                                                password='SoPasswordMuchStrong')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+        cls.dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                      for i in range(30)]
+
+    def test_query_count_does_not_depend_on_order_size(self):
+        # Revenue rollups of the day are created and dish prices
+        # are cached by the first order
+        create_order(self.operator, self.restaurant,
+                     [dish.id for dish in self.dishes])
+        for size in (1, 10, 30):
+            dish_ids = [dish.id for dish in self.dishes[:size]]
+            # Savepoint, order, items, restaurant and dish rollups,
+            # savepoint release
+            with self.assertNumQueries(6):
+                order, failed = create_order(self.operator, self.restaurant,
+                                             dish_ids)
+            self.assertEqual(failed, [])
+            self.assertEqual(order.dishorder_set.count(), size)
+
+    def test_failed_dishes(self):
+        first, second = self.dishes[:2]
+        dish_ids = ['not id', first.id, 100500, str(second.id), None, first.id]
+        order, failed = create_order(self.operator, self.restaurant, dish_ids)
+
+        self.assertEqual(failed, ['not id', 100500, None])
+        items = DishOrder.objects.filter(order=order).order_by('id')
+        self.assertEqual([(item.dish_id, item.current_price, item.quantity)
+                          for item in items],
+                         [(first.id, first.price, 2),
+                          (second.id, second.price, 1)])
+
+
+class BatchOrderTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='test',
+                                 password='SoPasswordMuchStrong')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+        cls.dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                      for i in range(3)]
+
+    def setUp(self):
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json().get('access', {}).get('token')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}',
+                        'content_type': 'application/json'}
+
+    def post(self, payload) -> dict:
+        response = self.client.post('/api/orders/batch',
+                                    data=json.dumps(payload), **self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_batch(self):
+        dish_ids = [dish.id for dish in self.dishes]
+        orders = [
+            {'restaurant_id': self.restaurant.id, 'dish_ids': dish_ids},
+            {'restaurant_id': 100500, 'dish_ids': dish_ids},
+            {'restaurant_id': self.restaurant.id, 'dish_ids': 'not a list'},
+            {'restaurant_id': self.restaurant.id, 'dish_ids': [dish_ids[0],
+                                                              'not id']},
+        ]
+        results = self.post({'orders': orders})['orders']
+
+        self.assertEqual(len(results), 4)
+        self.assertEqual(results[0]['failed_dishes_ids'], [])
+        self.assertIn('error', results[1])
+        self.assertIn('error', results[2])
+        self.assertEqual(results[3]['failed_dishes_ids'], ['not id'])
+
+        first = Order.objects.get(pk=results[0]['order_id'])
+        self.assertEqual(first.operator.username, 'test')
+        self.assertIsNotNone(first.created_at)
+        self.assertCountEqual([dish.id for dish in first.dishes.all()],
+                              dish_ids)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_invalid_batch(self):
+        response = self.client.post('/api/orders/batch',
+                                    data=json.dumps({'orders': {}}),
+                                    **self.headers)
+        self.assertEqual(response.status_code, 400)
+
+
+class OrderTotalTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='test')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+        cls.first = Dish.objects.create(name='Первое', price=Decimal('100.50'))
+        cls.second = Dish.objects.create(name='Второе', price=200)
+
+    def assertTotal(self, order: Order, total: str):
+        order.refresh_from_db()
+        self.assertEqual(order.total, Decimal(total))
+
+    def test_created_orders(self):
+        dish_ids = [self.first.id, self.first.id, self.second.id]
+        order, _ = create_order(self.operator, self.restaurant, dish_ids)
+        self.assertTotal(order, '401.00')
+
+        results = create_orders(self.operator, [
+            {'restaurant_id': self.restaurant.id, 'dish_ids': dish_ids},
+            {'restaurant_id': self.restaurant.id, 'dish_ids': []},
+        ])
+        totals = Order.objects.filter(pk__in=[result['order_id']
+                                              for result in results])
+        self.assertCountEqual(totals.values_list('total', flat=True),
+                              [Decimal('401.00'), Decimal(0)])
+
+    def test_changed_items(self):
+        order, _ = create_order(self.operator, self.restaurant,
+                                [self.first.id])
+        item = DishOrder.objects.create(order=order, dish=self.second,
+                                        current_price=self.second.price)
+        self.assertTotal(order, '300.50')
+
+        item.quantity = 3
+        item.save()
+        self.assertTotal(order, '700.50')
+
+        item.delete()
+        self.assertTotal(order, '100.50')
+
+    def test_saved_order_keeps_its_total(self):
+        order, _ = create_order(self.operator, self.restaurant, [])
+        DishOrder.objects.create(order=order, dish=self.first,
+                                 current_price=self.first.price)
+        # The copy in memory still has the total of an empty order
+        order.status = Order.PAID
+        order.save()
+        self.assertTotal(order, '100.50')
+        self.assertEqual(order.status, Order.PAID)
+        self.assertEqual(total_drift(), [])
+
+    def test_bulk_changes(self):
+        third = Dish.objects.create(name='Третье', price=Decimal('10.00'))
+        order, _ = create_order(self.operator, self.restaurant,
+                                [self.first.id, third.id])
+        other, _ = create_order(self.operator, self.restaurant,
+                                [self.second.id])
+
+        DishOrder.objects.filter(order=order).update(quantity=2)
+        self.assertTotal(order, '221.00')
+        DishOrder.objects.filter(order=other).update(order=order)
+        self.assertTotal(order, '421.00')
+        self.assertTotal(other, '0')
+
+        # Items deleted by a cascade
+        third.delete()
+        self.assertTotal(order, '401.00')
+        # A savepoint, the items, their deletion and one UPDATE of totals
+        with self.assertNumQueries(5):
+            DishOrder.objects.filter(order=order).delete()
+        self.assertTotal(order, '0')
+        self.assertEqual(total_drift(), [])
+
+    def test_verify_command(self):
+        order, _ = create_order(self.operator, self.restaurant,
+                                [self.first.id])
+        # Totals changed by hand
+        Order.objects.filter(pk=order.pk).update(total=Decimal('50.00'))
+        self.assertEqual(total_drift(), [(order.id, Decimal('50.00'),
+                                          Decimal('100.50'))])
+
+        call_command('verify_order_totals', stdout=StringIO(),
+                     stderr=StringIO())
+        self.assertTotal(order, '50.00')
+        call_command('verify_order_totals', '--fix', stdout=StringIO())
+        self.assertTotal(order, '100.50')
+        self.assertEqual(total_drift(), [])
+
+
+class OrderHistoryTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='test',
+                                                password='SoPasswordMuchStrong')
+        cls.other = User.objects.create_user(username='other')
+        User.objects.create_user(username='staff', is_staff=True,
+                                 password='SoPasswordMuchStrong')
+        cls.restaurants = [Restaurant.objects.create(name=f'Ресторан {i}',
+                                                     city='Москва')
+                           for i in range(2)]
+        cls.dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                      for i in range(3)]
+        # Every second order shares its creation time with the previous one
+        now = timezone.now()
+        for i in range(10):
+            order = Order.objects.create(operator=cls.operator,
+                                         restaurant=cls.restaurants[i % 2])
+            moment = now - datetime.timedelta(minutes=i // 2)
+            Order.objects.filter(pk=order.pk).update(created_at=moment)
+            for dish in cls.dishes[:i % 3 + 1]:
+                DishOrder.objects.create(order=order, dish=dish,
+                                         current_price=dish.price)
+        Order.objects.create(operator=cls.other,
+                             restaurant=cls.restaurants[0])
+
+    def setUp(self):
+        self.client = Client()
+        self.tokens = {}
+        for username in ('test', 'staff'):
+            response = self.client.post('/api/auth',
+                                        data={'username': username,
+                                              'password': 'SoPasswordMuchStrong'})
+            self.tokens[username] = response.json()['access']['token']
+
+    def get(self, username: str = 'test', **params):
+        return self.client.get('/api/orders', params,
+                               HTTP_AUTHORIZATION=f'Bearer '
+                                                  f'{self.tokens[username]}')
+
+    def test_pages(self):
+        expected = list(Order.objects.filter(operator=self.operator)
+                                     .order_by('-created_at', '-id')
+                                     .values_list('id', flat=True))
+        ids = []
+        cursor = None
+        while True:
+            params = {'limit': 3}
+            if cursor is not None:
+                params['cursor'] = cursor
+            # Orders and items with dishes, the user is cached
+            with self.assertNumQueries(2):
+                page = self.get(**params).json()
+            ids.extend(order['id'] for order in page['orders'])
+            cursor = page['next_cursor']
+            if cursor is None:
+                break
+        self.assertEqual(ids, expected)
+
+    @skipUnless(connection.vendor == 'sqlite', 'query plan of SQLite')
+    def test_deep_pages_seek_in_the_index(self):
+        cursor = encode_cursor(Order.objects.order_by('created_at').first())
+        orders = after_cursor(Order.objects.all(), cursor)
+        sql, params = (orders.order_by('-created_at', '-id')[:51]
+                             .query.sql_with_params())
+        with connection.cursor() as db:
+            db.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            plan = ' '.join(row[-1] for row in db.fetchall())
+        # Newer orders aren't scanned to get to the cursor
+        self.assertIn('SEARCH', plan)
+        self.assertIn('order_created_idx (created_at<', plan)
+
+    def test_serialized_order(self):
+        order = (Order.objects.filter(operator=self.operator)
+                              .annotate(count=Count('dishorder'))
+                              .filter(count=3).first())
+        response = self.get(restaurant=order.restaurant_id, limit=100)
+        data = next(item for item in response.json()['orders']
+                    if item['id'] == order.id)
+        self.assertEqual(data['total'], str(order.total))
+        self.assertEqual([item['name'] for item in data['items']],
+                         [dish.name for dish in self.dishes])
+
+    def test_filters(self):
+        orders = self.get(restaurant=self.restaurants[1].id,
+                          limit=100).json()['orders']
+        self.assertEqual(len(orders), 5)
+        self.assertEqual(self.get(status=Order.PAID).json()['orders'], [])
+        since = (timezone.now() - datetime.timedelta(seconds=30)).isoformat()
+        self.assertEqual(len(self.get(since=since).json()['orders']), 2)
+
+    def test_visibility(self):
+        self.assertEqual(len(self.get(limit=100).json()['orders']), 10)
+        self.assertEqual(len(self.get('staff', limit=100).json()['orders']),
+                         11)
+
+        other = Order.objects.get(operator=self.other)
+        headers = {'HTTP_AUTHORIZATION': f'Bearer {self.tokens["test"]}'}
+        response = self.client.get(f'/api/orders/{other.id}', **headers)
+        self.assertEqual(response.status_code, 404)
+        own = Order.objects.filter(operator=self.operator).first()
+        response = self.client.get(f'/api/orders/{own.id}', **headers)
+        self.assertEqual(response.json()['id'], own.id)
+
+    def test_invalid_parameters(self):
+        for params in ({'cursor': 'garbage'}, {'limit': 0},
+                       {'status': 'paid'}, {'since': 'yesterday'}):
+            self.assertEqual(self.get(**params).status_code, 400)
+
+
+class OrderStatusTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        User.objects.create_user(username='staff', is_staff=True,
+                                 password='SoPasswordMuchStrong')
+        User.objects.create_user(username='test',
+                                 password='SoPasswordMuchStrong')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+
+    def setUp(self):
+        operator = User.objects.get(username='test')
+        self.orders = [Order.objects.create(operator=operator,
+                                            restaurant=self.restaurant)
+                       for _ in range(3)]
+        Order.objects.filter(pk=self.orders[2].pk).update(
+            status=Order.CANCELLED)
+        self.client = Client()
+
+    def post(self, payload, username: str = 'staff'):
+        response = self.client.post('/api/auth',
+                                    data={'username': username,
+                                          'password': 'SoPasswordMuchStrong'})
+        token = response.json()['access']['token']
+        return self.client.post('/api/orders/status',
+                                data=json.dumps(payload),
+                                content_type='application/json',
+                                HTTP_AUTHORIZATION=f'Bearer {token}')
+
+    def test_transition(self):
+        first, second, cancelled = self.orders
+        response = self.post({'status': Order.PAID,
+                              'order_ids': [first.id, cancelled.id, 100500]})
+        self.assertDictEqual(response.json(), {'changed': [first.id],
+                                               'rejected': [cancelled.id],
+                                               'not_found': [100500]})
+        first.refresh_from_db()
+        self.assertEqual(first.status, Order.PAID)
+        self.assertGreater(first.updated_at, second.updated_at)
+        cancelled.refresh_from_db()
+        self.assertEqual(cancelled.status, Order.CANCELLED)
+
+    def test_filter(self):
+        response = self.post({'status': Order.CANCELLED,
+                              'filter': {'restaurant': self.restaurant.id}})
+        self.assertEqual(response.json()['changed'],
+                         [order.id for order in self.orders[:2]])
+        self.assertFalse(Order.objects.exclude(status=Order.CANCELLED)
+                                      .exists())
+
+    @mock.patch('junto_api.orders.MAX_TRANSITION_SIZE', 2)
+    @mock.patch('junto_api.views.MAX_TRANSITION_SIZE', 2)
+    def test_filter_pages(self):
+        first, second, cancelled = self.orders
+        payload = {'status': Order.PAID,
+                   'filter': {'restaurant': self.restaurant.id}}
+        response = self.post(payload).json()
+        self.assertEqual((response['changed'], response['next']),
+                         ([first.id, second.id], second.id))
+
+        response = self.post(dict(payload, after=response['next'])).json()
+        self.assertEqual((response['rejected'], response['next']),
+                         ([cancelled.id], None))
+        self.assertEqual(self.post(dict(payload, after='1')).status_code, 400)
+
+    @mock.patch('junto_api.orders.MAX_TRANSITION_SIZE', 1)
+    @mock.patch('junto_api.admin.MAX_TRANSITION_SIZE', 1)
+    def test_admin_action_pages(self):
+        self.client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'SoPasswordMuchStrong'))
+        response = self.client.post(
+            '/admin/junto_api/order/',
+            {'action': 'make_paid',
+             '_selected_action': [order.id for order in self.orders]},
+            follow=True)
+        self.assertEqual([str(message) for message
+                          in response.context['messages']][0],
+                         'Изменено заказов: 2')
+        self.assertEqual(Order.objects.filter(status=Order.PAID).count(), 2)
+
+    def test_invalid_requests(self):
+        self.assertEqual(self.post({'status': Order.PAID, 'order_ids': []},
+                                   username='test').status_code, 403)
+        for payload in ({'status': 100, 'order_ids': []},
+                        {'status': [Order.PAID], 'order_ids': []},
+                        {'status': {}, 'order_ids': []},
+                        {'status': Order.PAID},
+                        {'status': Order.PAID, 'order_ids': ['1']},
+                        {'status': Order.PAID, 'filter': {}},
+                        {'status': Order.PAID, 'filter': {'city': 1}}):
+            self.assertEqual(self.post(payload).status_code, 400)
+
+
+class OrderExportTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        operator = User.objects.create_user(username='staff', is_staff=True,
+                                            password='SoPasswordMuchStrong')
+        restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                               city='Москва')
+        dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                  for i in range(2)]
+        cls.orders = [create_order(operator, restaurant, dish_ids)[0]
+                      for dish_ids in ([dishes[0].id],
+                                       [],
+                                       [dishes[0].id, dishes[1].id])]
+
+    def get(self, **params):
+        client = Client()
+        response = client.post('/api/auth',
+                               data={'username': 'staff',
+                                     'password': 'SoPasswordMuchStrong'})
+        token = response.json()['access']['token']
+        response = client.get('/api/orders/export', params,
+                              HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_ndjson(self):
+        lines = [json.loads(line) for line in self.get().splitlines()]
+        self.assertEqual([line['id'] for line in lines],
+                         [order.id for order in self.orders])
+        self.assertEqual([len(line['items']) for line in lines], [1, 0, 2])
+        self.assertEqual(lines[2]['restaurant_name'], 'Тестовый ресторан')
+        self.assertEqual(lines[2]['items'][1], {'dish_id': self.orders[2]
+                                                .dishorder_set.last().dish_id,
+                                                'dish_name': 'Блюдо 1',
+                                                'price': '101.00',
+                                                'quantity': 1})
+
+    def test_csv(self):
+        rows = list(csv.DictReader(StringIO(self.get(format='csv'))))
+        self.assertEqual([int(row['id']) for row in rows],
+                         [self.orders[0].id, self.orders[1].id,
+                          self.orders[2].id, self.orders[2].id])
+        self.assertEqual(rows[1]['dish_id'], '')
+        self.assertEqual(rows[3]['total'], '201.00')
+
+    def test_command(self):
+        since = timezone.now().isoformat()
+        order = create_order(self.orders[0].operator,
+                             self.orders[0].restaurant, [])[0]
+        with tempfile.NamedTemporaryFile('r') as output:
+            call_command('export_orders', '--since', since,
+                         '--output', output.name)
+            lines = output.read().splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines],
+                         [order.id])
+
+
+class ArchiveTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='test',
+                                                password='SoPasswordMuchStrong')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+        cls.dish = Dish.objects.create(name='Блюдо', price=100)
+
+    def setUp(self):
+        long_ago = timezone.now() - datetime.timedelta(days=365)
+        self.orders = {}
+        for name, status, created_at in (('old paid', Order.PAID, long_ago),
+                                         ('old cancelled', Order.CANCELLED,
+                                          long_ago),
+                                         ('old pending', Order.PENDING,
+                                          long_ago),
+                                         ('new paid', Order.PAID, None)):
+            order, _ = create_order(self.operator, self.restaurant,
+                                    [self.dish.id, self.dish.id])
+            Order.objects.filter(pk=order.pk).update(
+                status=status, created_at=created_at or order.created_at)
+            self.orders[name] = order.id
+
+    def test_archive(self):
+        call_command('archive_orders', '--batch-size', 1, '--limit', 1,
+                     stdout=StringIO())
+        self.assertEqual(ArchivedOrder.objects.count(), 1)
+        # The next run continues where the previous one stopped
+        call_command('archive_orders', '--batch-size', 1, stdout=StringIO())
+
+        archived = [self.orders['old paid'], self.orders['old cancelled']]
+        self.assertCountEqual(ArchivedOrder.objects.values_list('id',
+                                                                flat=True),
+                              archived)
+        self.assertFalse(Order.objects.filter(pk__in=archived).exists())
+        self.assertFalse(DishOrder.objects.filter(order_id__in=archived)
+                                          .exists())
+        self.assertEqual(Order.objects.count(), 2)
+        order = ArchivedOrder.objects.get(pk=self.orders['old paid'])
+        self.assertEqual(order.total, Decimal('200.00'))
+        self.assertEqual([(item.dish_id, item.quantity)
+                          for item in order.items.all()],
+                         [(self.dish.id, 2)])
+
+    def test_batch_query_count(self):
+        dishes = [Dish.objects.create(name=f'Блюдо {i}', price=10 + i)
+                  for i in range(20)]
+        DishOrder.objects.bulk_create(
+            DishOrder(order_id=self.orders['old paid'], dish=dish,
+                      current_price=dish.price)
+            for dish in dishes)
+        before = timezone.now() - datetime.timedelta(days=1)
+        # Savepoint, ids, orders and items with their copies, deletion
+        # of the items, orders with their (already deleted) items and
+        # deletion of the orders, savepoint release. No totals are
+        # updated, whatever the number of items
+        with self.assertNumQueries(11):
+            self.assertEqual(archive_batch(before, 10), 2)
+        self.assertEqual(ArchivedOrder.objects.get(
+            pk=self.orders['old paid']).items.count(), 21)
+
+    def test_read_archive(self):
+        call_command('archive_orders', stdout=StringIO())
+        client = Client()
+        response = client.post('/api/auth',
+                               data={'username': 'test',
+                                     'password': 'SoPasswordMuchStrong'})
+        headers = {'HTTP_AUTHORIZATION': 'Bearer '
+                                         + response.json()['access']['token']}
+
+        response = client.get('/api/orders/archive', **headers)
+        self.assertCountEqual([order['id']
+                               for order in response.json()['orders']],
+                              [self.orders['old paid'],
+                               self.orders['old cancelled']])
+        order_id = self.orders['old paid']
+        response = client.get(f'/api/orders/archive/{order_id}', **headers)
+        self.assertEqual(response.json()['items'][0]['quantity'], 2)
+        response = client.get(f'/api/orders/{order_id}', **headers)
+        self.assertEqual(response.status_code, 404)
+
+
+class ReferenceCacheTestCase(TestCase):
+    def setUp(self):
+        self.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                    city='Москва')
+        self.dish = Dish.objects.create(name='Блюдо', price=100)
+        # Stands for the cache of another worker process
+        self.cache = ReferenceCache('references')
+
+    def test_read_through(self):
+        self.assertEqual(self.cache.prices([self.dish.id, 100500]),
+                         {self.dish.id: Decimal('100.00')})
+        self.assertEqual(self.cache.restaurants([self.restaurant.id]),
+                         {self.restaurant.id: self.restaurant})
+        with self.assertNumQueries(0):
+            self.cache.prices([self.dish.id])
+            self.cache.restaurants([self.restaurant.id])
+        # Made up ids aren't cached
+        with self.assertNumQueries(1):
+            self.assertEqual(self.cache.prices([100500]), {})
+
+    def test_invalidation(self):
+        self.cache.prices([self.dish.id])
+        self.dish.price = 150
+        self.dish.save()
+        self.assertEqual(self.cache.prices([self.dish.id]),
+                         {self.dish.id: Decimal('150.00')})
+
+        self.dish.delete()
+        self.assertEqual(self.cache.prices([self.dish.id]), {})
+
+    def test_bulk_update(self):
+        self.cache.prices([self.dish.id])
+        self.cache.restaurants([self.restaurant.id])
+        Dish.objects.filter(pk=self.dish.pk).update(price=150)
+        self.assertEqual(self.cache.prices([self.dish.id]),
+                         {self.dish.id: Decimal('150.00')})
+
+        Restaurant.objects.filter(pk=self.restaurant.pk).update(city='Казань')
+        self.assertEqual(
+            self.cache.restaurants([self.restaurant.id])[
+                self.restaurant.id].city,
+            'Казань')
+
+    def test_expiration(self):
+        cache = ReferenceCache('references', ttl=0)
+        cache.prices([self.dish.id])
+        # Changes made outside of Django are picked up after the TTL
+        with connection.cursor() as db:
+            db.execute(f'UPDATE {Dish._meta.db_table} SET price = 150')
+        self.assertEqual(cache.prices([self.dish.id]),
+                         {self.dish.id: Decimal('150.00')})
+
+
+class IdempotencyTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='test',
+                                                password='SoPasswordMuchStrong')
+        cls.restaurant = Restaurant.objects.create(name='Тестовый ресторан',
+                                                   city='Москва')
+        cls.dish = Dish.objects.create(name='Чизбургер', price=50)
+
+    def setUp(self):
+        idempotency._store = None
+        cache.clear()
+        self.client = Client()
+        response = self.client.post('/api/auth',
+                                    data={'username': 'test',
+                                          'password': 'SoPasswordMuchStrong'})
+        access_token = response.json().get('access', {}).get('token')
+        self.headers = {'HTTP_AUTHORIZATION': f'Bearer {access_token}',
+                        'content_type': 'application/json'}
+
+    def post_order(self, key: str, dish_ids: list):
+        payload = {'restaurant_id': self.restaurant.id, 'dish_ids': dish_ids}
+        return self.client.post('/api/order', data=json.dumps(payload),
+                                HTTP_IDEMPOTENCY_KEY=key, **self.headers)
+
+    def check_retry(self):
+        first = self.post_order('order-1', [self.dish.id])
+        # The order tables aren't touched and the user is cached
+        with self.assertNumQueries(0):
+            retry = self.post_order('order-1', [self.dish.id])
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+
+        response = self.post_order('order-1', [self.dish.id, self.dish.id])
+        self.assertEqual(response.status_code, 422)
+
+        self.post_order('order-2', [self.dish.id])
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_retry(self):
+        self.check_retry()
+
+    @override_settings(IDEMPOTENCY_STORE='cache')
+    def test_retry_with_cache_store(self):
+        self.check_retry()
+
+    def test_concurrent_requests_are_collapsed(self):
+        calls = []
+
+        @idempotent
+        def view(request):
+            calls.append(request)
+            time.sleep(0.1)
+            return JsonResponse({'calls': len(calls)})
+
+        def request():
+            request = RequestFactory().post('/api/order', data='{}',
+                                            content_type='application/json',
+                                            HTTP_IDEMPOTENCY_KEY='key')
+            request.user = self.operator
+            responses.append(view(request))
+
+        responses = []
+        threads = [threading.Thread(target=request) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({response.content for response in responses},
+                         {b'{"calls": 1}'})
+
+    def test_lock_of_the_next_holder_is_kept(self):
+        store = CacheIdempotencyStore(ttl=60, lock_ttl=120)
+        with store.lock('key', timeout=1):
+            # The lock expired and was taken by another request
+            cache.set('idempotency:key:lock', 'next holder')
+        self.assertEqual(cache.get('idempotency:key:lock'), 'next holder')
+
+    def test_local_stores_are_refused(self):
+        for store in ('local', 'cache'):
+            idempotency._store = None
+            with self.settings(IDEMPOTENCY_STORE=store,
+                               IDEMPOTENCY_REQUIRE_SHARED=True):
+                with self.assertRaises(ImproperlyConfigured):
+                    idempotency.get_store()
+                self.assertEqual([error.id for error
+                                  in check_idempotency_store(None)],
+                                 ['junto_api.E003'])
+
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches = {'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': directory.name,
+        }}
+        idempotency._store = None
+        with self.settings(IDEMPOTENCY_STORE='cache',
+                           IDEMPOTENCY_REQUIRE_SHARED=True, CACHES=caches):
+            self.assertTrue(idempotency.get_store().shared)
+        idempotency._store = None
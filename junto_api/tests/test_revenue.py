@@ -0,0 +1,108 @@
+from decimal import Decimal
+from io import StringIO
+from django.core.management import call_command
+from django.test import TestCase, Client
+from django.utils import timezone
+from junto_api.models import (User, Dish, Restaurant, Order, DishRevenue,
+                              RestaurantRevenue)
+from junto_api.archive import archive_batch
+from junto_api.orders import create_order, create_orders, transition_orders
+
+
+def rollups() -> tuple:
+    return (sorted(RestaurantRevenue.objects.values_list(
+                'restaurant_id', 'date', 'status', 'orders', 'items',
+                'revenue')),
+            sorted(DishRevenue.objects.values_list(
+                'dish_id', 'date', 'status', 'orders', 'items', 'revenue')))
+
+
+class RevenueTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.operator = User.objects.create_user(username='staff',
+                                                is_staff=True,
+                                                password='SoPasswordMuchStrong')
+        cls.restaurants = [Restaurant.objects.create(name=f'Ресторан {i}',
+                                                     city='Москва')
+                           for i in range(2)]
+        cls.dishes = [Dish.objects.create(name=f'Блюдо {i}', price=100 + i)
+                      for i in range(3)]
+
+    def setUp(self):
+        first, second, third = (dish.id for dish in self.dishes)
+        self.order, _ = create_order(self.operator, self.restaurants[0],
+                                     [first, first, second])
+        create_orders(self.operator, [
+            {'restaurant_id': self.restaurants[0].id, 'dish_ids': [first]},
+            {'restaurant_id': self.restaurants[1].id,
+             'dish_ids': [second, third]},
+        ])
+
+    def assertConsistent(self):
+        """Incremental rollups are the same as the rebuilt ones"""
+        incremental = rollups()
+        call_command('rebuild_revenue', stdout=StringIO())
+        self.assertEqual(incremental, rollups())
+
+    def test_created_orders(self):
+        today = timezone.localdate()
+        row = RestaurantRevenue.objects.get(restaurant=self.restaurants[0])
+        self.assertEqual((row.date, row.status, row.orders, row.items,
+                          row.revenue),
+                         (today, Order.PENDING, 2, 4, Decimal('401.00')))
+        row = DishRevenue.objects.get(dish=self.dishes[0])
+        self.assertEqual((row.orders, row.items, row.revenue),
+                         (2, 3, Decimal('300.00')))
+        self.assertConsistent()
+
+    def test_transition(self):
+        transition_orders(Order.objects.filter(pk=self.order.pk), Order.PAID)
+        paid = RestaurantRevenue.objects.get(status=Order.PAID)
+        self.assertEqual((paid.orders, paid.items, paid.revenue),
+                         (1, 3, Decimal('301.00')))
+        pending = RestaurantRevenue.objects.get(
+            restaurant=self.restaurants[0], status=Order.PENDING)
+        self.assertEqual((pending.orders, pending.items, pending.revenue),
+                         (1, 1, Decimal('100.00')))
+        self.assertConsistent()
+
+        transition_orders(Order.objects.all(), Order.CANCELLED)
+        self.assertConsistent()
+
+        # Archived orders stay in the rollups
+        archive_batch(timezone.now(), batch_size=10)
+        self.assertConsistent()
+
+    def test_report(self):
+        client = Client()
+        response = client.post('/api/auth',
+                               data={'username': 'staff',
+                                     'password': 'SoPasswordMuchStrong'})
+        headers = {'HTTP_AUTHORIZATION': 'Bearer '
+                                         + response.json()['access']['token']}
+        today = timezone.localdate().isoformat()
+
+        response = client.get('/api/revenue', {'since': today}, **headers)
+        self.assertEqual([row['restaurant_id']
+                          for row in response.json()['revenue']],
+                         [restaurant.id for restaurant in self.restaurants])
+        response = client.get('/api/revenue', {'by': 'dish',
+                                               'id': self.dishes[2].id},
+                              **headers)
+        self.assertEqual(response.json()['revenue'],
+                         [{'date': today, 'dish_id': self.dishes[2].id,
+                           'status': Order.PENDING, 'orders': 1, 'items': 1,
+                           'revenue': '102.00'}])
+        for params in ({'by': 'operator'}, {'since': 'today'},
+                       {'status': 'paid'}):
+            response = client.get('/api/revenue', params, **headers)
+            self.assertEqual(response.status_code, 400)
+
+    def test_admin_status_is_read_only(self):
+        client = Client()
+        client.force_login(User.objects.create_superuser(
+            'admin', 'admin@example.com', 'SoPasswordMuchStrong'))
+        response = client.get(f'/admin/junto_api/order/{self.order.id}/change/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('name="status"', response.content.decode())
@@ -0,0 +1,115 @@
+"""
+Purge of refresh tokens that can't be used anymore.
+
+Every login and refresh adds a refresh token, while revoked and expired
+ones used to stay forever. Stale tokens are deleted in small batches,
+each of them a single short DELETE by primary keys, so the purge runs
+next to the live traffic without holding long locks. It runs with the
+purge_refresh_tokens command, either once, e.g. from cron, or with
+--interval as a dedicated process, see the Procfile. Web workers never
+run it. Every run is recorded in the database, so that the stats are
+the same whichever process reports them. Expired entries of the
+denylist of access tokens are purged along the way.
+"""
+import datetime
+import time
+from typing import Iterator, Optional, Tuple
+
+from django.conf import settings
+from django.db.models import Count, F, Max, Q, QuerySet, Sum
+from django.utils import timezone
+
+from .auth import denylist
+from .models import RefreshToken, TokenPurgeRun
+
+
+def stale_tokens(now: datetime.datetime) -> QuerySet:
+    """Revoked and expired tokens, and tokens of previous generations"""
+    return RefreshToken.objects.filter(
+        Q(revoked=True)
+        | Q(expires_at__lte=now)
+        | Q(generation__lt=F('user__token_family__generation')))
+
+
+def purge_batch(now: datetime.datetime, batch_size: int) -> int:
+    """Delete up to `batch_size` stale tokens"""
+    ids = list(stale_tokens(now).order_by('id')
+                                .values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+    deleted, _ = RefreshToken.objects.filter(pk__in=ids).delete()
+    return deleted
+
+
+def purge_tokens(now: datetime.datetime, batch_size: int = 1000,
+                 pause: float = 0,
+                 limit: Optional[int] = None) -> Iterator[int]:
+    """
+    Delete stale tokens in batches, yielding the number of tokens
+    deleted by every batch.
+
+    `pause` seconds between batches leave room for the other queries,
+    `limit` caps the number of tokens deleted by a single run.
+    """
+    deleted = 0
+    while limit is None or deleted < limit:
+        size = batch_size if limit is None else min(batch_size,
+                                                   limit - deleted)
+        count = purge_batch(now, size)
+        if not count:
+            break
+        deleted += count
+        yield count
+        if pause:
+            time.sleep(pause)
+
+
+def purge_denylist(now: datetime.datetime) -> int:
+    """
+    Delete denylist entries older than the access token lifetime.
+    Tokens issued before the denial have expired by then, the ones
+    issued since carry the active claim of the user.
+    """
+    return denylist.prune(now - datetime.timedelta(
+        seconds=settings.ACCESS_TOKEN_EXPIRATION_TIME))
+
+
+def record_run(started_at: datetime.datetime, deleted: int,
+               seconds: float) -> TokenPurgeRun:
+    return TokenPurgeRun.objects.create(started_at=started_at,
+                                        deleted=deleted, seconds=seconds)
+
+
+def purge_stats() -> dict:
+    """Totals of all recorded runs and the numbers of the last one"""
+    totals = TokenPurgeRun.objects.aggregate(runs=Count('id'),
+                                             deleted=Sum('deleted'),
+                                             seconds=Sum('seconds'))
+    last = TokenPurgeRun.objects.order_by('-started_at', '-id').first()
+    return {
+        'runs': totals['runs'],
+        'deleted': totals['deleted'] or 0,
+        'seconds': round(totals['seconds'] or 0, 3),
+        'last_deleted': last.deleted if last else 0,
+        'last_seconds': round(last.seconds, 3) if last else 0,
+        'last_run_at': last.started_at.isoformat() if last else None,
+    }
+
+
+def purge(batch_size: Optional[int] = None, pause: Optional[float] = None,
+          limit: Optional[int] = None) -> Tuple[int, float]:
+    """
+    Delete all stale tokens and record the run, returns the number
+    of deleted tokens and the time it took in seconds
+    """
+    if batch_size is None:
+        batch_size = settings.TOKEN_PURGE_BATCH_SIZE
+    if pause is None:
+        pause = settings.TOKEN_PURGE_PAUSE
+    now = timezone.now()
+    started = time.monotonic()
+    deleted = sum(purge_tokens(now, batch_size, pause, limit))
+    purge_denylist(now)
+    seconds = time.monotonic() - started
+    record_run(now, deleted, seconds)
+    return deleted, seconds
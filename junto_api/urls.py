@@ -5,7 +5,18 @@ from . import views
 urlpatterns = [
     url(r'auth/refresh', views.refresh, name='refresh'),
     url(r'auth', views.get_token, name='auth'),
+    url(r'menu/changes', views.menu_changes, name='menu_changes'),
     url(r'menu', views.menu, name='menu'),
+    url(r'orders/batch', views.new_orders_batch, name='orders_batch'),
+    url(r'orders/status', views.orders_status, name='orders_status'),
+    url(r'orders/export', views.orders_export, name='orders_export'),
+    url(r'orders/archive/(?P<order_id>\d+)', views.archived_order_detail,
+        name='archived_order_detail'),
+    url(r'orders/archive', views.archived_orders, name='archived_orders'),
+    url(r'orders/(?P<order_id>\d+)', views.order_detail, name='order_detail'),
+    url(r'orders', views.orders, name='orders'),
     url(r'order', views.new_order),
-    url(r'restaurants', views.restaurants, name='restaurants')
+    url(r'restaurants', views.restaurants, name='restaurants'),
+    url(r'revenue', views.revenue, name='revenue'),
+    url(r'stats/caches', views.cache_stats, name='cache_stats')
 ]
@@ -1,42 +1,99 @@
 import jwt
-from django.http import HttpResponse, JsonResponse, HttpRequest
+from django.http import (HttpResponse, JsonResponse, HttpRequest,
+                         StreamingHttpResponse)
 from django.contrib.auth import authenticate
 from django.contrib.auth.models import User
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
 from django.conf import settings
-from .models import RefreshToken, Order, Restaurant, Dish, DishOrder
+from .models import (RefreshToken, Restaurant, Dish, Category, Order,
+                     TokenFamily)
 from typing import Union
-from .auth import token_required, generate_tokens
-from .models import Category
+from .auth import (token_required, claims_required, generate_tokens,
+                   token_cache, user_cache)
+from .exports import export, FORMATS
+from .fields import parse_fields
+from .idempotency import idempotent
+from .menu import (menu_snapshot, build_menu, build_changes,
+                   CATEGORY_FIELDS)
+from .order_history import (archived_orders_with_items, list_orders,
+                            orders_with_items, parse_filters,
+                            DEFAULT_PAGE_SIZE, FILTERS, MAX_PAGE_SIZE)
+from .orders import (create_order, create_orders, transition_orders,
+                     _to_int, MAX_BATCH_SIZE, MAX_TRANSITION_SIZE)
+from .references import references
+from .restaurants import restaurants_snapshot, build_restaurants
+from .revenue import report
+from .snapshots import snapshot_response
+from .token_purge import purge_stats
+from django.core.exceptions import ObjectDoesNotExist
+from django.db import transaction
+from django.db.models import Q, QuerySet
 import json
 
 
-@token_required
-def menu(request: HttpRequest) -> JsonResponse:
-    top_level_categories = Category.objects.filter(supercategory=None)
-    
-    return JsonResponse({
-        'categories': {
-            'count': len(top_level_categories),
-            'items': [cat.serialize() for cat in top_level_categories]
-        }
-    })
+@claims_required
+def menu(request: HttpRequest) -> HttpResponse:
+    root_id = request.GET.get('root')
+    max_depth = request.GET.get('depth')
+    fields = request.GET.get('fields')
+    if root_id is None and max_depth is None and fields is None:
+        return snapshot_response(request, menu_snapshot.get())
 
+    try:
+        category_fields, nested_fields = parse_fields(
+            fields, CATEGORY_FIELDS, nested={'dishes': Dish.FIELDS})
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
 
-@token_required
-def restaurants(request: HttpRequest) -> JsonResponse:
-    restaurants = Restaurant.objects.all()
-    return JsonResponse({
-        'restaurants': {
-            'count': len(restaurants),
-            'items': [restaurant.serialize() for restaurant in restaurants]
-        }
-    })
+    try:
+        root = None
+        if root_id is not None:
+            root = Category.objects.get(pk=int(root_id))
+        if max_depth is not None:
+            max_depth = int(max_depth)
+            if max_depth < 1:
+                raise ValueError('depth should be positive')
+    except ValueError:
+        return JsonResponse({'error': 'root and depth should be '
+                                      'positive integers'},
+                            status=400)
+    except Category.DoesNotExist:
+        return JsonResponse({'error': f'Category with id {root_id} '
+                                      'does not exist'},
+                            status=404)
+
+    return JsonResponse(build_menu(root, max_depth,
+                                   category_fields=category_fields,
+                                   dish_fields=nested_fields['dishes']))
+
+
+@claims_required
+def menu_changes(request: HttpRequest) -> JsonResponse:
+    try:
+        since = int(request.GET.get('since', 0))
+    except ValueError:
+        return JsonResponse({'error': 'since should be an integer'},
+                            status=400)
+    return JsonResponse(build_changes(since))
+
+
+@claims_required
+def restaurants(request: HttpRequest) -> HttpResponse:
+    fields = request.GET.get('fields')
+    if fields is None:
+        return snapshot_response(request, restaurants_snapshot.get())
+
+    try:
+        fields, _ = parse_fields(fields, Restaurant.FIELDS)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(build_restaurants(fields))
 
 @token_required
 @csrf_exempt
 @require_POST
+@idempotent
 def new_order(request: HttpRequest) -> JsonResponse:
     try:
         order_data = json.loads(request.body.decode())
@@ -47,28 +104,15 @@ def new_order(request: HttpRequest) -> JsonResponse:
                                 status=400)
         
         restaurant_id = order_data.get('restaurant_id')
-        try:
-            restaurant = Restaurant.objects.get(pk=restaurant_id)
-        except Restaurant.DoesNotExist:
+        # Ids given as strings are accepted, same as by create_orders()
+        pk = _to_int(restaurant_id)
+        restaurant = references.restaurants([pk]).get(pk)
+        if restaurant is None:
             return JsonResponse({'error': f'Restaurant with id {restaurant_id}'
                                           'does not exist'},
                                 status=400)
         
-        order = Order.objects.create(restaurant=restaurant,
-                                     operator=request.user)
-        order.save()
-        
-        failed = []
-        
-        for dish_id in dish_ids:
-            try:
-                dish = Dish.objects.get(pk=int(dish_id))
-                relation = DishOrder.objects.create(dish=dish,
-                                                    order=order,
-                                                    current_price=dish.price)
-                relation.save()
-            except (Dish.DoesNotExist, ValueError):
-                failed.append(dish_id)
+        order, failed = create_order(request.user, restaurant, dish_ids)
         
         return JsonResponse({
             'order_id': order.id,
@@ -78,7 +122,205 @@ def new_order(request: HttpRequest) -> JsonResponse:
     except json.JSONDecodeError:
         return JsonResponse({'error': 'Invalid data format'},
                             status=400)
+
+
+@token_required
+@csrf_exempt
+@require_POST
+@idempotent
+def new_orders_batch(request: HttpRequest) -> JsonResponse:
+    try:
+        orders = json.loads(request.body.decode()).get('orders')
+    except (json.JSONDecodeError, AttributeError):
+        return JsonResponse({'error': 'Invalid data format'},
+                            status=400)
+    
+    if not isinstance(orders, list):
+        return JsonResponse({'error': 'orders should be a list'},
+                            status=400)
+    if len(orders) > MAX_BATCH_SIZE:
+        return JsonResponse({'error': f'No more than {MAX_BATCH_SIZE} '
+                                      'orders are allowed in a batch'},
+                            status=400)
+    
+    return JsonResponse({'orders': create_orders(request.user, orders)})
+
+
+@token_required
+@csrf_exempt
+@require_POST
+@idempotent
+def orders_status(request: HttpRequest) -> JsonResponse:
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can change order status'},
+                            status=403)
+    try:
+        data = json.loads(request.body.decode())
+        status = data['status']
+        order_ids = data.get('order_ids')
+        filters = data.get('filter')
+        after = data.get('after', 0)
+    except (json.JSONDecodeError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error': 'Invalid data format'},
+                            status=400)
+    
+    if not isinstance(status, int) or status not in Order.TRANSITIONS:
+        return JsonResponse({'error': f'Unknown status {status}'},
+                            status=400)
+    if (order_ids is None) == (filters is None):
+        return JsonResponse({'error': 'Either order_ids or filter '
+                                      'should be given'},
+                            status=400)
+    
+    if order_ids is not None:
+        if (not isinstance(order_ids, list)
+                or not all(isinstance(pk, int) for pk in order_ids)):
+            return JsonResponse({'error': 'order_ids should be a list '
+                                          'of integers'},
+                                status=400)
+        if len(order_ids) > MAX_TRANSITION_SIZE:
+            return JsonResponse({'error': f'No more than '
+                                          f'{MAX_TRANSITION_SIZE} orders '
+                                          f'are allowed at once'},
+                                status=400)
+        orders = Order.objects.filter(pk__in=order_ids)
+    else:
+        try:
+            if not isinstance(filters, dict) or not filters:
+                raise ValueError('filter should be a non-empty object')
+            unknown = set(filters) - set(FILTERS)
+            if unknown:
+                raise ValueError(f'Unknown filter {unknown.pop()}')
+            if not isinstance(after, int):
+                raise ValueError('after should be an integer')
+            # Matching orders are handled in pages of MAX_TRANSITION_SIZE,
+            # the next page starts after the last order of this one
+            orders = Order.objects.filter(
+                parse_filters({key: str(value)
+                               for key, value in filters.items()}),
+                pk__gt=after)
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+    
+    changed, rejected = transition_orders(orders, status)
+    found = set(changed) | set(rejected)
+    response = {
+        'changed': changed,
+        'rejected': rejected,
+        'not_found': [pk for pk in order_ids or [] if pk not in found]
+    }
+    if filters is not None:
+        response['next'] = (max(found) if len(found) == MAX_TRANSITION_SIZE
+                            else None)
+    return JsonResponse(response)
+
+
+@token_required
+@require_GET
+def orders_export(request: HttpRequest) -> HttpResponse:
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can export orders'},
+                            status=403)
+    format = request.GET.get('format', 'ndjson')
+    if format not in FORMATS:
+        return JsonResponse({'error': f'format should be one of '
+                                      f'{", ".join(FORMATS)}'},
+                            status=400)
+    try:
+        filters = parse_filters(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
     
+    response = StreamingHttpResponse(export(filters, format),
+                                     content_type=FORMATS[format])
+    response['Content-Disposition'] = (f'attachment; '
+                                       f'filename="orders.{format}"')
+    return response
+
+
+@token_required
+@require_GET
+def revenue(request: HttpRequest) -> JsonResponse:
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can see revenue'},
+                            status=403)
+    try:
+        return JsonResponse({'revenue': report(request.GET)})
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+
+def _visible_orders(user: User) -> Q:
+    """Operators only see their own orders, staff sees everything"""
+    return Q() if user.is_staff else Q(operator_id=user.id)
+
+
+@token_required
+@require_GET
+def cache_stats(request: HttpRequest) -> JsonResponse:
+    """
+    Cache counters of the current worker process, and the refresh token
+    purge runs recorded by the purge process
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'error': 'Only staff can see cache stats'},
+                            status=403)
+    return JsonResponse({'users': user_cache.stats(),
+                         'tokens': token_cache.stats(),
+                         'token_purge': purge_stats()})
+
+
+def _orders_page(request: HttpRequest, orders: QuerySet) -> JsonResponse:
+    try:
+        filters = parse_filters(request.GET)
+        limit = int(request.GET.get('limit', DEFAULT_PAGE_SIZE))
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit should be between 1 and {MAX_PAGE_SIZE}')
+        page = list_orders(filters & _visible_orders(request.user),
+                           cursor=request.GET.get('cursor'), limit=limit,
+                           orders=orders)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(page)
+
+
+def _order(request: HttpRequest, orders: QuerySet,
+           order_id: str) -> JsonResponse:
+    try:
+        order = (orders.filter(_visible_orders(request.user))
+                       .get(pk=int(order_id)))
+    except ObjectDoesNotExist:
+        return JsonResponse({'error': f'Order with id {order_id} '
+                                      'does not exist'},
+                            status=404)
+    return JsonResponse(order.serialize())
+
+
+@token_required
+@require_GET
+def orders(request: HttpRequest) -> JsonResponse:
+    return _orders_page(request, orders_with_items())
+
+
+@token_required
+@require_GET
+def order_detail(request: HttpRequest, order_id: str) -> JsonResponse:
+    return _order(request, orders_with_items(), order_id)
+
+
+@token_required
+@require_GET
+def archived_orders(request: HttpRequest) -> JsonResponse:
+    return _orders_page(request, archived_orders_with_items())
+
+
+@token_required
+@require_GET
+def archived_order_detail(request: HttpRequest,
+                          order_id: str) -> JsonResponse:
+    return _order(request, archived_orders_with_items(), order_id)
+
+
 @csrf_exempt
 @require_POST
 def get_token(request: HttpRequest) -> Union[JsonResponse, HttpResponse]:
@@ -87,11 +329,10 @@ def get_token(request: HttpRequest) -> Union[JsonResponse, HttpResponse]:
     user = authenticate(username=username, password=password)
     
     if user is not None:
-        for refresh_token in user.refresh_tokens.all():
-            refresh_token.revoked = True
-            refresh_token.save()
-
-        tokens = generate_tokens(user)
+        with transaction.atomic():
+            # Revokes all previous refresh tokens
+            generation = TokenFamily.revoke_all(user)
+            tokens = generate_tokens(user, generation)
         return JsonResponse(tokens)
     
     else:
@@ -109,24 +350,29 @@ def refresh(request: HttpRequest) -> JsonResponse:
             if payload.get('type') != 'refresh':
                 raise ValueError('Incorrect token type')
             user_id = payload.get('user_id')
-            user = User.objects.get(id=user_id)
-            token_object = (RefreshToken.objects.all()
-                                                .filter(value=token)
-                                                .first())
+            # Tokens issued before generations were introduced
+            # belong to the first one
+            generation = payload.get('generation', 0)
+            token_object = (RefreshToken.lookup(token)
+                                        .select_related('user')
+                                        .filter(user_id=user_id)
+                                        .first())
+            
+            with transaction.atomic():
+                # Moving to the next generation revokes all previous
+                # refresh tokens. It fails if the token has already been
+                # revoked, or used by a concurrent request
+                if (token_object is not None and not token_object.revoked
+                        and TokenFamily.rotate(user_id, generation)):
+                    tokens = generate_tokens(token_object.user,
+                                             generation + 1)
+                    return JsonResponse(tokens)
             
-            if token_object in user.refresh_tokens.all() and not token_object.revoked:
-                # Revoke all previous refresh tokens
-                for token in user.refresh_tokens.all():
-                    token.revoked = True
-                    token.save()
-                tokens = generate_tokens(user)
-                return JsonResponse(tokens)
-            else:
-                return JsonResponse({'error': 'Refresh token is revoked '
-                                              'or invalid. Please obtain'
-                                              'a new pair of tokens via '
-                                              'username/password authentication'},
-                                    status=403)
+            return JsonResponse({'error': 'Refresh token is revoked '
+                                          'or invalid. Please obtain'
+                                          'a new pair of tokens via '
+                                          'username/password authentication'},
+                                status=403)
         
         except jwt.ExpiredSignatureError:
             return JsonResponse({'error': 'Refresh token expired. '
@@ -143,10 +389,3 @@ def refresh(request: HttpRequest) -> JsonResponse:
                                           'Please make sure that you are '
                                           'sending the refresh token'},
                                 status=401)
-        
-        except User.DoesNotExist:
-            return JsonResponse({'error': 'User corresponding to the token '
-                                          'does not exist. Please contact '
-                                          'the administrator to resolve '
-                                          'this issue'},
-                                status=401)